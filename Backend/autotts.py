@@ -7,7 +7,11 @@ import os
 import re
 import requests
 import time
-from typing import List, Tuple, Optional
+import queue
+import threading
+from typing import Iterable, Iterator, List, Tuple, Optional
+from utils import gradio_lock
+from metrics import timed
 
 # client pointing to local Gradio server
 GRADIO_URL = "http://127.0.0.1:8080"
@@ -45,6 +49,54 @@ def split_text_into_chunks(text: str, max_chars: int = 300) -> List[str]:
         chunks.append(current.strip())
     return chunks
 
+_DONE = object()
+
+
+def coalesce_sentences(sentences: Iterable[str], max_chars: int = 300) -> Iterator[str]:
+    """
+    Turns a stream of sentences into TTS chunks as they arrive. Sentences
+    are read on a separate thread; every chunk takes whatever has arrived
+    by the time the previous one is synthesized, up to max_chars. So the
+    first sentence is spoken right away, and a slow synthesizer gets fewer,
+    larger chunks.
+    """
+    pending = queue.Queue()
+
+    def produce():
+        try:
+            for sentence in sentences:
+                for piece in split_text_into_chunks(sentence, max_chars):
+                    pending.put(piece)
+        except Exception as e:
+            pending.put(e)
+            return
+        pending.put(_DONE)
+
+    threading.Thread(target=produce, name="tts-sentences", daemon=True).start()
+
+    carry = None
+    while True:
+        item = carry if carry is not None else pending.get()
+        carry = None
+        if item is _DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+
+        chunk = item
+        while True:
+            try:
+                following = pending.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(following, str) and len(chunk) + 1 + len(following) <= max_chars:
+                chunk = f"{chunk} {following}"
+            else:
+                carry = following
+                break
+        yield chunk
+
+
 def _normalize_audio(a: np.ndarray) -> np.ndarray:
     """Simple peak-normalize if abs peak > 1.0."""
     peak = np.max(np.abs(a)) if a.size else 1.0
@@ -103,7 +155,13 @@ def _parse_gradio_result(result) -> Tuple[int, np.ndarray]:
 def shutdown_server():
     """Shutdown the Gradio server after audio generation is complete"""
     print("🎯 Audio generation complete. Initiating server shutdown...")
-    
+
+    # Not while another job is mid-request
+    with gradio_lock(GRADIO_URL):
+        _send_shutdown()
+
+
+def _send_shutdown():
     try:
         # Send shutdown request to Gradio server
         response = requests.post(f"{GRADIO_URL}/shutdown", timeout=10)
@@ -119,10 +177,13 @@ def shutdown_server():
     # Small delay to ensure the message is sent before process termination
     time.sleep(1)
 
+@timed("tts_hf")
 def tts_hf(
     script: str,
     output_file: Optional[str] = None,
-    audio_prompt: Optional[str] = None
+    audio_prompt: Optional[str] = None,
+    cancel_token=None,
+    on_progress=None
 ) -> str:
     """
     Generate TTS by calling your local Gradio API (/generate_tts_audio).
@@ -133,6 +194,8 @@ def tts_hf(
         script: text to synthesize.
         output_file: optional output filepath. If omitted, a random file in downloads/ is used.
         audio_prompt: optional URL or local path for reference audio.
+        cancel_token: optional CancelToken, checked before every chunk.
+        on_progress: optional callback, called as on_progress(done, total) after every chunk.
 
     Returns:
         Path to saved WAV file as string.
@@ -144,6 +207,31 @@ def tts_hf(
     if not chunks:
         raise RuntimeError("Failed to split script into chunks.")
 
+    return _tts_hf(chunks, len(chunks), output_file, audio_prompt, cancel_token, on_progress)
+
+
+@timed("tts_hf")
+def tts_hf_stream(
+    sentences: Iterable[str],
+    output_file: Optional[str] = None,
+    audio_prompt: Optional[str] = None,
+    cancel_token=None,
+    on_progress=None
+) -> str:
+    """
+    Like tts_hf, but synthesizes a script that is still being written,
+    e.g. gpt.stream_script. Synthesis starts with the first sentence and
+    every later chunk holds the sentences that arrived in the meantime.
+    The total number of chunks isn't known upfront, so on_progress is
+    called as on_progress(done, 0).
+    """
+    return _tts_hf(coalesce_sentences(sentences, max_chars=300), 0, output_file, audio_prompt,
+                   cancel_token, on_progress)
+
+
+def _tts_hf(chunks: Iterable[str], total: int, output_file: Optional[str], audio_prompt: Optional[str],
+            cancel_token, on_progress) -> str:
+
     # Prepare ref audio handle if provided
     ref_handle = None
     if audio_prompt:
@@ -161,17 +249,22 @@ def tts_hf(
 
     try:
         for i, chunk in enumerate(chunks, start=1):
-            print(f"[tts_hf] Generating chunk {i}/{len(chunks)} ({len(chunk)} chars)...")
-            result = client.predict(
-                text_input=chunk,
-                audio_prompt_path_input=ref_handle,
-                exaggeration_input=0.5,
-                temperature_input=0.8,
-                seed_num_input=0,
-                language_id="en",
-                cfgw_input=0.5,
-                api_name="/generate_tts_audio"
-            )
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            print(f"[tts_hf] Generating chunk {i}/{total or '?'} ({len(chunk)} chars)...")
+            # Held per chunk, not per script: a script still being streamed
+            # from the LLM mustn't keep other jobs off the server meanwhile
+            with gradio_lock(GRADIO_URL):
+                result = client.predict(
+                    text_input=chunk,
+                    audio_prompt_path_input=ref_handle,
+                    exaggeration_input=0.5,
+                    temperature_input=0.8,
+                    seed_num_input=0,
+                    language_id="en",
+                    cfgw_input=0.5,
+                    api_name="/generate_tts_audio"
+                )
 
             # parse result robustly
             sr, wav_np = _parse_gradio_result(result)
@@ -189,6 +282,11 @@ def tts_hf(
                 raise RuntimeError(f"Sample rate mismatch: {sr_final} != {sr}")
 
             parts.append(wav_np)
+            if on_progress is not None:
+                on_progress(i, total)
+
+        if not parts:
+            raise ValueError("Script is empty.")
 
         # concatenate parts
         full = np.concatenate(parts, axis=0)
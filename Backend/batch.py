@@ -0,0 +1,252 @@
+"""
+Headless batch runner. Renders every job of a JSONL manifest through the
+same stage graph as the web server, without Flask or the job queue.
+
+Each manifest line is a JSON object:
+
+    {"subject": "Black holes", "contentType": "stock", "voice": "Michel.mp3",
+     "song": "shadow.mp3", "count": 2}
+
+Only `subject` is required. Optional keys: contentType ("stock" or
+"generative"), voice and song (file names in ../voice and ../Songs),
+count (shorts to render, default 1), aiModel, paragraphNumber,
+subtitlesPosition, color, customPrompt and automateYoutubeUpload.
+
+Usage (from the Backend directory, like main.py):
+    python batch.py nightly.jsonl --concurrency 2 --output nightly.results.jsonl
+
+One result line is appended per short as soon as it finishes, with the
+video path and the seconds spent in every stage. Running the same batch
+again with the same --batch-id and output skips the shorts it already
+finished and resumes those that failed halfway.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+from uuid import uuid4
+from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from termcolor import colored
+from dotenv import load_dotenv
+from moviepy.config import change_settings
+
+load_dotenv("../.env")
+change_settings({"IMAGEMAGICK_BINARY": os.getenv("IMAGEMAGICK_BINARY")})
+
+from utils import create_workspace, remove_workspace, workspace_path
+from pipeline import generate_short
+from stages import Journal
+from gpt import generate_scripts
+from catalog import VideoCatalog
+from cancellation import CancelToken, JobCancelled
+
+
+def read_manifest(path: str) -> List[dict]:
+    """
+    Reads and validates a JSONL manifest.
+
+    Args:
+        path (str): Path to the manifest.
+
+    Returns:
+        List[dict]: One job per non-empty line.
+
+    Raises:
+        ValueError: If a line isn't a JSON object with a subject.
+    """
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON ({e})")
+            if not isinstance(job, dict) or not str(job.get("subject", "")).strip():
+                raise ValueError(f"{path}:{line_number}: every job needs a subject")
+            if int(job.get("count", 1)) < 1:
+                raise ValueError(f"{path}:{line_number}: count must be at least 1")
+            jobs.append(job)
+    return jobs
+
+
+def short_options(job: dict, short_index: int, ai_model: str) -> dict:
+    """Maps a manifest job to the options of pipeline.generate_short."""
+    scripts = job.get("scripts") or []
+    return {
+        "video_subject": job["subject"],
+        "paragraph_number": int(job.get("paragraphNumber", 1)),
+        "ai_model": job.get("aiModel", ai_model),
+        "custom_prompt": job.get("customPrompt") or (scripts[short_index] if short_index < len(scripts) else None),
+        "voice": job.get("voice"),
+        "contentType": job.get("contentType", "stock"),
+        "subtitles_position": job.get("subtitlesPosition", "center,bottom"),
+        "text_color": job.get("color"),
+        "songsName": job.get("song"),
+        "automate_youtube_upload": bool(job.get("automateYoutubeUpload", False)),
+    }
+
+
+def prepare_scripts(jobs: List[dict], batch_id: str, ai_model: str, concurrency: int) -> None:
+    """
+    Writes the scripts of every job with more than one short up front, as
+    distinct scripts from one concurrent round of requests, and stores
+    them under job["scripts"]. A job whose scripts can't be written falls
+    back to one script per short.
+    """
+    def prepare(job_index):
+        job = jobs[job_index]
+        journal = Journal(os.path.join(create_workspace("batch", batch_id, job_index), "journal.json"))
+        try:
+            job["scripts"] = journal.memo("scripts", lambda: generate_scripts(
+                job["subject"], int(job.get("count", 1)), int(job.get("paragraphNumber", 1)),
+                job.get("aiModel", ai_model)
+            ))
+        except Exception as e:
+            print(colored(f"[-] Could not write the scripts of job {job_index} up front: {e}", "red"))
+
+    pending = [i for i, job in enumerate(jobs) if int(job.get("count", 1)) > 1 and not job.get("customPrompt")]
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(pending)))) as executor:
+            list(executor.map(prepare, pending))
+
+
+# Result statuses of shorts that a rerun of the batch doesn't render again
+FINISHED = ("success", "no_media")
+
+
+def finished_shorts(output_path: str, batch_id: str) -> Dict[Tuple[int, int], str]:
+    """
+    Returns the status of every short of the batch that the result
+    manifest records as finished, keyed by (job, short).
+    """
+    done = {}
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash
+                continue
+            if record.get("batch_id") == batch_id and record.get("status") in FINISHED:
+                done[(record["job"], record["short"])] = record["status"]
+    return done
+
+
+def run_batch(jobs: List[dict], output_path: str, batch_id: str, concurrency: int,
+              ai_model: str, cancel_token: CancelToken) -> Tuple[int, int]:
+    """
+    Renders every short of every job, `concurrency` shorts at a time, and
+    appends one result line per short to `output_path`. Shorts that
+    `output_path` already records as finished for this batch are skipped.
+
+    Returns:
+        Tuple[int, int]: The number of shorts rendered, in this run or an
+            earlier one, and the number of shorts in the batch.
+    """
+    done = finished_shorts(output_path, batch_id)
+    all_shorts = [(job_index, short_index)
+                  for job_index, job in enumerate(jobs)
+                  for short_index in range(int(job.get("count", 1)))]
+    shorts = [short for short in all_shorts if short not in done]
+    if len(shorts) < len(all_shorts):
+        print(colored(f"[+] Skipping {len(all_shorts) - len(shorts)} short(s) finished in an earlier run", "blue"))
+    output_lock = threading.Lock()
+    rendered = sum(1 for status in done.values() if status == "success")
+    finished = len(all_shorts) - len(shorts)
+    catalog = VideoCatalog(os.path.abspath("../catalog.db"), "../Generated_Video")
+
+    def render(short):
+        nonlocal rendered, finished
+        job_index, short_index = short
+        job = jobs[job_index]
+        record = {
+            "batch_id": batch_id,
+            "job": job_index,
+            "short": short_index,
+            "subject": job["subject"],
+            "contentType": job.get("contentType", "stock"),
+        }
+        workspace = create_workspace("batch", batch_id, job_index, short_index)
+        start = time.monotonic()
+        try:
+            cancel_token.raise_if_cancelled()
+            print(colored(f"[+] Job {job_index}, short {short_index + 1}: {job['subject']}", "green"))
+            result = generate_short(short_options(job, short_index, ai_model), workspace, cancel_token,
+                                    catalog=catalog, source=f"batch/{batch_id}")
+            record["status"] = "success" if result.video else "no_media"
+            record["video"] = result.video
+            record["timings"] = result.timings
+            record["restored"] = result.restored
+            # A failed short keeps its workspace so the next run resumes it
+            remove_workspace(workspace)
+        except JobCancelled:
+            record["status"] = "cancelled"
+        except Exception as e:
+            print(colored(f"[-] Job {job_index}, short {short_index + 1} failed: {e}", "red"))
+            record["status"] = "error"
+            record["error"] = str(e)
+        record["seconds"] = round(time.monotonic() - start, 3)
+
+        with output_lock:
+            if record["status"] == "success":
+                rendered += 1
+            if record["status"] in FINISHED:
+                finished += 1
+            with open(output_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        list(executor.map(render, shorts))
+
+    if finished == len(all_shorts):
+        # Nothing left to resume
+        remove_workspace(workspace_path("batch", batch_id))
+    return rendered, len(all_shorts)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Render shorts from a JSONL manifest.")
+    parser.add_argument("manifest", help="JSONL file with one job per line")
+    parser.add_argument("--output", help="Result manifest (default: <manifest>.results.jsonl)")
+    parser.add_argument("--concurrency", type=int,
+                        default=int(os.getenv("MAX_PARALLEL_SHORTS", 4)),
+                        help="Shorts in flight at the same time; renders are bounded by CPU_SLOTS")
+    parser.add_argument("--batch-id", default=None,
+                        help="Reuse (with the same --output) to skip the finished shorts of an "
+                             "earlier run and resume the failed ones")
+    parser.add_argument("--ai-model", default="deepseek-chat",
+                        help="Default model for jobs without an aiModel")
+    args = parser.parse_args()
+
+    try:
+        jobs = read_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(colored(f"[-] {e}", "red"))
+        return 2
+
+    batch_id = args.batch_id or uuid4().hex[:12]
+    output_path = args.output or f"{os.path.splitext(args.manifest)[0]}.results.jsonl"
+
+    # Ctrl+C stops new shorts and interrupts running ones at the next safe point
+    cancel_token = CancelToken()
+    signal.signal(signal.SIGINT, lambda signum, frame: cancel_token.cancel())
+
+    print(colored(f"[+] Batch {batch_id}: {len(jobs)} job(s), writing results to {output_path}", "blue"))
+    prepare_scripts(jobs, batch_id, args.ai_model, args.concurrency)
+    rendered, total = run_batch(jobs, output_path, batch_id, args.concurrency, args.ai_model, cancel_token)
+    print(colored(f"[+] Batch {batch_id}: {rendered} of {total} short(s) rendered", "green"))
+    return 0 if rendered == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, Tuple
+
+from termcolor import colored
+
+from metrics import REGISTRY, Counter
+
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "moneyprinter_cache_requests_total", "Cache lookups by cache and result.", ["cache", "result"]))
+
+
+class DiskCache:
+    """
+    A persistent key/value cache backed by SQLite, shared by every thread
+    and process using the same file.
+
+    Entries expire `ttl` seconds after they were stored. When the stored
+    values grow past `max_bytes`, the least recently used entries are
+    evicted until the cache is back at 90% of the limit.
+
+    With `stale_ttl`, expired entries are kept that much longer, so
+    get_entry() can still return them for revalidation with the origin
+    (e.g. an HTTP ETag) or as a fallback when the origin fails.
+    """
+
+    def __init__(self, name: str, path: str, ttl: float, max_bytes: int, stale_ttl: float = 0):
+        """
+        Args:
+            name (str): Name used in logs and metrics, e.g. "llm".
+            path (str): Path to the SQLite database file.
+            ttl (float): Seconds an entry stays valid.
+            max_bytes (int): Upper bound for the total size of the values.
+            stale_ttl (float): Seconds an expired entry is kept after `ttl`.
+        """
+        self.name = name
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_by_access ON entries (accessed_at)")
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Hashes the parts of a key into a fixed-length one."""
+        return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="hit" if hit else "miss")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the value stored under `key`, or None if it's missing or expired."""
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None and entry[1] else None
+
+    def get_entry(self, key: str) -> Optional[Tuple[bytes, bool]]:
+        """
+        Returns (value, fresh) for the entry stored under `key`, where fresh
+        is False for an expired entry still within `stale_ttl`, or None if
+        there's no such entry. Only fresh entries count as hits.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] + self.stale_ttl < now:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                self._db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        fresh = row is not None and row[1] >= now
+        self._count(fresh)
+        return (row[0], fresh) if row is not None else None
+
+    def set(self, key: str, value: bytes, ttl: float = None) -> None:
+        """Stores a value, then evicts least recently used entries if the cache is too big."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + (self.ttl if ttl is None else ttl), now)
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM entries WHERE expires_at < ?", (now - self.stale_ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            if total <= target:
+                break
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        print(colored(f"[cache] {self.name}: evicted {evicted} least recently used entries", "cyan"))
+
+    def stats(self) -> dict:
+        """Returns hit/miss counts of this process and the current size of the cache."""
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
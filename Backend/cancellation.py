@@ -0,0 +1,28 @@
+import threading
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once its cancel token has been triggered."""
+
+
+class CancelToken:
+    """
+    A per-task cancellation flag. Long-running code calls
+    raise_if_cancelled() at safe points, so a cancelled task unwinds with
+    JobCancelled instead of running to completion.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise JobCancelled("Video generation was cancelled.")
+
@@ -0,0 +1,180 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Optional
+
+from termcolor import colored
+from moviepy.editor import VideoFileClip
+
+# Columns callers may sort the listing by
+SORT_COLUMNS = ("created_at", "duration", "size")
+
+
+def _escape_like(text: str) -> str:
+    """Escapes LIKE wildcards, so a subject with % or _ matches only itself."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class VideoCatalog:
+    """
+    A persistent index of the rendered videos in one directory, backed by
+    SQLite, so listing them doesn't mean probing every file on every
+    request. Videos are added when a render finishes; sync() picks up files
+    that were added or deleted behind the catalog's back.
+    """
+
+    def __init__(self, db_path: str, videos_dir: str):
+        """
+        Args:
+            db_path (str): Path to the SQLite database file.
+            videos_dir (str): Directory the videos are rendered to.
+                Thumbnails go to its `thumbnails` subdirectory.
+        """
+        self.videos_dir = os.path.abspath(videos_dir)
+        self.thumbnails_dir = os.path.join(self.videos_dir, "thumbnails")
+        os.makedirs(self.thumbnails_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS videos (
+                filename TEXT PRIMARY KEY,
+                task_id TEXT,
+                subject TEXT,
+                duration REAL,
+                size INTEGER NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                thumbnail TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS videos_by_created ON videos (created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS videos_by_task ON videos (task_id)")
+
+    def add(self, video_path: str, task_id: str = None, subject: str = None) -> dict:
+        """
+        Probes a rendered video, writes its thumbnail and records it.
+
+        Args:
+            video_path (str): Path to the video inside the videos directory.
+            task_id (str): The task (or batch) that rendered it.
+            subject (str): The video subject.
+
+        Returns:
+            dict: The catalog entry.
+        """
+        filename = os.path.basename(video_path)
+        path = os.path.join(self.videos_dir, filename)
+        stat = os.stat(path)
+
+        duration = width = height = thumbnail = None
+        try:
+            clip = VideoFileClip(path, audio=False)
+            try:
+                duration = clip.duration
+                width, height = clip.size
+                thumbnail = f"{os.path.splitext(filename)[0]}.jpg"
+                clip.save_frame(os.path.join(self.thumbnails_dir, thumbnail), t=min(1.0, duration / 2))
+            finally:
+                clip.close()
+        except Exception as e:
+            print(colored(f"[-] Could not probe {filename}: {e}", "red"))
+
+        entry = {
+            "filename": filename,
+            "task_id": task_id,
+            "subject": subject,
+            "duration": duration,
+            "size": stat.st_size,
+            "width": width,
+            "height": height,
+            "thumbnail": thumbnail,
+            "created_at": stat.st_mtime,
+        }
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO videos (filename, task_id, subject, duration, size, width, height, "
+                "thumbnail, created_at) VALUES (:filename, :task_id, :subject, :duration, :size, :width, "
+                ":height, :thumbnail, :created_at)",
+                entry
+            )
+        return entry
+
+    def get(self, filename: str) -> Optional[dict]:
+        """Returns the catalog entry of a video, or None if it isn't indexed."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM videos WHERE filename = ?", (filename,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list(self, page: int = 1, per_page: int = 50, task_id: str = None, subject: str = None,
+             min_duration: float = None, max_duration: float = None, since: float = None,
+             until: float = None, sort: str = "created_at", descending: bool = True) -> dict:
+        """
+        Returns one page of videos matching every given filter.
+
+        Args:
+            page (int): 1-based page number.
+            per_page (int): Videos per page.
+            task_id (str): Only videos of this task.
+            subject (str): Only videos whose subject contains this text.
+            min_duration, max_duration (float): Duration bounds in seconds.
+            since, until (float): Creation time bounds as Unix timestamps.
+            sort (str): One of SORT_COLUMNS.
+            descending (bool): Newest, longest or largest first.
+
+        Returns:
+            dict: {"items": [...], "total": int, "page": int, "per_page": int}
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Can't sort by {sort}, use one of {SORT_COLUMNS}")
+
+        conditions, params = [], []
+        for clause, value in (
+            ("task_id = ?", task_id),
+            ("subject LIKE ? ESCAPE '\\'", f"%{_escape_like(subject)}%" if subject else None),
+            ("duration >= ?", min_duration),
+            ("duration <= ?", max_duration),
+            ("created_at >= ?", since),
+            ("created_at <= ?", until),
+        ):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        page, per_page = max(1, page), max(1, per_page)
+
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM videos {where}", params).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT * FROM videos {where} ORDER BY {sort} {'DESC' if descending else 'ASC'}, filename "
+                "LIMIT ? OFFSET ?",
+                (*params, per_page, (page - 1) * per_page)
+            ).fetchall()
+        return {"items": [dict(row) for row in rows], "total": total, "page": page, "per_page": per_page}
+
+    def sync(self) -> None:
+        """Indexes videos missing from the catalog and drops entries whose file is gone."""
+        on_disk = {f for f in os.listdir(self.videos_dir) if f.endswith(".mp4")}
+        with self._lock:
+            indexed = {row["filename"]: row["thumbnail"]
+                       for row in self._db.execute("SELECT filename, thumbnail FROM videos").fetchall()}
+
+        for filename in sorted(set(indexed) - on_disk):
+            with self._lock:
+                self._db.execute("DELETE FROM videos WHERE filename = ?", (filename,))
+            if indexed[filename]:
+                try:
+                    os.unlink(os.path.join(self.thumbnails_dir, indexed[filename]))
+                except OSError:
+                    pass
+
+        missing = sorted(on_disk - set(indexed))
+        start = time.monotonic()
+        for filename in missing:
+            self.add(filename)
+        if missing:
+            print(colored(f"[+] Indexed {len(missing)} video(s) in {time.monotonic() - start:.1f}s", "cyan"))
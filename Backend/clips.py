@@ -0,0 +1,225 @@
+import os
+import re
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+from termcolor import colored
+
+from cache import CACHE_REQUESTS
+
+# Pexels file URLs look like https://videos.pexels.com/video-files/3571264/3571264-uhd_2560_1440_30fps.mp4
+_PEXELS_FILE = re.compile(r"/video-files/(\d+)/([^/?#]+)")
+
+
+def clip_key(url: str) -> str:
+    """
+    The library key of a clip URL: "pexels/<video id>/<file name>" for
+    Pexels files, whatever host or query string they come with, and the
+    URL without its query string otherwise.
+    """
+    parsed = urlparse(url)
+    match = _PEXELS_FILE.search(parsed.path)
+    if match:
+        return f"pexels/{match.group(1)}/{match.group(2)}"
+    return f"{parsed.netloc}{parsed.path}"
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ClipLibrary:
+    """
+    A persistent store of downloaded stock clips, shared by every job, so a
+    clip is downloaded once no matter how many shorts use it.
+
+    Clips are stored under the hash of their key (see clip_key) and indexed
+    in SQLite. A clip only enters the library once it's fully downloaded:
+    downloads land in a temporary file that's atomically renamed into
+    place. A stored clip's SHA-256 is checked the first time this process
+    uses it, and a clip that doesn't match is dropped and downloaded again.
+    When the library grows past `max_bytes`, least recently used
+    clips are deleted until it's back at 90% of the limit.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        """
+        Args:
+            root (str): Directory holding the clips and their index.
+            max_bytes (int): Disk quota for the clips.
+        """
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Keys whose file matched its checksum in this process
+        self._verified = set()
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # One lock per key being fetched, so concurrent jobs download a clip once
+        self._fetching = {}
+        self._db = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS clips (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS clips_by_access ON clips (accessed_at)")
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], f"{digest}.mp4")
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        CACHE_REQUESTS.inc(cache="clips", result="hit" if hit else "miss")
+
+    def get(self, url: str) -> Optional[str]:
+        """Returns the library path of a clip, or None if it isn't stored intact."""
+        key = clip_key(url)
+        with self._lock:
+            row = self._db.execute("SELECT path, sha256 FROM clips WHERE key = ?", (key,)).fetchone()
+            verified = key in self._verified
+        if row is None:
+            return None
+        path, sha256 = row
+        if not os.path.exists(path):
+            # Deleted behind the library's back
+            self._drop(key, path)
+            return None
+        if not verified:
+            if _sha256(path) != sha256:
+                print(colored(f"[!] Clip {key} is corrupt, downloading it again", "yellow"))
+                self._drop(key, path)
+                return None
+            with self._lock:
+                self._verified.add(key)
+        with self._lock:
+            self._db.execute("UPDATE clips SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return path
+
+    def _drop(self, key: str, path: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM clips WHERE key = ?", (key,))
+            self._verified.discard(key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def fetch(self, url: str, download: Callable[[], str], directory: str = None) -> str:
+        """
+        Returns a clip from the library, downloading it first if needed.
+
+        Args:
+            url (str): The clip's source URL.
+            download (Callable): Downloads the clip to a file in `tmp_dir`
+                and returns its path.
+            directory (str): If given, the clip is linked (or copied, across
+                file systems) into this directory and that path returned,
+                so evicting it later can't pull it from under a job.
+
+        Returns:
+            str: Path to the clip.
+        """
+        key = clip_key(url)
+        with self._lock:
+            key_lock = self._fetching.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                path = self.get(url)
+                self._count(path is not None)
+                if path is None:
+                    path = self._add(key, url, download())
+        finally:
+            # Also when the download fails or is cancelled
+            with self._lock:
+                self._fetching.pop(key, None)
+        return self._checkout(path, directory) if directory else path
+
+    def _add(self, key: str, url: str, downloaded: str) -> str:
+        digest = _sha256(downloaded)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(downloaded, path)
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO clips (key, url, path, size, sha256, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, url, path, os.path.getsize(path), digest, now, now)
+            )
+            self._verified.add(key)
+            self._evict(keep=key)
+        return path
+
+    @staticmethod
+    def _checkout(path: str, directory: str) -> str:
+        target = os.path.join(os.path.abspath(directory), os.path.basename(path))
+        if not os.path.exists(target):
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copyfile(path, target)
+        return target
+
+    def _evict(self, keep: str) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM clips").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * 0.9
+        evicted = 0
+        rows = self._db.execute("SELECT key, path, size FROM clips ORDER BY accessed_at").fetchall()
+        for key, path, size in rows:
+            if total <= target:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._db.execute("DELETE FROM clips WHERE key = ?", (key,))
+            self._verified.discard(key)
+            total -= size
+            evicted += 1
+        print(colored(f"[clips] Evicted {evicted} least recently used clips", "cyan"))
+
+    def stats(self) -> dict:
+        """Returns hit/miss counts of this process and the current size of the library."""
+        with self._lock:
+            clips, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM clips").fetchone()
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "clips": clips,
+            "bytes": size,
+        }
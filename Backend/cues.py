@@ -0,0 +1,237 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+import numpy as np
+
+_TIMECODE = re.compile(r"(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)")
+
+
+class Cue(NamedTuple):
+    start: float
+    end: float
+    text: str
+
+
+def _srt_time(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    h, ms = divmod(ms, 3600000)
+    m, ms = divmod(ms, 60000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02}:{m:02}:{s:02},{ms:03}"
+
+
+def _ass_time(seconds: float) -> str:
+    cs = int(round(seconds * 100))
+    h, cs = divmod(cs, 360000)
+    m, cs = divmod(cs, 6000)
+    s, cs = divmod(cs, 100)
+    return f"{h}:{m:02}:{s:02}.{cs:02}"
+
+
+def _wrap(text: str, max_chars: int) -> List[str]:
+    """Greedy word wrap; a word longer than max_chars gets a line of its own."""
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > max_chars:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+class CueTable:
+    """
+    Subtitle cues sorted by start time. Start and end times live in NumPy
+    arrays and the texts in one string with an offset array, so a table of
+    any length is three arrays and a string, and slicing it copies no text.
+
+    Build one with from_srt(), from_segments() or load(), and write it
+    with to_srt() / to_ass() / write().
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, text: str, offsets: np.ndarray):
+        self.starts = starts
+        self.ends = ends
+        self._text = text
+        # Cue i's text is _text[offsets[i]:offsets[i + 1]]
+        self._offsets = offsets
+
+    @classmethod
+    def from_cues(cls, cues: Iterable[Tuple[float, float, str]]) -> "CueTable":
+        """Builds a table from (start, end, text) tuples in any order."""
+        cues = sorted((float(start), float(end), text.strip()) for start, end, text in cues)
+        starts = np.array([cue[0] for cue in cues], dtype=np.float64)
+        ends = np.array([cue[1] for cue in cues], dtype=np.float64)
+        offsets = np.zeros(len(cues) + 1, dtype=np.int64)
+        np.cumsum([len(cue[2]) for cue in cues], out=offsets[1:])
+        return cls(starts, ends, "".join(cue[2] for cue in cues), offsets)
+
+    @classmethod
+    def from_segments(cls, segments: Iterable[dict]) -> "CueTable":
+        """Builds a table from Whisper segments (dicts with start, end and text)."""
+        return cls.from_cues((seg["start"], seg["end"], seg["text"]) for seg in segments)
+
+    @classmethod
+    def from_srt(cls, content: str) -> "CueTable":
+        """Parses SRT text. Blocks without a valid timecode line are skipped."""
+        cues = []
+        for block in re.split(r"\n\s*\n", content.replace("\r\n", "\n").strip()):
+            lines = block.strip().split("\n")
+            for i, line in enumerate(lines[:2]):
+                match = _TIMECODE.match(line.strip())
+                if match:
+                    h1, m1, s1, ms1, h2, m2, s2, ms2 = map(int, match.groups())
+                    cues.append((h1 * 3600 + m1 * 60 + s1 + ms1 / 1000,
+                                 h2 * 3600 + m2 * 60 + s2 + ms2 / 1000,
+                                 "\n".join(lines[i + 1:])))
+                    break
+        return cls.from_cues(cues)
+
+    @classmethod
+    def load(cls, source: Union[str, "CueTable", None]) -> "CueTable":
+        """
+        Returns the table of an SRT file, parsing each file only once while
+        it's unchanged. A table is returned as is; a missing file gives an
+        empty table.
+        """
+        if isinstance(source, CueTable):
+            return source
+        if not source or not os.path.exists(source):
+            return cls.from_cues([])
+        return _load_cached(os.path.abspath(source), os.stat(source).st_mtime_ns)
+
+    # ============================
+    # Access
+    # ============================
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def text(self, i: int) -> str:
+        return self._text[self._offsets[i]:self._offsets[i + 1]]
+
+    def texts(self) -> List[str]:
+        return [self.text(i) for i in range(len(self))]
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Cue, "CueTable"]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("CueTable slices must be contiguous.")
+            stop = max(start, stop)
+            return CueTable(self.starts[start:stop], self.ends[start:stop], self._text,
+                            self._offsets[start:stop + 1])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("cue index out of range")
+        return Cue(float(self.starts[index]), float(self.ends[index]), self.text(index))
+
+    def __iter__(self) -> Iterator[Cue]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def duration(self) -> float:
+        """End of the last cue, 0 for an empty table."""
+        return float(self.ends.max()) if len(self) else 0.0
+
+    def active_at(self, t: float) -> int:
+        """Index of the cue shown at time t, or -1. Binary search, O(log n)."""
+        i = int(np.searchsorted(self.starts, t, side="right")) - 1
+        return i if i >= 0 and t < self.ends[i] else -1
+
+    def between(self, start: float, end: float) -> "CueTable":
+        """The cues overlapping [start, end)."""
+        stop = int(np.searchsorted(self.starts, end, side="left"))
+        ends = self.ends[:stop]
+        # Cues don't overlap each other in practice, so their ends are sorted
+        # too and a second binary search finds the first one; scan otherwise
+        if np.all(ends[1:] >= ends[:-1]):
+            first = int(np.searchsorted(ends, start, side="right"))
+        else:
+            overlapping = np.nonzero(ends > start)[0]
+            first = int(overlapping[0]) if len(overlapping) else stop
+        return self[first:stop]
+
+    # ============================
+    # Transforms and output
+    # ============================
+    def equalize(self, max_chars: int) -> "CueTable":
+        """
+        Splits cues longer than `max_chars` into consecutive cues of at most
+        that many characters (single long words excepted), sharing the
+        original cue's time in proportion to their length.
+        """
+        cues = []
+        for start, end, text in self:
+            lines = _wrap(text, max_chars) if len(text) > max_chars else [text]
+            total = sum(len(line) for line in lines) or 1
+            t = start
+            for line in lines:
+                line_end = t + (end - start) * len(line) / total
+                cues.append((t, line_end, line))
+                t = line_end
+        return CueTable.from_cues(cues)
+
+    def to_srt(self) -> str:
+        return "".join(
+            f"{i}\n{_srt_time(start)} --> {_srt_time(end)}\n{text}\n\n"
+            for i, (start, end, text) in enumerate(self, start=1)
+        )
+
+    def to_ass(self, font: str = "Arial", fontsize: int = 50, color: str = "#FFFFFF",
+               resolution: Tuple[int, int] = (1080, 1920)) -> str:
+        """Renders the cues as an Advanced SubStation Alpha script with one style."""
+        r, g, b = (int(color.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4))
+        header = (
+            "[Script Info]\nScriptType: v4.00+\n"
+            f"PlayResX: {resolution[0]}\nPlayResY: {resolution[1]}\n\n"
+            "[V4+ Styles]\n"
+            "Format: Name, Fontname, Fontsize, PrimaryColour, OutlineColour, Outline, Alignment\n"
+            f"Style: Default,{font},{fontsize},&H00{b:02X}{g:02X}{r:02X},&H00000000,1,5\n\n"
+            "[Events]\nFormat: Layer, Start, End, Style, Text\n"
+        )
+        events = []
+        for start, end, text in self:
+            text = text.replace("\n", "\\N")
+            events.append(f"Dialogue: 0,{_ass_time(start)},{_ass_time(end)},Default,{text}\n")
+        return header + "".join(events)
+
+    def write(self, path: str) -> str:
+        """Writes the cues as SRT, or ASS if the path ends in .ass. Returns the path."""
+        content = self.to_ass() if path.lower().endswith(".ass") else self.to_srt()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        _remember(os.path.abspath(path), os.stat(path).st_mtime_ns, self)
+        return path
+
+
+# Parsed files by (path, mtime), so the stages reading the same subtitles
+# share one table
+_CACHE_SIZE = 64
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _remember(path: str, mtime_ns: int, table: CueTable) -> None:
+    with _cache_lock:
+        _cache[(path, mtime_ns)] = table
+        _cache.move_to_end((path, mtime_ns))
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _load_cached(path: str, mtime_ns: int) -> CueTable:
+    with _cache_lock:
+        table = _cache.get((path, mtime_ns))
+    if table is None:
+        with open(path, "r", encoding="utf-8") as f:
+            table = CueTable.from_srt(f.read())
+        _remember(path, mtime_ns, table)
+    return table
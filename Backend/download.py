@@ -0,0 +1,174 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from termcolor import colored
+
+from metrics import DOWNLOADED_BYTES, EXTERNAL_FAILURES, EXTERNAL_RETRIES
+
+# (connect, read) timeouts; the read timeout applies between chunks, not to the whole file
+DOWNLOAD_TIMEOUT = (float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", 10)), float(os.getenv("DOWNLOAD_READ_TIMEOUT", 30)))
+# Files of at least this size are fetched over several connections at once
+DOWNLOAD_SEGMENTS = int(os.getenv("DOWNLOAD_SEGMENTS", 4))
+DOWNLOAD_SEGMENT_MIN_BYTES = int(float(os.getenv("DOWNLOAD_SEGMENT_MIN_MB", 16)) * 1024 * 1024)
+CHUNK_SIZE = 1024 * 1024
+# Statuses worth retrying: rate limiting and server-side trouble
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Shared by every job, so downloads from the same CDN reuse connections
+download_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+download_session.mount("https://", _adapter)
+download_session.mount("http://", _adapter)
+
+
+class DownloadError(Exception):
+    """Raised when a download fails for good or ends up the wrong size."""
+
+
+class _RetryableStatus(Exception):
+    pass
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(30, 2 ** attempt))
+
+
+def _fetch_range(url: str, path: str, start: int, end: Optional[int], service: str, max_retries: int,
+                 cancel_token=None, stop: Optional[threading.Event] = None) -> int:
+    """
+    Streams bytes start..end (inclusive; None for the end of the file) of
+    `url` into `path` at the same offset. A dropped connection resumes
+    with a Range request from the last byte written. Setting `stop` makes
+    it give up at the next chunk, e.g. once another segment has failed.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    written = 0
+    attempt = 0
+    while True:
+        offset = start + written
+        headers = {}
+        if offset or end is not None:
+            headers["Range"] = f"bytes={offset}-{'' if end is None else end}"
+        try:
+            with download_session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as resp:
+                if resp.status_code in RETRY_STATUSES:
+                    raise _RetryableStatus(f"HTTP {resp.status_code}")
+                if resp.status_code not in (200, 206):
+                    EXTERNAL_FAILURES.inc(service=service)
+                    raise DownloadError(f"HTTP {resp.status_code}")
+                if "Range" in headers and resp.status_code == 200:
+                    # The server ignored the Range header and sends everything
+                    if end is not None:
+                        raise DownloadError("server does not support range requests")
+                    start, written, offset = 0, 0, 0
+                with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                    f.seek(offset)
+                    if end is None:
+                        f.truncate()
+                    for chunk in resp.iter_content(CHUNK_SIZE):
+                        if cancel_token is not None:
+                            cancel_token.raise_if_cancelled()
+                        if stop is not None and stop.is_set():
+                            raise DownloadError("stopped after another segment failed")
+                        f.write(chunk)
+                        written += len(chunk)
+                        DOWNLOADED_BYTES.inc(len(chunk))
+            return written
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                _RetryableStatus) as e:
+            if attempt >= max_retries:
+                EXTERNAL_FAILURES.inc(service=service)
+                raise DownloadError(f"{type(e).__name__}: {e} (gave up after {attempt + 1} attempts)")
+            EXTERNAL_RETRIES.inc(service=service)
+            print(colored(f"[!] Download interrupted after {written} bytes ({type(e).__name__}), resuming...",
+                          "yellow"))
+            if stop is not None:
+                if stop.wait(_backoff(attempt)):
+                    raise DownloadError("stopped after another segment failed")
+            else:
+                time.sleep(_backoff(attempt))
+            attempt += 1
+
+
+def _probe(url: str) -> Tuple[Optional[int], bool]:
+    """Returns the size of the file behind `url` and whether it can be fetched in ranges."""
+    try:
+        resp = download_session.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+    except requests.RequestException:
+        return None, False
+    if resp.status_code != 200:
+        return None, False
+    length = resp.headers.get("Content-Length")
+    size = int(length) if length and length.isdigit() else None
+    return size, resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+
+def download_file(url: str, path: str, segments: int = DOWNLOAD_SEGMENTS, max_retries: int = 4,
+                  service: str = "download", cancel_token=None) -> int:
+    """
+    Downloads a file to `path` without holding it in memory.
+
+    The file is streamed to `path`.part in 1 MiB chunks and renamed into
+    place once complete, so `path` never holds a partial file. Dropped
+    connections resume where they stopped. Large files on servers that
+    accept Range requests are split into `segments` parts fetched in
+    parallel. The result must match the size the server announced.
+
+    Args:
+        url (str): The file URL.
+        path (str): Where to save it.
+        segments (int): Connections used at most for one file.
+        max_retries (int): Resumes per connection after the first attempt.
+        service (str): Name used in metrics.
+        cancel_token (CancelToken): Checked between chunks.
+
+    Returns:
+        int: The size of the file in bytes.
+
+    Raises:
+        DownloadError: If the download fails for good or is incomplete.
+    """
+    part_path = f"{path}.part"
+    size, ranges = _probe(url)
+    try:
+        if size and ranges and segments > 1 and size >= 2 * DOWNLOAD_SEGMENT_MIN_BYTES:
+            parts = min(segments, size // DOWNLOAD_SEGMENT_MIN_BYTES)
+            step = -(-size // parts)
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+            stop = threading.Event()
+            with ThreadPoolExecutor(max_workers=parts) as executor:
+                futures = [
+                    executor.submit(_fetch_range, url, part_path, start, min(start + step, size) - 1,
+                                    service, max_retries, cancel_token, stop)
+                    for start in range(0, size, step)
+                ]
+                # One failed segment fails the file: stop the others right away
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                failed = next((future for future in done if future.exception() is not None), None)
+                if failed is not None:
+                    stop.set()
+                    raise failed.exception()
+                written = sum(future.result() for future in futures)
+        else:
+            written = _fetch_range(url, part_path, 0, None, service, max_retries, cancel_token)
+
+        if size is not None and written != size:
+            EXTERNAL_FAILURES.inc(service=service)
+            raise DownloadError(f"got {written} of {size} bytes")
+        os.replace(part_path, path)
+        return written
+    except BaseException:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        raise
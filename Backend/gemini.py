@@ -3,9 +3,11 @@ import shutil
 import requests
 from uuid import uuid4
 from gradio_client import Client
+from utils import gradio_lock
 
 # Initialize client
-client = Client("http://localhost:7860/")
+GRADIO_URL = "http://localhost:7860/"
+client = Client(GRADIO_URL)
 
 def safe_predict(step_name, **kwargs):
     try:
@@ -16,12 +18,12 @@ def safe_predict(step_name, **kwargs):
         print(f"[FAIL] {step_name} -> {e}")
         return None
 
-def copy_image_from_gradio_temp(gradio_temp_path: str) -> str:
+def copy_image_from_gradio_temp(gradio_temp_path: str, output_dir: str = None) -> str:
     """
     Copy the generated image from Gradio's temp directory to our temp folder
     """
     # Create our output directory
-    output_dir = os.path.join(os.path.dirname(__file__), "../temp")
+    output_dir = output_dir or os.path.join(os.path.dirname(__file__), "../temp")
     os.makedirs(output_dir, exist_ok=True)
     
     # Generate unique filename
@@ -37,11 +39,19 @@ def copy_image_from_gradio_temp(gradio_temp_path: str) -> str:
         print(f"[-] Error copying image: {e}")
         return None
 
-def generate_flux_image(prompt: str, contentType: str):
+def generate_flux_image(prompt: str, contentType: str, output_dir: str = None):
     """
     Full Gradio pipeline for generating an image using the provided prompt.
-    Returns the file path of the saved image in our temp folder.
+    Returns the file path of the saved image in our temp folder, or in
+    output_dir if given.
     """
+    # The pipeline below is a sequence of stateful UI calls, so concurrent
+    # shorts take turns on the server
+    with gradio_lock(GRADIO_URL):
+        return _generate_flux_image(prompt, contentType, output_dir)
+
+
+def _generate_flux_image(prompt: str, contentType: str, output_dir: str = None):
     if contentType == "cartoon":
         newprompt = (
             f"{prompt} night dark, old cartoon style, with heavy shadows, "
@@ -230,7 +240,7 @@ def generate_flux_image(prompt: str, contentType: str):
     # --- Step 9: Copy the image to our temp folder ---
     local_image_path = None
     if gradio_image_path and os.path.exists(gradio_image_path):
-        local_image_path = copy_image_from_gradio_temp(gradio_image_path)
+        local_image_path = copy_image_from_gradio_temp(gradio_image_path, output_dir)
     else:
         print("[-] No image path found in results")
         gradio_temp_dir = r"C:\Users\Anuj\AppData\Local\Temp\gradio"
@@ -247,7 +257,7 @@ def generate_flux_image(prompt: str, contentType: str):
                 latest_image = max(image_files, key=lambda x: x[1])
                 gradio_image_path = latest_image[0]
                 print(f"[+] Found latest image: {gradio_image_path}")
-                local_image_path = copy_image_from_gradio_temp(gradio_image_path)
+                local_image_path = copy_image_from_gradio_temp(gradio_image_path, output_dir)
 
     # --- Step 10: Cleanup ---
     safe_predict("Unload model", api_name="/unload_model_if_needed")
@@ -1,15 +1,23 @@
-from multiprocessing import Value
 import re
 import os
 import g4f
 import json
+import time
 import google.generativeai as genai
 import requests
 
 from g4f.client import Client
 from termcolor import colored
 from dotenv import load_dotenv
-from typing import Tuple, List
+from typing import Iterable, Iterator, Tuple, List, Optional, Union
+from metrics import STAGE_FAILURES, STAGE_SECONDS
+from llm import LLMClient
+from router import GeminiProvider, LLMRouter, OpenAICompatibleProvider, StandInProvider
+from cache import DiskCache
+from cues import CueTable
+from cancellation import JobCancelled
+from similarity import cluster_terms, is_near_duplicate
+from llmjson import SchemaError, parse_llm_json, validate_image_prompts, validate_search_terms
 
 # Load environment variables
 load_dotenv("../.env")
@@ -19,39 +27,154 @@ DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 genai.configure(api_key=GOOGLE_API_KEY)
 
+DEEPSEEK_MODELS = ["deepseek-chat", "deepseek-reasoner"]
 
-def generate_response(prompt: str, ai_model: str = "deepseek-chat") -> str:
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))
+
+
+def _build_router() -> LLMRouter:
     """
-    Generate a response using DeepSeek API.
-    ai_model can be 'deepseek-chat' or 'deepseek-reasoner'.
+    Builds the providers named in LLM_PROVIDERS (comma-separated, in order
+    of preference). By default that's DeepSeek, then Gemini if
+    GOOGLE_API_KEY is set, then an OpenAI-compatible local server if
+    LOCAL_LLM_URL is set. "standin" answers locally without any network.
     """
-    if ai_model not in ["deepseek-chat", "deepseek-reasoner"]:
-        raise ValueError(f"Invalid AI model selected: {ai_model}. Use 'deepseek-chat' or 'deepseek-reasoner'.")
-
-    url = "https://api.deepseek.com/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": ai_model,
-        "messages": [{"role": "user", "content": prompt}]
+    providers = {
+        # Shared by every job, so concurrent shorts reuse warm connections
+        "deepseek": OpenAICompatibleProvider(
+            "deepseek",
+            LLMClient("deepseek", "https://api.deepseek.com", DEEPSEEK_API_KEY, read_timeout=LLM_TIMEOUT),
+            default_model="deepseek-chat",
+            models=DEEPSEEK_MODELS,
+            # Only deepseek-chat supports JSON output; the reasoner relies on the prompt
+            json_mode_models=["deepseek-chat"],
+        ),
+        "standin": StandInProvider(),
     }
+    if GOOGLE_API_KEY:
+        providers["gemini"] = GeminiProvider(os.getenv("GEMINI_MODEL", "gemini-1.5-flash"), timeout=LLM_TIMEOUT)
+    if os.getenv("LOCAL_LLM_URL"):
+        local_model = os.getenv("LOCAL_LLM_MODEL", "llama3")
+        providers["local"] = OpenAICompatibleProvider(
+            "local",
+            LLMClient("local", os.getenv("LOCAL_LLM_URL"), os.getenv("LOCAL_LLM_API_KEY", "none"),
+                      read_timeout=LLM_TIMEOUT, max_retries=1),
+            default_model=local_model,
+            json_mode_models=[local_model],
+        )
+
+    default = [name for name in ("deepseek", "gemini", "local") if name in providers]
+    names = [name.strip() for name in os.getenv("LLM_PROVIDERS", ",".join(default)).split(",") if name.strip()]
+    for name in names:
+        if name not in providers:
+            print(colored(f"[!] LLM provider {name} is unknown or not configured, skipping it.", "yellow"))
+    return LLMRouter(
+        [providers[name] for name in names if name in providers] or [providers["deepseek"]],
+        preferred={"deepseek-chat": "deepseek", "deepseek-reasoner": "deepseek",
+                   "gemmini": "gemini", "local": "local"},
+        # Unset: hedge past each provider's measured p95 latency; a number
+        # of seconds fixes the delay and 0 turns hedging off. Each hedge is
+        # a second paid request.
+        hedge_delay=float(os.environ["LLM_HEDGE_DELAY"]) if os.getenv("LLM_HEDGE_DELAY") else None,
+        error_threshold=float(os.getenv("LLM_FAILOVER_ERROR_RATE", 0.5)),
+        cooldown=float(os.getenv("LLM_FAILOVER_COOLDOWN", 60)),
+    )
+
+
+llm_router = _build_router()
+
+
+# Responses to repeated prompts (search terms for a recurring subject,
+# metadata, retried jobs) come from disk. LLM_CACHE_TTL=0 disables it.
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+response_cache = DiskCache(
+    "llm",
+    os.path.abspath("../cache/llm.db"),
+    ttl=LLM_CACHE_TTL,
+    max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", 64)) * 1024 * 1024),
+) if LLM_CACHE_TTL > 0 else None
+
+
+def _check_model(ai_model: str) -> None:
+    if ai_model not in llm_router.preferred:
+        raise ValueError(f"Invalid AI model selected: {ai_model}. "
+                         f"Use one of {', '.join(sorted(llm_router.preferred))}.")
+
+
+def _cache_key(prompt: str, ai_model: str, json_mode: bool = False) -> str:
+    # Prompts are built from indented f-strings, so whitespace is noise
+    return DiskCache.make_key(ai_model, json_mode, " ".join(prompt.split()))
+
+
+def _cached(prompt: str, ai_model: str, creative: bool, json_mode: bool = False) -> Optional[str]:
+    if response_cache is None or creative:
+        return None
+    value = response_cache.get(_cache_key(prompt, ai_model, json_mode))
+    return value.decode("utf-8") if value is not None else None
+
 
-    resp = requests.post(url, headers=headers, json=payload)
-    resp.raise_for_status()
-    data = resp.json()
-    return data["choices"][0]["message"]["content"]
+def _store(prompt: str, ai_model: str, creative: bool, response: str, json_mode: bool = False) -> None:
+    if response_cache is not None and not creative and response:
+        response_cache.set(_cache_key(prompt, ai_model, json_mode), response.encode("utf-8"))
 
 
-def generate_script(video_subject: str, paragraph_number: str, ai_model: str,  customPrompt: str = None) -> str:
+def generate_response(prompt: str, ai_model: str = "deepseek-chat", creative: bool = False,
+                      json_mode: bool = False) -> str:
+    """
+    Generate a response through the LLM router.
+    ai_model picks the provider tried first: 'deepseek-chat' or
+    'deepseek-reasoner' for DeepSeek, 'gemmini' for Gemini, 'local' for the
+    local server. Slow requests are hedged to, and failing ones failed over
+    to, the other providers.
+    Responses are cached on disk unless `creative` is set, for prompts that
+    should give a fresh answer every time. `json_mode` asks the model for a
+    single JSON object; the prompt must still describe its fields.
+    """
+    _check_model(ai_model)
+    response = _cached(prompt, ai_model, creative, json_mode)
+    if response is None:
+        response = llm_router.complete(prompt, ai_model, json_mode)
+        _store(prompt, ai_model, creative, response, json_mode)
+    return response
+
+
+def generate_responses(prompts: List[str], ai_model: str = "deepseek-chat", creative: bool = False) -> List[str]:
+    """
+    Generate responses for several prompts concurrently.
+    Returns the responses in the order of the prompts.
+    """
+    _check_model(ai_model)
+    responses = [_cached(prompt, ai_model, creative) for prompt in prompts]
+    missing = [i for i, response in enumerate(responses) if response is None]
+    for i, response in zip(missing, llm_router.complete_many([prompts[i] for i in missing], ai_model)):
+        _store(prompts[i], ai_model, creative, response)
+        responses[i] = response
+    return responses
+
+
+async def agenerate_response(prompt: str, ai_model: str = "deepseek-chat", creative: bool = False) -> str:
+    """asyncio version of generate_response."""
+    _check_model(ai_model)
+    response = _cached(prompt, ai_model, creative)
+    if response is None:
+        response = await llm_router.acomplete(prompt, ai_model)
+        _store(prompt, ai_model, creative, response)
+    return response
+
+
+def stream_response(prompt: str, ai_model: str = "deepseek-chat") -> Iterator[str]:
     """
-    Generate a single-paragraph script for a video.
+    Generate a response through the LLM router, yielding text as it's generated.
+    Streamed responses are never cached.
     """
+    _check_model(ai_model)
+    return llm_router.stream(prompt, ai_model)
+
+
+def _script_prompt(video_subject: str, customPrompt: str = None) -> str:
     if customPrompt:
-        prompt = customPrompt
-    else:
-        prompt = f"""
+        return customPrompt
+    return f"""
         Write a single engaging narration about: {video_subject}.
 
         **STYLE GUIDELINES:**
@@ -73,39 +196,166 @@ def generate_script(video_subject: str, paragraph_number: str, ai_model: str,  c
 
         **Subject to write about:** {video_subject}
         """
-    
-    response = generate_response(prompt, ai_model)
 
-    if response:
-        # Clean the script from markdown or extra characters
-        response = response.replace("*", "").replace("#", "")
-        response = re.sub(r"\[.*?\]", "", response)
-        response = re.sub(r"\(.*?\)", "", response)
 
-        # Remove unnecessary newlines and keep it as a single paragraph
-        final_script = " ".join(response.split())
-        print('final script', final_script)
-        return final_script
-    else:
-        print(colored("[-] GPT returned an empty response.", "red"))
-        return None
+def _clean_script(response: str) -> str:
+    # Clean the script from markdown or extra characters
+    response = response.replace("*", "").replace("#", "")
+    response = re.sub(r"\[.*?\]", "", response)
+    response = re.sub(r"\(.*?\)", "", response)
 
+    # Remove unnecessary newlines and keep it as a single paragraph
+    return " ".join(response.split())
 
 
-def get_search_terms(video_subject: str, amount: int, script: str, ai_model: str) -> List[str]:
+def generate_scripts(video_subject: str, count: int, paragraph_number: str, ai_model: str,
+                     max_rounds: int = 3, threshold: float = 0.5) -> List[str]:
+    """
+    Generate `count` distinct scripts for the same subject, with all
+    requests issued concurrently.
+
+    A script that is a near-duplicate of one already accepted is rejected
+    and requested again, for up to `max_rounds` rounds. If there still
+    aren't enough distinct scripts after that, rejected ones fill the gap.
+
+    Args:
+        video_subject (str): The subject of the videos.
+        count (int): Number of scripts.
+        paragraph_number (str): Passed on like in stream_script.
+        ai_model (str): The AI model to use for generation.
+        max_rounds (int): Rounds of requests before giving up on distinctness.
+        threshold (float): Word-shingle similarity from which two scripts
+            count as near-duplicates.
+
+    Returns:
+        List[str]: `count` cleaned scripts.
+    """
+    scripts, rejected = [], []
+    for _ in range(max_rounds):
+        if len(scripts) >= count:
+            break
+        prompts = [
+            _script_prompt(video_subject) +
+            f"\n        This is version {i + 1} of {count}: pick a different hook and angle than the others.\n"
+            for i in range(len(scripts), count)
+        ]
+        for response in generate_responses(prompts, ai_model, creative=True):
+            script = _clean_script(response or "")
+            if not script:
+                continue
+            if is_near_duplicate(script, scripts, threshold):
+                print(colored("[!] Rejected a near-duplicate script.", "yellow"))
+                rejected.append(script)
+                continue
+            if len(scripts) < count:
+                scripts.append(script)
+
+    if len(scripts) < count:
+        print(colored(f"[!] Only {len(scripts)} of {count} scripts are distinct.", "yellow"))
+        scripts += rejected[:count - len(scripts)]
+    if len(scripts) < count:
+        raise ValueError(f"Could only generate {len(scripts)} of {count} scripts.")
+
+    print(colored(f"[+] Generated {count} scripts for: {video_subject}", "green"))
+    return scripts
+
+
+# A sentence ends at . ! or ? followed by optional closing quotes and whitespace
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+")
+
+
+def split_sentences(deltas: Iterable[str]) -> Iterator[str]:
+    """
+    Regroups streamed text into complete sentences. A sentence is only
+    cut where no [...] or (...) is open, so the script cleanup, which drops
+    bracketed text, can run on every sentence on its own.
+    """
+    buffer = ""
+    for delta in deltas:
+        buffer += delta
+        start = 0
+        for match in SENTENCE_END.finditer(buffer):
+            candidate = buffer[start:match.end()]
+            if candidate.count("[") > candidate.count("]") or candidate.count("(") > candidate.count(")"):
+                continue
+            yield candidate
+            start = match.end()
+        buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer
+
+
+def stream_script(video_subject: str, paragraph_number: str, ai_model: str, customPrompt: str = None) -> Iterator[str]:
+    """
+    Generate a single-paragraph script for a video, yielded cleaned, one
+    sentence at a time while the rest is still being generated, so speech
+    synthesis can start on the first sentence right away.
+    """
+    start = time.monotonic()
+    try:
+        for sentence in split_sentences(stream_response(_script_prompt(video_subject, customPrompt), ai_model)):
+            sentence = _clean_script(sentence)
+            if sentence:
+                yield sentence
+    except Exception:
+        STAGE_FAILURES.inc(stage="generate_script")
+        raise
+    finally:
+        # Failed and abandoned streams count too, like @timed stages
+        STAGE_SECONDS.observe(time.monotonic() - start, stage="generate_script")
+
+
+
+def get_search_terms(video_subject: str, amount: int, script: str, ai_model: str,
+                     max_rounds: int = 2) -> List[str]:
     """
     Generate a JSON-Array of search terms for stock videos,
     depending on the subject of a video.
 
+    Near-duplicate terms ("ocean waves", "waves ocean") would cost a Pexels
+    request and a download each for the same footage, so they're collapsed,
+    and missing terms are backfilled with another request asking for
+    different ones.
+
     Args:
         video_subject (str): The subject of the video.
         amount (int): The amount of search terms to generate.
         script (str): The script of the video.
         ai_model (str): The AI model to use for generation.
+        max_rounds (int): Requests made at most to get `amount` distinct terms.
 
     Returns:
         List[str]: The search terms for the video subject.
     """
+    candidates, search_terms = [], []
+    for _ in range(max_rounds):
+        # Ask for a few more than needed, since some may be collapsed
+        wanted = amount - len(search_terms)
+        new_terms = _request_search_terms(video_subject, wanted + max(2, wanted // 2), script, ai_model,
+                                          avoid=candidates)
+        if not new_terms:
+            break
+        candidates += new_terms
+        clusters = cluster_terms(candidates)
+        search_terms = [cluster[0] for cluster in clusters][:amount]
+        for cluster in clusters:
+            if len(cluster) > 1:
+                print(colored(f"[*] Collapsed near-duplicate search terms: {', '.join(cluster)}", "blue"))
+        if len(search_terms) >= amount:
+            break
+
+    # Let user know
+    print(colored(f"\nGenerated {len(search_terms)} search terms: {', '.join(search_terms)}", "cyan"))
+
+    # Return search terms
+    return search_terms
+
+
+def _request_search_terms(video_subject: str, amount: int, script: str, ai_model: str,
+                          avoid: List[str] = ()) -> List[str]:
+    avoid_hint = f"""
+    Do NOT return these terms or rewordings of them: {json.dumps(avoid)}
+    """ if avoid else ""
 
     # Build prompt
     prompt = f"""
@@ -123,10 +373,11 @@ def get_search_terms(video_subject: str, amount: int, script: str, ai_model: str
     YOU MUST NOT RETURN ANYTHING ELSE. 
     YOU MUST NOT RETURN THE SCRIPT.
     
-    The search terms must be related to the subject of the video.
+    The search terms must be related to the subject of the video,
+    and each must show something visually different from the others.
     Here is an example of a JSON-Array of strings:
     ["search term "]
-
+    {avoid_hint}
     For context, here is the full text:
     {script}
     """
@@ -136,79 +387,29 @@ def get_search_terms(video_subject: str, amount: int, script: str, ai_model: str
     print(response)
 
     # Parse response into a list of search terms
-    search_terms = []
-    
     try:
-        search_terms = json.loads(response)
-        if not isinstance(search_terms, list) or not all(isinstance(term, str) for term in search_terms):
-            raise ValueError("Response is not a list of strings.")
-
-    except (json.JSONDecodeError, Value
-            ):
-        # Get everything between the first and last square brackets
-        response = response[response.find("[") + 1:response.rfind("]")]
-
-        print(colored("[*] GPT returned an unformatted response. Attempting to clean...", "yellow"))
-
-        # Attempt to extract list-like string and convert to list
-        match = re.search(r'\["(?:[^"\\]|\\.)*"(?:,\s*"[^"\\]*")*\]', response)
-        print(match.group())
-        if match:
-            try:
-                search_terms = json.loads(match.group())
-            except json.JSONDecodeError:
-                print(colored("[-] Could not parse response.", "red"))
-                return []
-
-
-    # Let user know
-    print(colored(f"\nGenerated {len(search_terms)} search terms: {', '.join(search_terms)}", "cyan"))
-
-    # Return search terms
-    return search_terms
+        return parse_llm_json(response, validate_search_terms)
+    except SchemaError as e:
+        print(colored(f"[-] Could not parse response: {e}", "red"))
+        return []
 
-def get_image_search_terms(video_subject: str, amount: int, subtitles_path: str, ai_model: str) -> List[dict]:
+def get_image_search_terms(video_subject: str, amount: int, subtitles_path: Union[str, CueTable],
+                           ai_model: str) -> List[dict]:
     """
     Generate highly detailed, visually descriptive prompts for AI image generation
-    with precise timing information based on the subtitle file.
+    with precise timing information based on the subtitle file (or an
+    already loaded CueTable).
     """
-    
-    # --- Helper: Parse SRT into segments with start/end in seconds ---
-    def parse_srt(subtitles_path: str) -> List[dict]:
-        segments = []
-        if not subtitles_path or not os.path.exists(subtitles_path):
-            return segments
-        with open(subtitles_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-        blocks = content.split('\n\n')
-        for block in blocks:
-            lines = block.split('\n')
-            if len(lines) >= 3:
-                ts_match = re.match(
-                    r"(\d+):(\d+):(\d+),(\d+)\s*-->\s*(\d+):(\d+):(\d+),(\d+)", 
-                    lines[1]
-                )
-                if ts_match:
-                    h1, m1, s1, ms1, h2, m2, s2, ms2 = map(int, ts_match.groups())
-                    start_sec = h1*3600 + m1*60 + s1 + ms1/1000
-                    end_sec = h2*3600 + m2*60 + s2 + ms2/1000
-                    text = " ".join(lines[2:]).strip()
-                    segments.append({
-                        "text": text,
-                        "start": start_sec,
-                        "end": end_sec
-                    })
-        return segments
 
     # --- Get total duration from subtitles ---
-    def get_total_duration(segments: List[dict]) -> float:
-        if segments:
-            return segments[-1]["end"]
+    def get_total_duration(segments: CueTable) -> float:
+        if len(segments):
+            return segments.duration
         return 24.0  # fallback
 
     # --- Generate fallback image prompts ---
-    def fallback_prompts(segments: List[dict], amount: int) -> List[dict]:
-        if not segments:
+    def fallback_prompts(segments: CueTable, amount: int) -> List[dict]:
+        if not len(segments):
             segment_duration = 24.0 / amount
             return [{
                 "Img prompt": f"{video_subject} - scene {i+1}, detailed cinematic shot",
@@ -221,53 +422,22 @@ def get_image_search_terms(video_subject: str, amount: int, subtitles_path: str,
         prompts = []
         for i in range(0, len(segments), step):
             segs = segments[i:i+step]
-            prompt_text = " ".join([s['text'] for s in segs])
+            prompt_text = " ".join(segs.texts())
             prompts.append({
                 "Img prompt": f"Cinematic scene: {prompt_text}",
-                "start": segs[0]['start'],
-                "end": segs[-1]['end']
+                "start": segs[0].start,
+                "end": segs[-1].end
             })
         return prompts[:amount]  # Ensure exact amount
 
-    # --- Extract JSON from AI response ---
-    def extract_json_from_response(response: str) -> List[dict]:
-        """Extract JSON array from AI response, handling various formats"""
-        try:
-            # First try to parse directly as JSON
-            return json.loads(response)
-        except json.JSONDecodeError:
-            # Look for JSON array pattern
-            json_match = re.search(r'\[\s*\{.*?\}\s*\]', response, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group())
-                except json.JSONDecodeError:
-                    pass
-            
-            # Look for individual JSON objects
-            object_matches = re.findall(r'\{.*?\}', response, re.DOTALL)
-            if object_matches:
-                try:
-                    objects = []
-                    for match in object_matches:
-                        obj = json.loads(match)
-                        if "Img prompt" in obj:
-                            objects.append(obj)
-                    if len(objects) >= amount:
-                        return objects[:amount]
-                except json.JSONDecodeError:
-                    pass
-            
-            return None
-
     # --- Main logic ---
-    segments = parse_srt(subtitles_path)
+    segments = CueTable.load(subtitles_path)
     total_duration = get_total_duration(segments)
     
     # Define segment_duration for outer fallback
     segment_duration = total_duration / amount
 
-    full_script = " ".join([s['text'] for s in segments]) if segments else f"A video about {video_subject}"
+    full_script = " ".join(segments.texts()) if len(segments) else f"A video about {video_subject}"
 
     # Prepare GPT prompt with clearer instructions and example
     example_json = [
@@ -316,17 +486,17 @@ def get_image_search_terms(video_subject: str, amount: int, subtitles_path: str,
         print(colored(f"[*] Raw AI response for image prompts:", "yellow"))
         print(colored(response, "white"))
         
-        # Extract JSON from response
-        search_terms = extract_json_from_response(response)
-        
-        if not search_terms or not isinstance(search_terms, list):
-            print(colored("[!] Could not extract valid JSON from AI response, using fallback.", "yellow"))
-            search_terms = fallback_prompts(segments, amount)
-        elif len(search_terms) != amount:
-            print(colored(f"[!] AI returned {len(search_terms)} prompts but expected {amount}, using fallback.", "yellow"))
+        # Extract JSON from response. A truncated array keeps its complete
+        # prompts; the timeline fix below stretches them over the video.
+        try:
+            search_terms = parse_llm_json(response, validate_image_prompts)[:amount]
+            if len(search_terms) != amount:
+                print(colored(f"[!] AI returned {len(search_terms)} prompts but expected {amount}, using them.", "yellow"))
+            else:
+                print(colored(f"[+] Successfully generated {len(search_terms)} image prompts!", "green"))
+        except SchemaError as e:
+            print(colored(f"[!] Could not extract valid JSON from AI response ({e}), using fallback.", "yellow"))
             search_terms = fallback_prompts(segments, amount)
-        else:
-            print(colored(f"[+] Successfully generated {len(search_terms)} image prompts!", "green"))
 
         # Ensure timeline consistency
         if search_terms:
@@ -361,9 +531,60 @@ def get_image_search_terms(video_subject: str, amount: int, subtitles_path: str,
         return fallback_result
 
 
+# YouTube's limits for video metadata
+MAX_TITLE_LENGTH = 100
+MAX_DESCRIPTION_LENGTH = 5000
+MAX_TAGS_LENGTH = 500
+
+
+def validate_metadata(data) -> Tuple[str, str, List[str]]:
+    """
+    Validates and normalizes metadata returned by the model.
+
+    Args:
+        data: The parsed JSON object with "title", "description" and "tags".
+
+    Returns:
+        Tuple[str, str, List[str]]: The title, description and tags, trimmed
+            to YouTube's limits, with duplicate and empty tags dropped.
+
+    Raises:
+        ValueError: If a field is missing or has the wrong type.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Metadata is not a JSON object.")
+
+    title, description, tags = data.get("title"), data.get("description"), data.get("tags")
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("Metadata has no title.")
+    if not isinstance(description, str) or not description.strip():
+        raise ValueError("Metadata has no description.")
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError("Metadata tags are not a list of strings.")
+
+    # YouTube rejects angle brackets in titles and descriptions
+    title = " ".join(title.replace("<", "").replace(">", "").split())[:MAX_TITLE_LENGTH]
+    description = description.replace("<", "").replace(">", "").strip()[:MAX_DESCRIPTION_LENGTH]
+
+    keywords, seen, length = [], set(), 0
+    for tag in tags:
+        tag = " ".join(tag.strip().lstrip("#").replace(",", " ").split())
+        if not tag or tag.lower() in seen or length + len(tag) + 1 > MAX_TAGS_LENGTH:
+            continue
+        seen.add(tag.lower())
+        keywords.append(tag)
+        length += len(tag) + 1
+
+    return title, description, keywords
+
+
 def generate_metadata(video_subject: str, script: str, ai_model: str) -> Tuple[str, str, List[str]]:  
     """  
     Generate metadata for a YouTube video, including the title, description, and keywords.  
+    Everything comes from a single JSON request; if the model's answer
+    can't be used, the metadata falls back to the subject and the script.
   
     Args:  
         video_subject (str): The subject of the video.  
@@ -374,28 +595,33 @@ def generate_metadata(video_subject: str, script: str, ai_model: str) -> Tuple[s
         Tuple[str, str, List[str]]: The title, description, and keywords for the video.  
     """  
   
-    # Build prompt for title  
-    title_prompt = f"""  
-    Generate a catchy and SEO-friendly title for a YouTube shorts video about {video_subject}.  
-    """  
-  
-    # Generate title  
-    title = generate_response(title_prompt, ai_model).strip()  
-    
-    # Build prompt for description  
-    description_prompt = f"""  
-    Write a brief and engaging description for a YouTube shorts video about {video_subject}.  
-    The video is based on the following script:  
-    {script}  
-    """  
-  
-    # Generate description  
-    description = generate_response(description_prompt, ai_model).strip()  
-  
-    # Generate keywords  
-    keywords = get_image_search_terms(video_subject, 6, script, ai_model)  
+    prompt = f"""
+    Write the metadata for a YouTube shorts video about {video_subject}.
+    The video is based on the following script:
+    {script}
+
+    Return ONLY a JSON object with exactly these fields:
+    - "title": a catchy and SEO-friendly title, at most {MAX_TITLE_LENGTH} characters
+    - "description": a brief and engaging description of 2-3 sentences
+    - "tags": a JSON array of 5 to 10 short keywords
+
+    Example:
+    {{"title": "...", "description": "...", "tags": ["...", "..."]}}
+    """
+
+    try:
+        response = generate_response(prompt, ai_model, json_mode=True)
+        return parse_llm_json(response, validate_metadata)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        # Unusable JSON or every provider failing: metadata isn't worth failing the video over
+        print(colored(f"[!] Could not use the generated metadata ({e}), using fallback.", "yellow"))
 
-    return title, description, keywords  
+    title = video_subject.strip()[:MAX_TITLE_LENGTH] or "New video"
+    description = (script or title).strip()[:MAX_DESCRIPTION_LENGTH]
+    keywords = [word for word in dict.fromkeys(re.findall(r"\w+", video_subject.lower())) if len(word) > 2]
+    return title, description, keywords
 
 if __name__ == "__main__":
     subtitle_dir = r"D:\Projects\money printer\MoneyPrinter\subtitles"
@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from uuid import uuid4
+from typing import Callable, Optional
+
+from termcolor import colored
+from cancellation import CancelToken
+
+# Statuses a task can no longer leave
+FINISHED_STATUSES = ("success", "error", "cancelled")
+# Bounds of the janitor's sleep between eviction runs, in seconds
+JANITOR_MIN_INTERVAL = 30
+JANITOR_MAX_INTERVAL = 600
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when the queue is at capacity."""
+
+
+class JobQueue:
+    """
+    A persistent, priority-ordered job queue backed by SQLite, drained by a
+    fixed pool of worker threads.
+
+    Every task lives in one row, which doubles as its progress record for
+    the status endpoint. Finished tasks are evicted after `ttl` seconds.
+    Tasks that were processing when the process died are queued again on
+    the next start, up to `max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        handler: Callable[[str, dict, CancelToken], None],
+        workers: int = 2,
+        max_queued: int = 50,
+        ttl: float = 24 * 3600,
+        max_attempts: int = 3,
+        on_evict: Optional[Callable[[str], None]] = None,
+        on_change: Optional[Callable[[str, dict], None]] = None,
+    ):
+        """
+        Args:
+            db_path (str): Path to the SQLite database file.
+            handler (Callable): Called as handler(task_id, payload, cancel_token)
+                on a worker thread. It reports progress through update() and
+                should stop soon after the token is cancelled.
+            workers (int): Number of tasks processed at the same time.
+            max_queued (int): Number of waiting tasks above which submit()
+                rejects new ones.
+            ttl (float): Seconds a finished task is kept before eviction;
+                0 or less keeps finished tasks forever.
+            max_attempts (int): How many times a task is started before
+                it's given up on after repeated crashes.
+            on_evict (Callable): Optional, called with the id of every
+                task removed by TTL eviction.
+            on_change (Callable): Optional, called as on_change(task_id, task)
+                with the progress record (as returned by get()) after every
+                change to a task, whoever made it: the handler, a cancel, a
+                retry or the queue itself.
+        """
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.on_evict = on_evict
+        self.on_change = on_change
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                task_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                progress REAL,
+                current_video INTEGER,
+                total_videos INTEGER,
+                message TEXT,
+                data TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, priority, created_at)")
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._started = False
+        # Cancel tokens of the tasks currently being processed
+        self._tokens = {}
+
+    # ============================
+    # Lifecycle
+    # ============================
+    def start(self) -> None:
+        """Recovers interrupted tasks and starts the workers and the janitor."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        self._recover()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        if self.ttl > 0:
+            janitor = threading.Thread(target=self._janitor, name="job-janitor", daemon=True)
+            janitor.start()
+            self._threads.append(janitor)
+
+        print(colored(f"[+] Job queue started with {self.workers} workers", "green"))
+
+    def _recover(self) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'error', message = ?, updated_at = ? "
+                "WHERE status = 'processing' AND attempts >= ?",
+                ("Task crashed the server too many times, giving up.", now, self.max_attempts)
+            )
+            recovered = self._db.execute(
+                "UPDATE jobs SET status = 'queued', message = ?, updated_at = ? WHERE status = 'processing'",
+                ("Requeued after a server restart.", now)
+            ).rowcount
+        if recovered:
+            print(colored(f"[!] Requeued {recovered} interrupted task(s)", "yellow"))
+
+    # ============================
+    # Producer side
+    # ============================
+    def submit(self, payload: dict, priority: int = 0) -> str:
+        """
+        Queues a task.
+
+        Args:
+            payload (dict): JSON-serializable arguments for the handler.
+            priority (int): Higher priorities run first.
+
+        Returns:
+            str: The new task id.
+
+        Raises:
+            QueueFullError: If `max_queued` tasks are already waiting.
+        """
+        task_id = str(uuid4())
+        now = time.time()
+        with self._lock:
+            queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFullError(f"{queued} tasks are already waiting, try again later.")
+            self._db.execute(
+                "INSERT INTO jobs (task_id, payload, priority, status, progress, current_video, message, "
+                "created_at, updated_at) VALUES (?, ?, ?, 'queued', 0, 0, ?, ?, ?)",
+                (task_id, json.dumps(payload), priority, "Waiting for a free worker...", now, now)
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+        self._changed(task_id)
+        return task_id
+
+    def update(self, task_id: str, status: str, progress=None, current_video=None,
+               total_videos=None, message=None, data=None) -> None:
+        """Updates the progress record of a task. None leaves a field unchanged."""
+        fields = {"status": status, "updated_at": time.time()}
+        if progress is not None:
+            fields["progress"] = progress
+        if current_video is not None:
+            fields["current_video"] = current_video
+        if total_videos is not None:
+            fields["total_videos"] = total_videos
+        if message is not None:
+            fields["message"] = message
+        if data is not None:
+            fields["data"] = json.dumps(data)
+
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE task_id = ?", (*fields.values(), task_id))
+        self._changed(task_id)
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancels a task. A queued task is never started; a running task's
+        cancel token is triggered and the handler winds down.
+
+        Returns:
+            bool: False if the task is unknown or already finished.
+        """
+        with self._lock:
+            token = self._tokens.get(task_id)
+            if token is not None:
+                # The handler reports the cancellation once it has wound down
+                token.cancel()
+                return True
+            cancelled = self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', message = ?, updated_at = ? "
+                "WHERE task_id = ? AND status = 'queued'",
+                ("Video generation was cancelled.", time.time(), task_id)
+            ).rowcount > 0
+        if cancelled:
+            self._changed(task_id)
+        return cancelled
+
+    def retry(self, task_id: str) -> bool:
+        """
+        Queues a failed task again with its original payload.
+
+        Returns:
+            bool: False if the task is unknown or didn't fail.
+        """
+        with self._lock:
+            retried = self._db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = 0, message = ?, updated_at = ? "
+                "WHERE task_id = ? AND status = 'error'",
+                ("Queued again, resuming from the last checkpoint...", time.time(), task_id)
+            ).rowcount > 0
+        if retried:
+            with self._wakeup:
+                self._wakeup.notify()
+            self._changed(task_id)
+        return retried
+
+    def cancel_all(self) -> int:
+        """Cancels every queued and running task. Returns how many were cancelled."""
+        with self._lock:
+            for token in self._tokens.values():
+                token.cancel()
+            running = len(self._tokens)
+            queued = [row["task_id"] for row in
+                      self._db.execute("SELECT task_id FROM jobs WHERE status = 'queued'").fetchall()]
+            self._db.executemany(
+                "UPDATE jobs SET status = 'cancelled', message = ?, updated_at = ? "
+                "WHERE task_id = ? AND status = 'queued'",
+                [("Video generation was cancelled.", time.time(), task_id) for task_id in queued]
+            )
+        for task_id in queued:
+            self._changed(task_id)
+        return len(queued) + running
+
+    def _changed(self, task_id: str) -> None:
+        if self.on_change is None:
+            return
+        task = self.get(task_id)
+        if task is not None:
+            self.on_change(task_id, task)
+
+    def get(self, task_id: str) -> Optional[dict]:
+        """Returns the progress record of a task, or None if it's unknown or evicted."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            task = {
+                "status": row["status"],
+                "progress": row["progress"],
+                "current_video": row["current_video"],
+                "total_videos": row["total_videos"],
+                "message": row["message"],
+                "priority": row["priority"],
+            }
+            if row["data"] is not None:
+                task["data"] = json.loads(row["data"])
+            if row["status"] == "queued":
+                task["queue_position"] = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+                    "(priority > ? OR (priority = ? AND created_at < ?))",
+                    (row["priority"], row["priority"], row["created_at"])
+                ).fetchone()[0] + 1
+        return {key: value for key, value in task.items() if value is not None}
+
+    def stats(self) -> dict:
+        """Returns the number of tasks per status."""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def active_workers(self) -> int:
+        """Returns the number of workers currently processing a task."""
+        with self._lock:
+            return len(self._tokens)
+
+    # ============================
+    # Consumer side
+    # ============================
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Marks the next queued task as processing and registers its cancel token."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority DESC, created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'processing', attempts = attempts + 1, message = ?, "
+                        "updated_at = ? WHERE task_id = ?",
+                        ("Starting video generation...", time.time(), row["task_id"])
+                    )
+                    self._tokens[row["task_id"]] = CancelToken()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is not None:
+            self._changed(row["task_id"])
+        return row
+
+    def _work(self) -> None:
+        while True:
+            row = self._claim()
+            if row is None:
+                with self._wakeup:
+                    # The timeout also picks up tasks queued by other processes
+                    self._wakeup.wait(timeout=5)
+                continue
+
+            task_id = row["task_id"]
+            try:
+                self.handler(task_id, json.loads(row["payload"]), self._tokens[task_id])
+            except Exception as e:
+                print(colored(f"[-] Task {task_id} failed: {e}", "red"))
+                self.update(task_id, "error", message=str(e))
+            finally:
+                with self._lock:
+                    self._tokens.pop(task_id, None)
+
+            task = self.get(task_id)
+            if task is not None and task["status"] not in FINISHED_STATUSES:
+                self.update(task_id, "error", message="Task ended without reporting a result.")
+
+    def _janitor(self) -> None:
+        while True:
+            time.sleep(min(max(self.ttl, JANITOR_MIN_INTERVAL), JANITOR_MAX_INTERVAL))
+            self.evict_expired()
+
+    def evict_expired(self) -> int:
+        """Deletes finished tasks older than the TTL. Returns how many were deleted."""
+        if self.ttl <= 0:
+            return 0
+        placeholders = ", ".join("?" for _ in FINISHED_STATUSES)
+        condition = f"status IN ({placeholders}) AND updated_at < ?"
+        params = (*FINISHED_STATUSES, time.time() - self.ttl)
+        with self._lock:
+            expired = [row["task_id"] for row in
+                       self._db.execute(f"SELECT task_id FROM jobs WHERE {condition}", params).fetchall()]
+            self._db.execute(f"DELETE FROM jobs WHERE {condition}", params)
+
+        for task_id in expired:
+            if self.on_evict is not None:
+                self.on_evict(task_id)
+        if expired:
+            print(colored(f"[+] Evicted {len(expired)} finished task(s)", "cyan"))
+        return len(expired)
@@ -0,0 +1,210 @@
+import json
+import time
+import random
+import asyncio
+from typing import Iterator, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from termcolor import colored
+
+from metrics import EXTERNAL_FAILURES, EXTERNAL_RETRIES
+
+# Statuses worth retrying: rate limiting and server-side trouble
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class LLMError(Exception):
+    """Raised when a chat completion fails for good."""
+
+
+class LLMClient:
+    """
+    A client for an OpenAI-style /chat/completions endpoint, shared by
+    every thread of the process.
+
+    Connections are kept alive in a pool, so only the first request pays
+    for the TLS handshake. Every request has a timeout, and 429/5xx
+    responses and connection errors are retried with jittered exponential
+    backoff. There's a blocking interface (complete, stream)
+    and an asyncio one (acomplete).
+    """
+
+    def __init__(
+        self,
+        service: str,
+        base_url: str,
+        api_key: Optional[str],
+        connect_timeout: float = 10,
+        read_timeout: float = 120,
+        max_retries: int = 4,
+        backoff: float = 1.0,
+        max_backoff: float = 30,
+        pool_size: int = 16,
+    ):
+        """
+        Args:
+            service (str): Name used in logs and metrics, e.g. "deepseek".
+            base_url (str): API root, e.g. "https://api.deepseek.com".
+            api_key (str): Bearer token.
+            connect_timeout, read_timeout (float): Seconds.
+            max_retries (int): Retries after the first attempt.
+            backoff (float): Base delay in seconds, doubled per retry.
+            max_backoff (float): Upper bound of a single delay.
+            pool_size (int): Connections kept alive.
+        """
+        self.service = service
+        self.url = f"{base_url.rstrip('/')}/chat/completions"
+        self.api_key = api_key
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    # ============================
+    # Helpers
+    # ============================
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    @staticmethod
+    def _payload(prompt: str, model: str, **params) -> dict:
+        return {"model": model, "messages": [{"role": "user", "content": prompt}], **params}
+
+    def _delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Full-jitter backoff, unless the server said how long to wait."""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _retry_or_raise(self, attempt: int, error: str) -> None:
+        if attempt >= self.max_retries:
+            EXTERNAL_FAILURES.inc(service=self.service)
+            raise LLMError(f"{self.service}: {error} (gave up after {attempt + 1} attempts)")
+        EXTERNAL_RETRIES.inc(service=self.service)
+        print(colored(f"[!] {self.service}: {error}, retrying...", "yellow"))
+
+    @staticmethod
+    def _content(data: dict) -> str:
+        return data["choices"][0]["message"]["content"]
+
+    # ============================
+    # Blocking interface
+    # ============================
+    def complete(self, prompt: str, model: str, **params) -> str:
+        """
+        Sends one prompt and returns the reply text.
+
+        Raises:
+            LLMError: If the request still fails after all retries, or the
+                server rejected it with a status that isn't worth retrying.
+        """
+        payload = self._payload(prompt, model, **params)
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = self._session.post(self.url, headers=self._headers(), json=payload,
+                                          timeout=(self.connect_timeout, self.read_timeout))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._retry_or_raise(attempt, f"{type(e).__name__}: {e}")
+                time.sleep(self._delay(attempt))
+                continue
+
+            if resp.status_code in RETRY_STATUSES:
+                self._retry_or_raise(attempt, f"HTTP {resp.status_code}")
+                time.sleep(self._delay(attempt, resp.headers.get("Retry-After")))
+                continue
+            if resp.status_code >= 400:
+                EXTERNAL_FAILURES.inc(service=self.service)
+                raise LLMError(f"{self.service}: HTTP {resp.status_code}: {resp.text[:500]}")
+            return self._content(resp.json())
+
+    def stream(self, prompt: str, model: str, **params) -> Iterator[str]:
+        """
+        Sends one prompt and yields the reply as it's generated, one text
+        delta at a time. Only connecting is retried: once text has been
+        yielded, a broken stream raises instead of starting over.
+
+        Raises:
+            LLMError: As complete(), or if the stream breaks off.
+        """
+        payload = self._payload(prompt, model, stream=True, **params)
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = self._session.post(self.url, headers=self._headers(), json=payload, stream=True,
+                                          timeout=(self.connect_timeout, self.read_timeout))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._retry_or_raise(attempt, f"{type(e).__name__}: {e}")
+                time.sleep(self._delay(attempt))
+                continue
+
+            if resp.status_code in RETRY_STATUSES:
+                resp.close()
+                self._retry_or_raise(attempt, f"HTTP {resp.status_code}")
+                time.sleep(self._delay(attempt, resp.headers.get("Retry-After")))
+                continue
+            if resp.status_code >= 400:
+                EXTERNAL_FAILURES.inc(service=self.service)
+                raise LLMError(f"{self.service}: HTTP {resp.status_code}: {resp.text[:500]}")
+            break
+
+        # Event streams are UTF-8, but without a charset in Content-Type
+        # (local servers often leave it out) requests would decode ISO-8859-1
+        resp.encoding = "utf-8"
+        with resp:
+            try:
+                for line in resp.iter_lines(decode_unicode=True):
+                    # Server-Sent Events; lines starting with ':' are keep-alives
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    delta = json.loads(data)["choices"][0]["delta"].get("content")
+                    if delta:
+                        yield delta
+            except (requests.RequestException, ValueError) as e:
+                EXTERNAL_FAILURES.inc(service=self.service)
+                raise LLMError(f"{self.service}: stream broke off: {e}")
+
+    # ============================
+    # asyncio interface
+    # ============================
+    async def acomplete(self, prompt: str, model: str, **params) -> str:
+        """
+        asyncio version of complete(). Every call opens and closes its own
+        aiohttp session: a session is bound to one event loop, and one
+        kept per loop would leak with every asyncio.run().
+        """
+        payload = self._payload(prompt, model, **params)
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+        ) as session:
+            return await self._apost(session, payload)
+
+    async def _apost(self, session: aiohttp.ClientSession, payload: dict) -> str:
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with session.post(self.url, headers=self._headers(), json=payload) as resp:
+                    if resp.status in RETRY_STATUSES:
+                        self._retry_or_raise(attempt, f"HTTP {resp.status}")
+                        await asyncio.sleep(self._delay(attempt, resp.headers.get("Retry-After")))
+                        continue
+                    if resp.status >= 400:
+                        EXTERNAL_FAILURES.inc(service=self.service)
+                        raise LLMError(f"{self.service}: HTTP {resp.status}: {(await resp.text())[:500]}")
+                    return self._content(await resp.json())
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self._retry_or_raise(attempt, f"{type(e).__name__}: {e}")
+                await asyncio.sleep(self._delay(attempt))
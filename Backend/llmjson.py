@@ -0,0 +1,349 @@
+"""
+Tolerant JSON extraction for LLM responses.
+
+Models wrap JSON in code fences and prose, leave trailing commas, put raw
+newlines inside strings and get cut off mid-array. JsonExtractor finds
+the JSON values in such text in a linear scan of the characters, repairing
+these mistakes on the way, and can be fed a streamed response chunk by
+chunk. The validators turn the parsed values into the types the pipeline
+expects, or raise SchemaError.
+
+Run `python llmjson.py` for a benchmark against the previous regex-based
+recovery.
+"""
+import re
+import json
+from typing import Any, Callable, Iterable, List, Optional
+
+_CLOSERS = {"[": "]", "{": "}"}
+# A number or literal at the end of cut-off text, after its separator
+_TRAILING_SCALAR = re.compile(r"[\[,:]\s*(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null)\s*$")
+
+
+class SchemaError(ValueError):
+    """Raised when an LLM response holds no value matching the expected schema."""
+
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    i = len(out) - 1
+    while i >= 0 and out[i].isspace():
+        i -= 1
+    if i >= 0 and out[i] == ",":
+        del out[i]
+
+
+class JsonExtractor:
+    """
+    Extracts JSON arrays and objects from text that also contains other
+    things. Feed it text with feed(), then call close() once the text is
+    complete; both return the values completed so far.
+
+    Repairs on the way:
+    - anything outside the outermost brackets (prose, ``` fences) is skipped
+    - trailing commas before ] and } are dropped
+    - raw newlines inside strings are escaped
+    - a value cut off at the end (or by a closing fence) keeps its complete
+      elements, e.g. '["a", "b", "c' gives ["a", "b"], and a number it
+      ends in, e.g. '[1, 2, 3' gives [1, 2, 3]
+
+    Bracketed text that turns out not to be JSON, like "[citation needed]",
+    is scanned again from just after its opening bracket for values nested
+    inside it. Brackets nested deeper than MAX_DEPTH are given up on, which
+    keeps the rescans, and so the whole extraction, linear in the text.
+    """
+
+    MAX_DEPTH = 64
+
+    def __init__(self):
+        # The text from the opening bracket of the current value on, and
+        # the offset of the next character to scan in it
+        self._text = ""
+        self._pos = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._out = []
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        # Whether the token being read at depth 1 is an element or object
+        # value (not a key), so it may end a truncated value
+        self._is_value = False
+        # Length of _out after the last complete element of the outer value
+        self._safe = None
+
+    def feed(self, text: str) -> List[Any]:
+        values = []
+        self._text += text
+        self._scan(values)
+        return values
+
+    def close(self) -> List[Any]:
+        values = []
+        while self._stack:
+            self._finish_truncated(values)
+            self._scan(values)
+        self._text, self._pos = "", 0
+        return values
+
+    def _scan(self, values: List[Any]) -> None:
+        while self._pos < len(self._text):
+            c = self._text[self._pos]
+            self._pos += 1
+            self._step(c, values)
+        # Only the current value may still need a rescan
+        if self._stack:
+            if self._start:
+                self._text, self._pos = self._text[self._start:], self._pos - self._start
+                self._start = 0
+        else:
+            self._text, self._pos = "", 0
+
+    def _rescan(self) -> None:
+        """Drops the current value and scans on from just after its opening bracket."""
+        self._pos = self._start + 1
+        self._reset()
+
+    def _step(self, c: str, values: List[Any]) -> None:
+        if not self._stack:
+            if c in _CLOSERS:
+                self._start = self._pos - 1
+                self._stack.append(_CLOSERS[c])
+                self._is_value = c == "["
+                self._out.append(c)
+            return
+
+        out = self._out
+        depth = len(self._stack)
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif c == "\\":
+                self._escape = True
+            elif c == '"':
+                self._in_string = False
+                if depth == 1 and self._is_value:
+                    self._safe = len(out) + 1
+            elif c == "\n":
+                out.append("\\n")
+                return
+            out.append(c)
+        elif c == '"':
+            self._in_string = True
+            out.append(c)
+        elif c in _CLOSERS:
+            if depth == self.MAX_DEPTH:
+                # No model nests this deep: not JSON, and not worth rescanning
+                self._reset()
+                return
+            self._stack.append(_CLOSERS[c])
+            out.append(c)
+        elif c in "]}":
+            _drop_trailing_comma(out)
+            # A mismatched bracket is taken as the one that was expected
+            out.append(self._stack.pop())
+            if not self._stack:
+                self._emit("".join(out), values)
+            elif depth == 2 and self._is_value:
+                self._safe = len(out)
+        elif c == "`":
+            # A closing code fence: the value was cut off
+            self._finish_truncated(values)
+        else:
+            if depth == 1:
+                if c == ",":
+                    if self._is_value:
+                        self._safe = len(out)
+                    self._is_value = self._stack[0] == "]"
+                elif c == ":":
+                    self._is_value = True
+                elif c.isspace() and self._is_value and out and (out[-1].isalnum() or out[-1] == "."):
+                    # Whitespace after a number or literal ends it
+                    self._safe = len(out)
+            out.append(c)
+
+    def _emit(self, text: str, values: List[Any]) -> None:
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError:
+            # Not JSON after all; look for values inside it
+            self._rescan()
+            return
+        self._reset()
+        values.append(value)
+
+    def _finish_truncated(self, values: List[Any]) -> None:
+        if len(self._stack) == 1 and self._is_value and not self._in_string:
+            # A number the text ends in is kept as it stands, like a cut-off
+            # "[1, 2, 3" giving [1, 2, 3]
+            tail = "".join(self._out[-64:])
+            if _TRAILING_SCALAR.search(tail):
+                self._safe = len(self._out)
+        if self._safe is None:
+            self._rescan()
+            return
+        out = self._out[:self._safe]
+        _drop_trailing_comma(out)
+        out.append(self._stack[0])
+        self._emit("".join(out), values)
+
+
+def extract_json(text: str) -> List[Any]:
+    """Returns every JSON array or object found in `text`, in order."""
+    extractor = JsonExtractor()
+    return extractor.feed(text or "") + extractor.close()
+
+
+def parse_llm_json(text: str, validate: Callable[[Any], Any]) -> Any:
+    """
+    Returns validate(value) for the first JSON value in an LLM response
+    that passes validation.
+
+    Args:
+        text (str): The raw response.
+        validate (Callable): Raises ValueError for values of the wrong shape.
+
+    Raises:
+        SchemaError: If no value in the response passes validation.
+    """
+    errors = []
+    for value in extract_json(text):
+        try:
+            return validate(value)
+        except ValueError as e:
+            errors.append(str(e))
+    raise SchemaError(f"No valid JSON in response ({'; '.join(errors) or 'nothing found'})")
+
+
+# ============================
+# Schemas
+# ============================
+def validate_search_terms(value: Any, max_terms: Optional[int] = None) -> List[str]:
+    """
+    A JSON array of search terms: non-empty strings, deduplicated ignoring
+    case, in order. Arrays of {"term": ...} objects are accepted too.
+    """
+    if not isinstance(value, list):
+        raise SchemaError("Search terms are not a JSON array.")
+    terms, seen = [], set()
+    for item in value:
+        if isinstance(item, dict):
+            item = next((v for v in item.values() if isinstance(v, str)), None)
+        if not isinstance(item, str):
+            raise SchemaError(f"Search term is not a string: {item!r}")
+        term = " ".join(item.split())
+        if term and term.lower() not in seen:
+            seen.add(term.lower())
+            terms.append(term)
+    if not terms:
+        raise SchemaError("No search terms in the array.")
+    return terms[:max_terms] if max_terms else terms
+
+
+_PROMPT_KEYS = ("Img prompt", "img prompt", "Img_prompt", "img_prompt", "image prompt", "prompt")
+
+
+def validate_image_prompts(value: Any, amount: Optional[int] = None) -> List[dict]:
+    """
+    A JSON array of timed image prompts: objects with a non-empty
+    "Img prompt" string and numeric "start" and "end" (numeric strings are
+    converted), with start <= end. If `amount` is given, exactly that many.
+    """
+    if isinstance(value, dict):
+        # {"prompts": [...]} and similar wrappers
+        value = next((v for v in value.values() if isinstance(v, list)), value)
+    if not isinstance(value, list):
+        raise SchemaError("Image prompts are not a JSON array.")
+
+    prompts = []
+    for item in value:
+        if not isinstance(item, dict):
+            raise SchemaError(f"Image prompt is not an object: {item!r}")
+        text = next((item[key] for key in _PROMPT_KEYS if isinstance(item.get(key), str)), None)
+        if not text or not text.strip():
+            raise SchemaError(f"Image prompt has no text: {item!r}")
+        try:
+            start, end = float(item["start"]), float(item["end"])
+        except (KeyError, TypeError, ValueError):
+            raise SchemaError(f"Image prompt has no valid timing: {item!r}")
+        if end < start:
+            raise SchemaError(f"Image prompt ends before it starts: {item!r}")
+        prompts.append({"Img prompt": text.strip(), "start": start, "end": end})
+
+    if amount is not None and len(prompts) != amount:
+        raise SchemaError(f"Expected {amount} image prompts, got {len(prompts)}.")
+    return prompts
+
+
+# ============================
+# Benchmark
+# ============================
+# Malformed responses of the shapes we get back from the models
+BENCHMARK_CORPUS = [
+    '["black hole", "event horizon", "galaxy"]',
+    '```json\n["black hole", "event horizon", "galaxy"]\n```',
+    'Sure! Here are the search terms:\n["black hole", "event horizon", "galaxy"]\nLet me know if you need more.',
+    '["black hole", "event horizon", "galaxy",]',
+    '["black hole", "event horizon", "gal',
+    '```json\n["black hole", "event horizon",\n```',
+    'Here are [3] terms: ["black hole", "event horizon", "galaxy"]',
+    '[\n  {"Img prompt": "a black hole swallowing a star", "start": 0, "end": 4.5},\n'
+    '  {"Img prompt": "a glowing accretion disk", "start": 4.5, "end": 9},\n]',
+    '```json\n[{"Img prompt": "a black hole", "start": 0, "end": 4.5}, '
+    '{"Img prompt": "a glowing\naccretion disk", "start": 4.5, "end": 9}]\n```',
+    'The prompts: [{"Img prompt": "a black hole", "start": 0, "end": 4.5}, '
+    '{"Img prompt": "an accretion disk", "start": 4.5, "end": 9}, {"Img prompt": "a neutron st',
+]
+
+
+def _legacy_parse(response: str) -> Optional[list]:
+    """The recovery main.safe_parse_json and get_image_search_terms used to do."""
+    import re
+    try:
+        return json.loads(response)
+    except json.JSONDecodeError:
+        for pattern in (r'\[\s*\{.*?\}\s*\]', r'\[.*\]'):
+            match = re.search(pattern, response, re.DOTALL)
+            if match:
+                try:
+                    return json.loads(match.group())
+                except json.JSONDecodeError:
+                    pass
+        return None
+
+
+def _benchmark(corpus: Iterable[str], rounds: int = 2000) -> None:
+    import time
+
+    def validate(value):
+        try:
+            return validate_image_prompts(value)
+        except SchemaError:
+            return validate_search_terms(value)
+
+    corpus = list(corpus)
+    for name, parse in (
+        ("legacy regex", _legacy_parse),
+        ("JsonExtractor", lambda text: parse_llm_json(text, validate)),
+    ):
+        parsed = 0
+        for text in corpus:
+            try:
+                value = parse(text)
+                validate(value)
+                parsed += 1
+            except (ValueError, TypeError):
+                pass
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in corpus:
+                try:
+                    parse(text)
+                except ValueError:
+                    pass
+        per_response = (time.perf_counter() - start) / (rounds * len(corpus)) * 1e6
+        print(f"{name:>14}: {parsed}/{len(corpus)} usable, {per_response:.1f} µs per response")
+
+
+if __name__ == "__main__":
+    _benchmark(BENCHMARK_CORPUS)
@@ -6,6 +6,8 @@ from moviepy.editor import VideoFileClip, ColorClip, CompositeVideoClip, ImageCl
 from moviepy.video.fx.all import resize
 from gradio_client import Client, handle_file
 from dotenv import load_dotenv
+from utils import gradio_lock
+from progress import render_logger
 
 # Load environment variables
 load_dotenv("../.env")
@@ -15,7 +17,8 @@ TIKTOK_WIDTH = 720
 TIKTOK_HEIGHT = 1280
 
 # Initialize Gradio client for local LTX
-client = Client("http://localhost:7860/")
+GRADIO_URL = "http://localhost:7860/"
+client = Client(GRADIO_URL)
 
 def safe_predict(step_name, **kwargs):
     """Safe wrapper for Gradio client predictions"""
@@ -27,11 +30,11 @@ def safe_predict(step_name, **kwargs):
         print(f"[FAIL] {step_name} -> {e}")
         return None
 
-def copy_video_from_gradio_temp(gradio_temp_path: str) -> str:
+def copy_video_from_gradio_temp(gradio_temp_path: str, output_dir: str = None) -> str:
     """
     Copy the generated video from Gradio's temp directory to our temp folder
     """
-    output_dir = os.path.join(os.path.dirname(__file__), "../temp")
+    output_dir = output_dir or os.path.join(os.path.dirname(__file__), "../temp")
     os.makedirs(output_dir, exist_ok=True)
     
     file_extension = os.path.splitext(gradio_temp_path)[1] or '.mp4'
@@ -45,12 +48,18 @@ def copy_video_from_gradio_temp(gradio_temp_path: str) -> str:
         print(f"[-] Error copying video: {e}")
         return None
 
-def generate_video_from_image_local_ltx(image_path, prompt, duration=4, contentType=None):
+def generate_video_from_image_local_ltx(image_path, prompt, duration=4, contentType=None, output_dir="../temp"):
     """
     Generate a short video from an image using local LTX-Video.
     Returns path to the generated video. If generation fails, creates fallback video from image.
     """
-    output_path = f"../temp/{uuid.uuid4()}.mp4"
+    # Same Gradio server as the Flux images; its UI state is shared, so take turns
+    with gradio_lock(GRADIO_URL):
+        return _generate_video_from_image_local_ltx(image_path, prompt, duration, contentType, output_dir)
+
+
+def _generate_video_from_image_local_ltx(image_path, prompt, duration, contentType, output_dir):
+    output_path = f"{output_dir}/{uuid.uuid4()}.mp4"
     
     try:
         print(colored(f"🎬 Starting local LTX video generation for: {os.path.basename(image_path)}", "blue"))
@@ -256,7 +265,7 @@ def generate_video_from_image_local_ltx(image_path, prompt, duration=4, contentT
         # --- Step 12: Copy the video to our temp folder ---
         local_video_path = None
         if gradio_video_path and os.path.exists(gradio_video_path):
-            local_video_path = copy_video_from_gradio_temp(gradio_video_path)
+            local_video_path = copy_video_from_gradio_temp(gradio_video_path, output_dir)
         else:
             print(colored("⚠️ No video path found in results, searching Gradio temp directory...", "yellow"))
             
@@ -274,7 +283,7 @@ def generate_video_from_image_local_ltx(image_path, prompt, duration=4, contentT
                     latest_video = max(video_files, key=lambda x: x[1])
                     gradio_video_path = latest_video[0]
                     print(colored(f"✅ Found latest video: {gradio_video_path}", "green"))
-                    local_video_path = copy_video_from_gradio_temp(gradio_video_path)
+                    local_video_path = copy_video_from_gradio_temp(gradio_video_path, output_dir)
 
         # --- Step 13: Cleanup ---
         safe_predict("Unload model", api_name="/unload_model_if_needed")
@@ -300,9 +309,11 @@ def generate_video_from_image_local_ltx(image_path, prompt, duration=4, contentT
         fallback_clip.write_videofile(output_path, fps=30, threads=1)
         return output_path
 
-def create_video_from_images_with_local_ltx(image_paths, image_prompts_with_timing, audio_duration, contentType=None):
+def create_video_from_images_with_local_ltx(image_paths, image_prompts_with_timing, audio_duration, contentType=None,
+                                            output_dir="../temp", cancel_token=None, journal=None):
     """
     Combine multiple images into a TikTok video using local LTX-Video with fallback handling.
+    If a stages.Journal is given, every generated clip is recorded in it and reused on a retry.
     """
     print("image prompt============timing",image_prompts_with_timing)
     video_clips = []
@@ -313,6 +324,8 @@ def create_video_from_images_with_local_ltx(image_paths, image_prompts_with_timi
     valid_prompts = image_prompts_with_timing[:min_len]
 
     for i, img_path in enumerate(image_paths):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
         prompt = valid_prompts[i].get("Img prompt", "Cinematic transformation")
         start_time = valid_prompts[i].get("start", 0)
         end_time = valid_prompts[i].get("end", start_time + 4)
@@ -321,7 +334,11 @@ def create_video_from_images_with_local_ltx(image_paths, image_prompts_with_timi
         print(colored(f"🎬 Generating video from image {img_path} ({duration}s) with prompt: {prompt[:50]}...", "blue"))
         
         # Use local LTX instead of Hugging Face API
-        video_path = generate_video_from_image_local_ltx(img_path, prompt, duration, contentType)
+        generate = lambda: generate_video_from_image_local_ltx(img_path, prompt, duration, contentType, output_dir)
+        if journal is not None:
+            video_path = journal.memo(f"ltx/{os.path.basename(img_path)}/{duration}", generate)
+        else:
+            video_path = generate()
 
         # Load clip and apply TikTok format adjustments (same as before)
         if video_path and os.path.exists(video_path):
@@ -349,10 +366,11 @@ def create_video_from_images_with_local_ltx(image_paths, image_prompts_with_timi
         final_clip = CompositeVideoClip(video_clips).set_duration(audio_duration)
 
     # Save final video
-    output_file = f"../temp/final_combined_video_{uuid.uuid4()}.mp4"
-    final_clip.write_videofile(output_file, fps=30, threads=1)
+    output_file = f"{output_dir}/final_combined_video_{uuid.uuid4()}.mp4"
+    final_clip.write_videofile(output_file, fps=30, threads=1, logger=render_logger(cancel_token) or "bar")
     print(colored("🧹 Unloading model after full video generation...", "yellow"))
-    safe_predict("Unload model", api_name="/unload_model_if_needed")
+    with gradio_lock(GRADIO_URL):
+        safe_predict("Unload model", api_name="/unload_model_if_needed")
     return output_file
 
 def main():
@@ -1,23 +1,21 @@
 import os
-import json
-import re
-from uuid import uuid4
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
-from ltx import create_video_from_images_with_local_ltx
-from autotts import tts_hf
-from search import search_for_stock_videos
 from termcolor import colored
 from moviepy.config import change_settings
-from moviepy.editor import AudioFileClip
 from dotenv import load_dotenv
-from gemini import generate_flux_image
-from utils import clean_dir, check_env_vars
-from gpt import generate_script, generate_metadata, get_image_search_terms, get_search_terms
-from video import combine_videos, generate_subtitles, generate_video, save_video
-from youtube import upload_video
-from apiclient.errors import HttpError
+from utils import check_env_vars, create_workspace, remove_workspace, workspace_path
+from pipeline import STAGE_MESSAGES, generate_short as run_short_pipeline
+from stages import Journal
+from gpt import generate_scripts
+from jobqueue import JobQueue, QueueFullError, FINISHED_STATUSES
+from catalog import VideoCatalog
+from cancellation import JobCancelled
+from progress import ProgressBroker, format_sse
+from metrics import REGISTRY, QUEUE_DEPTH, ACTIVE_WORKERS
+import queue
 import threading
+from concurrent.futures import ThreadPoolExecutor
 load_dotenv("../.env")
 check_env_vars()
 SESSION_ID = os.getenv("TIKTOK_SESSION_ID")
@@ -36,12 +34,18 @@ CORS(
 )
 HOST = "0.0.0.0"
 PORT = 8000
+DEBUG = True
 
-AMOUNT_OF_STOCK_VIDEOS = 8
-GENERATING = False
+# How many shorts of one task are in flight at the same time. CPU-heavy
+# stages are additionally bounded by the cpu pool of scheduler.py, so this
+# can be higher than the number of renders the machine can handle.
+MAX_PARALLEL_SHORTS = int(os.getenv("MAX_PARALLEL_SHORTS", 4))
 
 GENERATED_VIDEOS_DIR = os.path.abspath("../Generated_Video")
 os.makedirs(GENERATED_VIDEOS_DIR, exist_ok=True)
+video_catalog = VideoCatalog(os.path.abspath("../catalog.db"), GENERATED_VIDEOS_DIR)
+# Rendered videos never change, so clients may cache them for a day
+VIDEO_MAX_AGE = 24 * 3600
 
 SONGS_DIR = os.path.abspath("../Songs")
 os.makedirs(SONGS_DIR, exist_ok=True)
@@ -50,37 +54,18 @@ VOICE_DIR = os.path.abspath("../voice")
 os.makedirs(VOICE_DIR, exist_ok=True)
 
 
-# ============================
-# Helper: Safe JSON parsing
-# ============================
-def safe_parse_json(response: str):
-    try:
-        return json.loads(response)
-    except json.JSONDecodeError:
-        match = re.search(r'\[.*\]', response, re.DOTALL)
-        if match:
-            try:
-                return json.loads(match.group())
-            except json.JSONDecodeError:
-                return []
-        return []
-
-active_tasks = {}
-
-def update_task_progress(task_id, status, progress=None, current_video=None, total_videos=None, message=None):
-    """Update task progress in the shared dictionary"""
-    if task_id not in active_tasks:
-        active_tasks[task_id] = {}
-    
-    active_tasks[task_id]["status"] = status
-    if progress is not None:
-        active_tasks[task_id]["progress"] = progress
-    if current_video is not None:
-        active_tasks[task_id]["current_video"] = current_video
-    if total_videos is not None:
-        active_tasks[task_id]["total_videos"] = total_videos
-    if message is not None:
-        active_tasks[task_id]["message"] = message
+progress_broker = ProgressBroker()
+
+def update_task_progress(task_id, status, progress=None, current_video=None, total_videos=None, message=None,
+                         data=None):
+    """Update task progress in the job queue; the queue pushes it to event stream listeners"""
+    job_queue.update(task_id, status, progress=progress, current_video=current_video,
+                     total_videos=total_videos, message=message, data=data)
+
+
+def publish_status(task_id, task):
+    """Push a task's progress record to its event stream listeners"""
+    progress_broker.publish(task_id, {"type": "status", **task})
 
 # ===========================================
 # Video generation endpoint - IMMEDIATE RESPONSE
@@ -88,29 +73,22 @@ def update_task_progress(task_id, status, progress=None, current_video=None, tot
 @app.route("/api/generate", methods=["POST"])
 def generate():
     data = request.get_json()
-    task_id = str(uuid4())
-    
-    # Initialize task
-    update_task_progress(task_id, "processing", progress=0, current_video=0, message="Starting video generation...")
-    
-    # Start processing in background thread
-    thread = threading.Thread(target=background_generation, args=(task_id, data))
-    thread.daemon = True
-    thread.start()
+
+    try:
+        task_id = job_queue.submit(data, priority=int(data.get("priority", 0)))
+    except QueueFullError as e:
+        return jsonify({"status": "error", "message": str(e)}), 429
     
     # Return immediate response to prevent timeout
     return jsonify({
-        "status": "processing", 
-        "message": "Video generation has started. Check back in 5–10 minutes for results.",
+        "status": "queued", 
+        "message": "Video generation has been queued. Check back in 5–10 minutes for results.",
         "task_id": task_id
     })
 
-def background_generation(task_id, data):
+def background_generation(task_id, data, cancel_token):
     """Background task that contains your original generation logic"""
-    global GENERATING
     try:
-        GENERATING = True
-        
         # =================================================
         # YOUR ORIGINAL GENERATION CODE STARTS HERE
         # =================================================
@@ -142,196 +120,107 @@ def background_generation(task_id, data):
         if use_custom_prompts:
             print(colored(f"   Custom prompts count: {len(custom_prompts)}", "blue"))
 
-        generated_video_paths = []
-        
+        update_task_progress(task_id, "processing", progress=10, total_videos=amountofshorts)
+
+        # Write every script up front, concurrently and distinct from each
+        # other, so no short waits on the LLM between renders. Journaled, so
+        # a retried task keeps its scripts.
+        if not use_custom_prompts and amountofshorts > 1:
+            update_task_progress(task_id, "processing", message=f"Writing {amountofshorts} scripts...")
+            task_journal = Journal(os.path.join(create_workspace(task_id), "journal.json"))
+            custom_prompts = task_journal.memo(
+                "scripts",
+                lambda: generate_scripts(video_subject, amountofshorts, paragraph_number, ai_model)
+            )
+            use_custom_prompts = True
+
+        def generate_short(video_index):
+            """Runs the stage graph for one short in its own workspace."""
+            # Check for cancellation before starting each video
+            cancel_token.raise_if_cancelled()
+
+            print(colored(f"\n[+] Generating video {video_index + 1} of {amountofshorts}", "green"))
+
+            def on_stage_progress(stage_name, step, done, total):
+                progress_broker.publish(task_id, {
+                    "type": "progress",
+                    "video": video_index + 1,
+                    "stage": stage_name,
+                    "step": step,
+                    "done": done,
+                    "total": total,
+                })
+
+            def on_stage_event(stage_name, event):
+                progress_broker.publish(task_id, {
+                    "type": "stage",
+                    "video": video_index + 1,
+                    "stage": stage_name,
+                    "event": event,
+                })
+                if event == "started" and stage_name in STAGE_MESSAGES:
+                    update_task_progress(
+                        task_id, "processing",
+                        message=f"Video {video_index + 1} of {amountofshorts}: {STAGE_MESSAGES[stage_name]}"
+                    )
+
+            # The workspace and its journal survive failures, so a retry
+            # of this task resumes each short at its first unfinished stage
+            options = {
+                "video_subject": video_subject,
+                "paragraph_number": paragraph_number,
+                "ai_model": ai_model,
+                "custom_prompt": custom_prompts[video_index] if use_custom_prompts else None,
+                "voice": voice,
+                "contentType": contentType,
+                "subtitles_position": subtitles_position,
+                "text_color": text_color,
+                "songsName": songsName,
+                "automate_youtube_upload": automate_youtube_upload,
+            }
+            result = run_short_pipeline(options, create_workspace(task_id, video_index), cancel_token,
+                                        on_event=on_stage_event, on_progress=on_stage_progress,
+                                        catalog=video_catalog, source=task_id)
+            if result.video is None:
+                return None
+
+            final_video_path = result.video
+            print(colored(f"[+] Video {video_index + 1} generated: {final_video_path}!", "green"))
+            return final_video_path
+
         # ============================
-        # LOOP GENERATION
+        # PARALLEL GENERATION
         # ============================
-        for video_index in range(amountofshorts):
-            # Check for cancellation at the start of each video
-            if not GENERATING:
-                update_task_progress(task_id, "cancelled", message="Video generation was cancelled.")
-                break
-                
-            print(colored(f"\n[+] Generating video {video_index + 1} of {amountofshorts}", "green"))
-            
-            # Update progress for current video
-            progress = 10 + (video_index / amountofshorts) * 80
-            update_task_progress(
-                task_id, 
-                "processing", 
-                progress=progress,
-                current_video=video_index + 1,
-                total_videos=amountofshorts,
-                message=f"Generating video {video_index + 1} of {amountofshorts}"
-            )
-            
-            # Clean temp directories for each video
-            clean_dir("../temp/")
-            clean_dir("../subtitles/")
-
-            # ============================
-            # Generate script
-            # ============================
-            update_task_progress(task_id, "processing", message="Generating script...")
-            
-            if use_custom_prompts:
-                script = custom_prompts[video_index]  # use specific custom prompt
-                print(colored(f"   Using custom prompt: {script[:100]}...", "blue"))
-            else:
-                script = generate_script(
-                    video_subject, 
-                    paragraph_number, 
-                    ai_model, 
-                    None  # no custom prompt in traditional flow
-                )
-                print(colored(f"   Generated script: {script[:100]}...", "blue"))
-
-            # ============================
-            # Generate TTS Audio
-            # ============================
-            update_task_progress(task_id, "processing", message="Generating audio...")
-            
-            # Save the full script as one TTS clip
-            tts_path = f"../temp/{uuid4()}.mp3"
-            voice_path = f"../voice/{voice}" if voice else "../voice/Michel.mp3"
-            tts_hf(script, output_file=tts_path, audio_prompt=voice_path)
-            final_audio = AudioFileClip(tts_path)
-
-            # ===================================
-            # Generate subtitles With Time Stamp
-            # ==================================
-            update_task_progress(task_id, "processing", message="Generating subtitles...")
-            
-            try:
-                subtitles_path = generate_subtitles(
-                    audio_path=tts_path,
+        generated_video_paths = []
+        finished = 0
+        progress_lock = threading.Lock()
+
+        def run_short(video_index):
+            nonlocal finished
+            path = generate_short(video_index)
+            with progress_lock:
+                finished += 1
+                if path:
+                    generated_video_paths.append(path)
+                update_task_progress(
+                    task_id,
+                    "processing",
+                    progress=10 + (finished / amountofshorts) * 80,
+                    current_video=finished,
+                    total_videos=amountofshorts,
+                    message=f"Finished {finished} of {amountofshorts} videos"
                 )
-            except Exception as e:
-                print(colored(f"[-] Error generating subtitles: {e}", "red"))
-                subtitles_path = None
-
-            # ============================
-            # Fetch media based on contentType
-            # ============================
-            update_task_progress(task_id, "processing", message="Fetching media content...")
-            
-            media_paths = []
-            image_prompts = []
-            
-            if contentType == "stock":
-                search_terms = get_search_terms(video_subject, AMOUNT_OF_STOCK_VIDEOS, script, ai_model)
-                video_urls = []
-                for term in search_terms:
-                    found = search_for_stock_videos(term, os.getenv("PEXELS_API_KEY"), it=15, min_dur=10)
-                    for url in found:
-                        if url not in video_urls:
-                            video_urls.append(url)
-                            break
-                if not video_urls:
-                    print(colored("[-] No stock videos found for this video.", "red"))
-                    continue
-                media_paths = [save_video(url) for url in video_urls]
-            else:
-                # Generative content flow
-                image_prompts = get_image_search_terms(video_subject, AMOUNT_OF_STOCK_VIDEOS, subtitles_path, ai_model)
-                for term_data in image_prompts:
-                    prompt = term_data["Img prompt"] if isinstance(term_data, dict) else term_data
-                    try:
-                        generated = generate_flux_image(prompt, contentType)
-                        if generated:  # make sure it's not None
-                            media_paths.append(generated)
-                        if len(media_paths) >= AMOUNT_OF_STOCK_VIDEOS:
-                            break
-                    except Exception as e:
-                        print(f"Could not generate image: {e}")
-
-                if not media_paths:
-                    print(colored("[-] No images generated for this video.", "red"))
-                    continue
-                print(colored(f"[+] {len(media_paths)} images generated!", "green"))
-
-            print(colored("[+] Script generated!\n", "green"))
-
-            # ============================
-            # Create video
-            # ============================
-            update_task_progress(task_id, "processing", message="Creating video...")
-            
-            n_threads = 1
-            
-            if contentType == "stock":
-                # Stock videos: combine downloaded video clips
-                temp_audio = AudioFileClip(tts_path)
-                combined_video_path = combine_videos(media_paths, temp_audio.duration, 3, n_threads)
-                temp_audio.close()
-            else:
-                if len(image_prompts) < len(media_paths):
-                    last_prompt = image_prompts[-1] if image_prompts else {"Img prompt": "Abstract technology background"}
-                    while len(image_prompts) < len(media_paths):
-                        image_prompts.append(last_prompt)
-                
-                combined_video_path = create_video_from_images_with_local_ltx(media_paths, image_prompts, final_audio.duration)
-
-            # Save final video with unique name
-            final_filename = f"output_{uuid4().hex[:8]}.mp4"
-            final_video_path = os.path.join(GENERATED_VIDEOS_DIR, final_filename)
-            
-            bg_music_path = f"../Songs/{songsName}" if songsName else "../Songs/shadow.mp3"
-            bg_music_volume = 0.3
-            
-            # Generate the final video
-            update_task_progress(task_id, "processing", message="Finalizing video...")
-            
-            generate_video(
-                combined_video_path, tts_path, subtitles_path,
-                n_threads, subtitles_position, text_color or "#FFFF00", 
-                bg_music_path, bg_music_volume, final_video_path
-            )
-            
-            # Close audio clips to free resources
-            final_audio.close()
-            
-            # Add to list of generated videos
-            generated_video_paths.append(final_video_path)
-            
-            # ============================
-            # Generate metadata
-            # ============================
-            update_task_progress(task_id, "processing", message="Generating metadata...")
-            
-            title, description, keywords = generate_metadata(video_subject, script, ai_model)
-
-            # ============================
-            # Optional YouTube upload
-            # ============================
-            if automate_youtube_upload:
-                update_task_progress(task_id, "processing", message="Uploading to YouTube...")
-                
-                client_secrets_file = os.path.abspath("./client_secret.json")
-                if os.path.exists(client_secrets_file):
-                    video_metadata = {
-                        'video_path': os.path.abspath(final_video_path),
-                        'title': title,
-                        'description': description,
-                        'category': "28",  # Science & Technology
-                        'keywords': ",".join(keywords),
-                        'privacyStatus': "private",
-                    }
-                    try:
-                        upload_video(**video_metadata)
-                    except HttpError as e:
-                        print(f"An HTTP error {e.resp.status} occurred:\n{e.content}")
 
-            print(colored(f"[+] Video {video_index + 1} generated: {final_video_path}!", "green"))
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_PARALLEL_SHORTS, amountofshorts))) as executor:
+            # list() re-raises the first error from any short
+            list(executor.map(run_short, range(amountofshorts)))
+
+        # Every short is done, nothing is left to resume
+        remove_workspace(workspace_path(task_id))
 
         # After loop completion, determine final status
-        if not GENERATING:
-            # Generation was cancelled during the process
-            update_task_progress(task_id, "cancelled", message="Video generation was cancelled.")
-        elif generated_video_paths:
+        if generated_video_paths:
             # Generation completed successfully
-            GENERATING = False
             video_filenames = [os.path.basename(path) for path in generated_video_paths]
             update_task_progress(
                 task_id, 
@@ -342,32 +231,96 @@ def background_generation(task_id, data):
             )
         else:
             # Generation completed but no videos were created
-            GENERATING = False
             update_task_progress(task_id, "error", message="No videos were generated.")
 
+    except JobCancelled:
+        # Generation was cancelled during the process
+        print(colored(f"[!] Task {task_id} cancelled", "yellow"))
+        remove_workspace(workspace_path(task_id))
+        update_task_progress(task_id, "cancelled", message="Video generation was cancelled.")
     except Exception as err:
+        # Keep the workspace: /api/generate/retry resumes from its journals
         print(colored(f"[-] Error: {err}", "red"))
-        GENERATING = False
         update_task_progress(task_id, "error", message=str(err))
 # ===========================================
 # Check generation status
 # ===========================================
 @app.route("/api/generate/status/<task_id>")
 def check_status(task_id):
-    task = active_tasks.get(task_id)
+    task = job_queue.get(task_id)
     if not task:
         return jsonify({"status": "not_found", "message": "Task not found"})
     
     return jsonify(task)
 
+@app.route("/api/generate/events/<task_id>")
+def stream_status(task_id):
+    """
+    Server-Sent Events stream of a task. Sends the current status first,
+    then "status", "stage" and "progress" events as they happen, and ends
+    once the task has finished.
+    """
+    # Subscribe before reading the snapshot so no event falls in between
+    subscription = progress_broker.subscribe(task_id)
+    task = job_queue.get(task_id)
+    if not task:
+        progress_broker.unsubscribe(task_id, subscription)
+        return jsonify({"status": "not_found", "message": "Task not found"}), 404
+
+    def stream():
+        try:
+            yield format_sse({"type": "status", **task})
+            if task["status"] in FINISHED_STATUSES:
+                return
+            while True:
+                try:
+                    event = subscription.get(timeout=15)
+                except queue.Empty:
+                    # Comment line, keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+                if event["type"] == "status" and event["status"] in FINISHED_STATUSES:
+                    return
+        finally:
+            progress_broker.unsubscribe(task_id, subscription)
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/api/generate/retry/<task_id>", methods=["POST"])
+def retry(task_id):
+    """Queues a failed task again. Finished stages are reused from its journals."""
+    if not job_queue.retry(task_id):
+        return jsonify({"status": "error", "message": "Only failed tasks can be retried."}), 409
+    return jsonify({"status": "queued", "message": "Task queued again.", "task_id": task_id})
+
+# ============================
+# Metrics
+# ============================
+@app.route("/api/metrics")
+def metrics():
+    """Stage latencies, external call counters and queue gauges in the Prometheus text format."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 # ============================
 # Cancel generation
 # ============================
 @app.route("/api/cancel", methods=["POST"])
 def cancel():
-    global GENERATING
-    GENERATING = False
-    print(colored("[!] Received cancellation request...", "yellow"))
+    data = request.get_json(silent=True) or {}
+    task_id = data.get("task_id")
+    print(colored(f"[!] Received cancellation request for {task_id or 'all tasks'}...", "yellow"))
+
+    if task_id:
+        if not job_queue.cancel(task_id):
+            return jsonify({"status": "error", "message": "Task not found or already finished."}), 404
+    else:
+        # Without a task id, keep the old behaviour of stopping everything
+        job_queue.cancel_all()
     return jsonify({"status": "success", "message": "Cancelled video generation."})
 
 # ============================
@@ -376,19 +329,54 @@ def cancel():
 
 @app.route("/api/videos")
 def list_videos():
-    if not os.path.exists(GENERATED_VIDEOS_DIR):
-        return jsonify({"status": "success", "videos": []})
-    
-    files = [f for f in os.listdir(GENERATED_VIDEOS_DIR) if f.endswith(".mp4")]
-    return jsonify({"status": "success", "videos": files})
+    """
+    Lists catalogued videos, newest first. Query parameters: page, per_page
+    (max 200), task_id, subject, min_duration, max_duration, since, until
+    (Unix timestamps), sort (created_at, duration or size) and order (asc
+    or desc). `videos` keeps the bare filenames for older clients.
+    """
+    args = request.args
+    try:
+        listing = video_catalog.list(
+            page=args.get("page", 1, type=int),
+            per_page=min(args.get("per_page", 50, type=int), 200),
+            task_id=args.get("task_id"),
+            subject=args.get("subject"),
+            min_duration=args.get("min_duration", type=float),
+            max_duration=args.get("max_duration", type=float),
+            since=args.get("since", type=float),
+            until=args.get("until", type=float),
+            sort=args.get("sort", "created_at"),
+            descending=args.get("order", "desc") != "asc",
+        )
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    return jsonify({
+        "status": "success",
+        "videos": [item["filename"] for item in listing["items"]],
+        **listing,
+    })
 
 
 @app.route("/api/video/<filename>")
 def serve_video(filename):
+    # conditional=True answers Range requests with 206 and If-None-Match /
+    # If-Modified-Since with 304, so scrubbing doesn't re-download the file
     if os.path.exists(os.path.join(GENERATED_VIDEOS_DIR, filename)):
-        return send_from_directory(GENERATED_VIDEOS_DIR, filename)
+        return send_from_directory(GENERATED_VIDEOS_DIR, filename, conditional=True, etag=True,
+                                   max_age=VIDEO_MAX_AGE)
     else:
         return jsonify({"status": "error", "message": "Video not found"}), 404
+
+
+@app.route("/api/thumbnails/<filename>")
+def serve_thumbnail(filename):
+    if os.path.exists(os.path.join(video_catalog.thumbnails_dir, filename)):
+        return send_from_directory(video_catalog.thumbnails_dir, filename, conditional=True,
+                                   max_age=VIDEO_MAX_AGE)
+    else:
+        return jsonify({"status": "error", "message": "Thumbnail not found"}), 404
     
 
 @app.route("/api/songs")
@@ -418,9 +406,49 @@ def get_voice(filename):
     return send_from_directory(VOICE_DIR, filename)
 
 
+# ============================
+# Job queue
+# ============================
+job_queue = JobQueue(
+    os.path.abspath("../jobs.db"),
+    background_generation,
+    workers=int(os.getenv("JOB_WORKERS", 2)),
+    max_queued=int(os.getenv("MAX_QUEUED_JOBS", 50)),
+    ttl=float(os.getenv("TASK_TTL_SECONDS", 24 * 3600)),
+    # Failed tasks keep their workspace for retries until they expire
+    on_evict=lambda task_id: remove_workspace(workspace_path(task_id)),
+    # Every status change, including cancels and worker fallbacks, reaches the event streams
+    on_change=publish_status,
+)
+
+
+def collect_queue_metrics():
+    counts = job_queue.stats()
+    for status in ("queued", "processing", *FINISHED_STATUSES):
+        QUEUE_DEPTH.set(counts.get(status, 0), status=status)
+    ACTIVE_WORKERS.set(job_queue.active_workers())
+
+
+REGISTRY.add_collector(collect_queue_metrics)
+
+
+def start_background_work():
+    """Starts the job workers and indexes videos rendered while the server was down."""
+    job_queue.start()
+    # Without delaying startup
+    threading.Thread(target=video_catalog.sync, name="catalog-sync", daemon=True).start()
+
+
+# Started on import, so the workers also run under a WSGI server
+# (gunicorn, waitress, flask run). With the debug reloader, `python
+# main.py` runs in a watcher and a serving process; only the serving one
+# should own workers.
+if not (__name__ == "__main__" and DEBUG and os.environ.get("WERKZEUG_RUN_MAIN") != "true"):
+    start_background_work()
+
 # ============================
 # Run server
 # ============================
 if __name__ == "__main__":
     print(colored(f"[INFO] Server is running on http://{HOST}:{PORT}", "green"))
-    app.run(debug=True, host=HOST, port=PORT)
\ No newline at end of file
+    app.run(debug=DEBUG, host=HOST, port=PORT)
\ No newline at end of file
@@ -0,0 +1,175 @@
+import time
+import threading
+import functools
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Pipeline stages take anywhere from a fraction of a second (a Pexels
+# search) to tens of minutes (LTX, rendering), so the buckets are wide
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: Dict[str, str] = None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class of the metric types: a family of series keyed by label values."""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. the number of retries."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = dict(self._series)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(series.items())]
+
+
+class Gauge(Counter):
+    """A value that goes up and down, e.g. the queue depth."""
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, e.g. stage latencies."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[key] = (counts, total + value)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        lines = []
+        for key, (counts, total) in sorted(series.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class Registry:
+    """A set of metrics, rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """Adds a function that refreshes gauges right before every scrape."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "moneyprinter_stage_duration_seconds", "Time spent in each pipeline stage.", ["stage"]))
+STAGE_FAILURES = REGISTRY.register(Counter(
+    "moneyprinter_stage_failures_total", "Pipeline stage calls that raised.", ["stage"]))
+EXTERNAL_RETRIES = REGISTRY.register(Counter(
+    "moneyprinter_external_retries_total", "Calls to external services that were retried.", ["service"]))
+EXTERNAL_FAILURES = REGISTRY.register(Counter(
+    "moneyprinter_external_failures_total", "Calls to external services that failed.", ["service"]))
+DOWNLOADED_BYTES = REGISTRY.register(Counter(
+    "moneyprinter_downloaded_bytes_total", "Bytes of media downloaded."))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "moneyprinter_jobs", "Jobs in the queue by status.", ["status"]))
+ACTIVE_WORKERS = REGISTRY.register(Gauge(
+    "moneyprinter_active_workers", "Job queue workers currently processing a task."))
+
+
+def timed(stage: str):
+    """
+    Decorator recording every call of the function in the stage latency
+    histogram, and counting the calls that raise as stage failures.
+
+    Args:
+        stage (str): The `stage` label, usually the function name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                STAGE_FAILURES.inc(stage=stage)
+                raise
+            finally:
+                STAGE_SECONDS.observe(time.monotonic() - start, stage=stage)
+        return wrapper
+    return decorator
@@ -0,0 +1,406 @@
+import os
+import time
+import queue
+import itertools
+import threading
+from uuid import uuid4
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from termcolor import colored
+from moviepy.editor import AudioFileClip
+from apiclient.errors import HttpError
+
+from ltx import create_video_from_images_with_local_ltx
+from autotts import tts_hf_stream
+from search import iter_stock_videos
+from gemini import generate_flux_image
+from gpt import stream_script, generate_metadata, get_image_search_terms, get_search_terms
+from video import collect_clips, generate_subtitles, generate_video, save_video, save_videos_iter, write_combined
+from youtube import upload_video
+from stages import Journal, Stage, StageError, run_stages
+from cancellation import JobCancelled
+from scheduler import SCHEDULER
+from clips import ClipLibrary
+
+AMOUNT_OF_STOCK_VIDEOS = 8
+
+# Downloaded stock clips are kept across jobs, up to CLIP_LIBRARY_MAX_GB
+clip_library = ClipLibrary(
+    os.getenv("CLIP_LIBRARY_DIR", "../clips"),
+    max_bytes=int(float(os.getenv("CLIP_LIBRARY_MAX_GB", 20)) * 1024 ** 3),
+)
+
+
+# ============================
+# Per-video stage graph
+# ============================
+class NoMediaError(RuntimeError):
+    """Raised when no stock clips or images could be fetched for a video."""
+
+
+STAGE_MESSAGES = {
+    "script": "Generating script...",
+    "tts": "Generating audio...",
+    "subtitles": "Generating subtitles...",
+    "media": "Fetching media content...",
+    "compose": "Creating video...",
+    "render": "Finalizing video...",
+    "metadata": "Generating metadata...",
+    "upload": "Uploading to YouTube...",
+}
+
+
+def build_video_stages(video_subject, paragraph_number, ai_model, custom_prompt, voice,
+                       contentType, subtitles_position, text_color, songsName,
+                       automate_youtube_upload, workspace, cancel_token, on_progress, journal,
+                       stock_downloads=None):
+    """
+    Builds the stage graph for a single short. Every intermediate file
+    (TTS audio, subtitles, clips, combined video) is written to `workspace`,
+    and every long-running call gets `cancel_token`. Fine-grained progress
+    is reported as on_progress(stage, step, done, total), e.g. TTS chunks
+    or frames written by the encoder.
+
+    Besides the stage results themselves, which run_stages journals, the
+    expensive per-item steps inside a stage (clip downloads, Flux images,
+    LTX clips) are recorded in `journal`, so a retry after a crash halfway
+    through a stage only redoes the missing items.
+
+    script ─┬─ media (stock) ────┐
+            ├─ metadata ─────────┼─────────────────────┐
+    tts ────┴─ subtitles ────────┴─ compose ── render ─┴─ upload
+
+    The script is streamed from the LLM sentence by sentence, and `tts`
+    starts together with `script`, synthesizing each sentence as it
+    arrives instead of waiting for the whole completion.
+
+    Stock media only needs the script, so searching and downloading clips
+    overlaps TTS and Whisper. `media` only picks the search terms and starts
+    the searches; each result is downloaded as soon as it's found, and
+    `compose` uses each clip as soon as it's on disk instead of waiting for
+    the slowest search or download. Generative media needs the subtitle timings
+    and therefore depends on `subtitles` instead. Metadata only needs the
+    script and overlaps the whole render.
+
+    `stock_downloads`, if given, is the dict the stock clip downloads are
+    kept in under "paths" once they start, so the caller can stop them if
+    the graph fails before `compose` is done with them.
+    """
+    # Encoder threads per render; the cpu pool bounds how many renders run at once
+    n_threads = SCHEDULER.threads("cpu")
+
+    # Sentences of the script on their way from `script` to `tts`. None
+    # ends the stream, a JobCancelled or other exception aborts it.
+    script_sentences = queue.Queue()
+
+    # Stock clip downloads on their way from `media` to `compose`
+    stock_downloads = {} if stock_downloads is None else stock_downloads
+    stock_clips_lock = threading.Lock()
+
+    def script_stage():
+        if custom_prompt:
+            # Custom prompts and scripts written up front are used as they are
+            print(colored(f"   Using prepared script: {custom_prompt[:100]}...", "blue"))
+            script_sentences.put(custom_prompt)
+            script_sentences.put(None)
+            return custom_prompt
+
+        sentences = []
+        try:
+            for sentence in stream_script(video_subject, paragraph_number, ai_model):
+                cancel_token.raise_if_cancelled()
+                sentences.append(sentence)
+                script_sentences.put(sentence)
+            script = " ".join(sentences)
+            if not script:
+                raise ValueError("The LLM returned an empty script.")
+        except Exception as e:
+            script_sentences.put(e)
+            raise
+
+        # Journal the script before TTS can finish, so a journaled TTS
+        # result always belongs to the journaled script
+        journal.record("script", script)
+        script_sentences.put(None)
+        print(colored(f"   Generated script: {script[:100]}...", "blue"))
+        return script
+
+    def streamed_sentences():
+        while True:
+            item = script_sentences.get()
+            if item is None:
+                return
+            if isinstance(item, JobCancelled):
+                raise item
+            if isinstance(item, Exception):
+                raise RuntimeError(f"Script generation failed: {item}")
+            yield item
+
+    def tts_stage():
+        # On a resume the script may already be journaled while TTS isn't
+        found, script = journal.lookup("script")
+        if found:
+            sentences = [script]
+        else:
+            # Wait for the first sentence outside the io pool: holding a
+            # slot here could starve the `script` stages this one waits on
+            sentences = streamed_sentences()
+            first = next(sentences, None)
+            sentences = itertools.chain([first] if first is not None else [], sentences)
+
+        # Save the full script as one TTS clip
+        tts_path = os.path.join(workspace, f"{uuid4()}.mp3")
+        voice_path = f"../voice/{voice}" if voice else "../voice/Michel.mp3"
+        with SCHEDULER.slot("io"):
+            tts_hf_stream(sentences, output_file=tts_path, audio_prompt=voice_path, cancel_token=cancel_token,
+                          on_progress=lambda done, total: on_progress("tts", "chunk", done, total))
+        return tts_path
+
+    def subtitles_stage(tts):
+        try:
+            return generate_subtitles(audio_path=tts, directory=workspace, cancel_token=cancel_token)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            print(colored(f"[-] Error generating subtitles: {e}", "red"))
+            return None
+
+    def save_clip(url):
+        return journal.memo(f"clip/{url}", lambda: clip_library.fetch(
+            url, lambda: save_video(url, directory=clip_library.tmp_dir, cancel_token=cancel_token),
+            directory=workspace))
+
+    def stock_clips(search_terms):
+        # Started once, by `media` or, after a resume that restored
+        # `media`, by `compose`. Every search result goes straight to the
+        # downloads, and `compose` takes each clip as it lands on disk.
+        with stock_clips_lock:
+            if "paths" not in stock_downloads:
+                video_urls = iter_stock_videos(search_terms, os.getenv("PEXELS_API_KEY"), it=15, min_dur=10)
+                stock_downloads["paths"] = save_videos_iter(video_urls, save=save_clip, cancel_token=cancel_token)
+            return stock_downloads["paths"]
+
+    def stock_media_stage(script):
+        search_terms = get_search_terms(video_subject, AMOUNT_OF_STOCK_VIDEOS, script, ai_model)
+        if not search_terms:
+            raise NoMediaError("No search terms for stock videos.")
+        cancel_token.raise_if_cancelled()
+        stock_clips(search_terms)
+        return search_terms, []
+
+    def generative_media_stage(subtitles):
+        media_paths = []
+        # Keyed by the subtitles file, so new subtitles mean new prompts
+        image_prompts = journal.memo(
+            f"image_prompts/{os.path.basename(subtitles or '')}",
+            lambda: get_image_search_terms(video_subject, AMOUNT_OF_STOCK_VIDEOS, subtitles, ai_model)
+        )
+        for term_data in image_prompts:
+            cancel_token.raise_if_cancelled()
+            prompt = term_data["Img prompt"] if isinstance(term_data, dict) else term_data
+            try:
+                found, generated = journal.lookup(f"image/{prompt}")
+                if not found:
+                    generated = generate_flux_image(prompt, contentType, output_dir=workspace)
+                    if generated:
+                        journal.record(f"image/{prompt}", generated)
+                if generated:  # make sure it's not None
+                    media_paths.append(generated)
+                if len(media_paths) >= AMOUNT_OF_STOCK_VIDEOS:
+                    break
+            except Exception as e:
+                print(f"Could not generate image: {e}")
+
+        if not media_paths:
+            raise NoMediaError("No images generated for this video.")
+        print(colored(f"[+] {len(media_paths)} images generated!", "green"))
+        return media_paths, image_prompts
+
+    def compose_stage(tts, media):
+        # Stock media is (search terms, []), generative media (images, prompts)
+        media_paths, image_prompts = media
+        audio = AudioFileClip(tts)
+        audio_duration = audio.duration
+        audio.close()
+
+        if contentType == "stock":
+            # Stock videos: combine the clips as they're downloaded
+            search_terms, landed = media_paths, []
+
+            def clips():
+                downloads = stock_clips(search_terms)
+                try:
+                    for path in downloads:
+                        landed.append(path)
+                        yield path
+                finally:
+                    downloads.close()
+
+            # Waiting for downloads holds no pool slot; only encoding takes a cpu one
+            try:
+                video_clips = collect_clips(clips(), audio_duration, 3, cancel_token=cancel_token,
+                                            expected_clips=len(search_terms))
+            except ValueError:
+                if not landed:
+                    raise NoMediaError("No stock videos could be found or downloaded for this video.")
+                raise
+            with SCHEDULER.slot("cpu"):
+                return write_combined(video_clips, n_threads, directory=workspace, cancel_token=cancel_token,
+                                      on_progress=lambda bar, done, total: on_progress("compose", bar, done, total))
+
+        if len(image_prompts) < len(media_paths):
+            last_prompt = image_prompts[-1] if image_prompts else {"Img prompt": "Abstract technology background"}
+            image_prompts = image_prompts + [last_prompt] * (len(media_paths) - len(image_prompts))
+        return create_video_from_images_with_local_ltx(media_paths, image_prompts, audio_duration,
+                                                       output_dir=workspace, cancel_token=cancel_token,
+                                                       journal=journal)
+
+    def render_stage(compose, tts, subtitles):
+        bg_music_path = f"../Songs/{songsName}" if songsName else "../Songs/shadow.mp3"
+        bg_music_volume = 0.3
+
+        # generate_video picks a unique name in Generated_Video and returns it.
+        # Journaled paths must be absolute so a resume can check they still exist.
+        return os.path.abspath(generate_video(
+            compose, tts, subtitles,
+            n_threads, subtitles_position, text_color or "#FFFF00",
+            bg_music_path, bg_music_volume,
+            cancel_token=cancel_token,
+            on_progress=lambda bar, done, total: on_progress("render", bar, done, total)
+        ))
+
+    def metadata_stage(script):
+        return generate_metadata(video_subject, script, ai_model)
+
+    def upload_stage(render, metadata):
+        if not automate_youtube_upload:
+            return None
+
+        title, description, keywords = metadata
+        client_secrets_file = os.path.abspath("./client_secret.json")
+        if not os.path.exists(client_secrets_file):
+            return None
+
+        video_metadata = {
+            'video_path': os.path.abspath(render),
+            'title': title,
+            'description': description,
+            'category': "28",  # Science & Technology
+            'keywords': ",".join(keywords),
+            'privacy_status': "private",
+        }
+        try:
+            return upload_video(**video_metadata)
+        except HttpError as e:
+            print(f"An HTTP error {e.resp.status} occurred:\n{e.content}")
+            return None
+
+    # Stages that wait on the network or a Gradio server run in the io pool,
+    # Whisper, MoviePy and x264 in the cpu pool
+    if contentType == "stock":
+        media_stage = Stage("media", stock_media_stage, ("script",), resource="io")
+        # Takes its cpu slot itself, once the clips are downloaded
+        compose_stage_def = Stage("compose", compose_stage, ("tts", "media"))
+    else:
+        media_stage = Stage("media", generative_media_stage, ("subtitles",), resource="io")
+        # Mostly waiting on LTX-Video
+        compose_stage_def = Stage("compose", compose_stage, ("tts", "media"), resource="io")
+
+    return [
+        Stage("script", script_stage, resource="io"),
+        # No dependency on `script`: it consumes the script while it's
+        # streamed, and takes its io slot once the first sentence is in
+        Stage("tts", tts_stage),
+        Stage("subtitles", subtitles_stage, ("tts",), resource="cpu"),
+        media_stage,
+        compose_stage_def,
+        Stage("render", render_stage, ("compose", "tts", "subtitles"), resource="cpu"),
+        Stage("metadata", metadata_stage, ("script",), resource="io"),
+        Stage("upload", upload_stage, ("render", "metadata"), resource="io"),
+    ]
+
+
+@dataclass
+class ShortResult:
+    """The outcome of generate_short."""
+    # Path of the rendered video, or None if no media could be found
+    video: Optional[str]
+    # Seconds spent in every stage that ran, keyed by stage name
+    timings: Dict[str, float] = field(default_factory=dict)
+    # Stages whose result was reused from the journal
+    restored: List[str] = field(default_factory=list)
+
+
+def generate_short(options: dict, workspace: str, cancel_token,
+                   on_event: Optional[Callable[[str, str], None]] = None,
+                   on_progress: Optional[Callable[[str, str, int, int], None]] = None,
+                   catalog=None, source: str = None) -> ShortResult:
+    """
+    Generates one short by running its stage graph in `workspace`. This is
+    shared by the job queue of the web server and the batch CLI.
+
+    The workspace keeps a journal of finished stages, so calling this again
+    with the same workspace after a failure resumes where it stopped. The
+    caller removes the workspace once it's no longer needed.
+
+    Args:
+        options (dict): Keyword arguments for build_video_stages, i.e.
+            everything but workspace, cancel_token, on_progress and journal.
+        workspace (str): Scratch directory of this short.
+        cancel_token (CancelToken): Checked throughout the pipeline.
+        on_event (Callable): Optional, forwarded to run_stages.
+        on_progress (Callable): Optional, fine-grained progress as
+            on_progress(stage, step, done, total).
+        catalog (VideoCatalog): Optional, the rendered video is added to it.
+        source (str): The task id recorded in the catalog.
+
+    Returns:
+        ShortResult: The rendered video and per-stage timings.
+
+    Raises:
+        JobCancelled: If the token is cancelled.
+        Exception: The error of the first failing stage.
+    """
+    result = ShortResult(video=None)
+    started = {}
+
+    def track(stage_name, event):
+        if event == "started":
+            started[stage_name] = time.monotonic()
+        elif event in ("finished", "failed") and stage_name in started:
+            result.timings[stage_name] = round(time.monotonic() - started[stage_name], 3)
+        elif event == "restored":
+            result.restored.append(stage_name)
+        if on_event is not None:
+            on_event(stage_name, event)
+
+    journal = Journal(os.path.join(workspace, "journal.json"))
+    stock_downloads = {}
+    stages = build_video_stages(
+        **options,
+        workspace=workspace,
+        cancel_token=cancel_token,
+        on_progress=on_progress or (lambda stage_name, step, done, total: None),
+        journal=journal,
+        stock_downloads=stock_downloads,
+    )
+
+    try:
+        results = run_stages(stages, on_event=track, cancel_token=cancel_token, journal=journal,
+                             scheduler=SCHEDULER)
+    except StageError as e:
+        if isinstance(e.error, NoMediaError):
+            print(colored(f"[-] {e.error}", "red"))
+            return result
+        raise e.error
+    finally:
+        # A failing sibling stage (tts, subtitles) must not leave the
+        # downloads `media` started running for a task that's over
+        if "paths" in stock_downloads:
+            stock_downloads["paths"].close()
+
+    result.video = results["render"]
+    if catalog is not None:
+        catalog.add(result.video, task_id=source, subject=options.get("video_subject"))
+    return result
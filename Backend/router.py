@@ -0,0 +1,403 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import google.generativeai as genai
+from termcolor import colored
+
+from llm import LLMClient, LLMError
+from metrics import REGISTRY, Counter, Gauge, Histogram
+
+LLM_LATENCY = REGISTRY.register(Histogram(
+    "moneyprinter_llm_latency_seconds", "Latency of LLM requests by provider.", ["provider"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)))
+LLM_REQUESTS = REGISTRY.register(Counter(
+    "moneyprinter_llm_requests_total", "LLM requests by provider and result.", ["provider", "result"]))
+LLM_FIRST_TOKEN = REGISTRY.register(Histogram(
+    "moneyprinter_llm_first_token_seconds", "Time to the first token of streamed LLM requests by provider.",
+    ["provider"], buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30)))
+LLM_HEDGES = REGISTRY.register(Counter(
+    "moneyprinter_llm_hedges_total", "Requests hedged to a second provider.", ["provider"]))
+LLM_AVAILABLE = REGISTRY.register(Gauge(
+    "moneyprinter_llm_provider_available", "1 while a provider takes requests, 0 while it's failed over.",
+    ["provider"]))
+
+
+# ============================
+# Providers
+# ============================
+class Provider:
+    """
+    A source of chat completions. Subclasses implement complete(); stream()
+    and acomplete() fall back to it.
+    """
+    name = "provider"
+
+    def complete(self, prompt: str, ai_model: str, json_mode: bool = False) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, ai_model: str) -> Iterator[str]:
+        yield self.complete(prompt, ai_model)
+
+    async def acomplete(self, prompt: str, ai_model: str, json_mode: bool = False) -> str:
+        return await asyncio.to_thread(self.complete, prompt, ai_model, json_mode)
+
+
+class OpenAICompatibleProvider(Provider):
+    """
+    DeepSeek, or any server speaking the OpenAI chat completions API, such
+    as a local llama.cpp, Ollama or vLLM server.
+
+    Args:
+        name (str): Provider name.
+        client (LLMClient): Client pointing at the server.
+        default_model (str): Model used when the requested one isn't served here.
+        models (Iterable[str]): Models this server serves.
+        json_mode_models (Iterable[str]): Models supporting response_format json_object.
+    """
+
+    def __init__(self, name: str, client: LLMClient, default_model: str, models: Iterable[str] = (),
+                 json_mode_models: Iterable[str] = ()):
+        self.name = name
+        self.client = client
+        self.default_model = default_model
+        self.models = set(models)
+        self.json_mode_models = set(json_mode_models)
+
+    def _model(self, ai_model: str) -> str:
+        return ai_model if ai_model in self.models else self.default_model
+
+    def _params(self, model: str, json_mode: bool) -> dict:
+        if json_mode and model in self.json_mode_models:
+            return {"response_format": {"type": "json_object"}}
+        return {}
+
+    def complete(self, prompt: str, ai_model: str, json_mode: bool = False) -> str:
+        model = self._model(ai_model)
+        return self.client.complete(prompt, model, **self._params(model, json_mode))
+
+    def stream(self, prompt: str, ai_model: str) -> Iterator[str]:
+        return self.client.stream(prompt, self._model(ai_model))
+
+    async def acomplete(self, prompt: str, ai_model: str, json_mode: bool = False) -> str:
+        model = self._model(ai_model)
+        return await self.client.acomplete(prompt, model, **self._params(model, json_mode))
+
+
+class GeminiProvider(Provider):
+    """Google Gemini through google.generativeai, configured with GOOGLE_API_KEY."""
+
+    def __init__(self, model_name: str = "gemini-1.5-flash", timeout: float = 120, name: str = "gemini"):
+        self.name = name
+        self.timeout = timeout
+        self.model = genai.GenerativeModel(model_name)
+
+    def complete(self, prompt: str, ai_model: str, json_mode: bool = False) -> str:
+        config = {"response_mime_type": "application/json"} if json_mode else None
+        response = self.model.generate_content(prompt, generation_config=config,
+                                               request_options={"timeout": self.timeout})
+        return response.text
+
+    def stream(self, prompt: str, ai_model: str) -> Iterator[str]:
+        for chunk in self.model.generate_content(prompt, stream=True, request_options={"timeout": self.timeout}):
+            if chunk.text:
+                yield chunk.text
+
+
+class StandInProvider(Provider):
+    """
+    Answers locally without any network, for tests and offline runs.
+
+    Args:
+        reply (Callable): Maps a prompt to the answer. Defaults to a fixed sentence.
+        delay (float): Seconds every answer takes.
+        fail_rate (float): Share of requests that raise LLMError.
+    """
+
+    def __init__(self, reply: Optional[Callable[[str], str]] = None, delay: float = 0.0, fail_rate: float = 0.0,
+                 name: str = "standin"):
+        self.name = name
+        self.reply = reply
+        self.delay = delay
+        self.fail_rate = fail_rate
+
+    def complete(self, prompt: str, ai_model: str, json_mode: bool = False) -> str:
+        time.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            raise LLMError(f"{self.name}: simulated failure")
+        if self.reply is not None:
+            return self.reply(prompt)
+        return '{"answer": "This is a stand-in answer."}' if json_mode else "This is a stand-in answer."
+
+
+# ============================
+# Health tracking
+# ============================
+class ProviderStats:
+    """
+    Outcomes and latencies of a provider's recent requests. When the error
+    rate over the last `window` requests reaches `error_threshold`, the
+    provider is taken out of rotation for `cooldown` seconds and then
+    tried again with a clean slate.
+    """
+
+    def __init__(self, name: str, window: int, min_samples: int, error_threshold: float, cooldown: float):
+        self.name = name
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._latencies = deque(maxlen=100)
+        self._unavailable_until = 0.0
+        self._lock = threading.Lock()
+        LLM_AVAILABLE.set(1, provider=name)
+
+    def record(self, ok: bool, latency: Optional[float] = None) -> None:
+        """
+        Records the outcome of a request. `latency` is only given for whole
+        completions: it feeds the p95 the router hedges on, which a full
+        stream's duration would inflate.
+        """
+        LLM_REQUESTS.inc(provider=self.name, result="success" if ok else "error")
+        with self._lock:
+            self._outcomes.append(ok)
+            if ok and latency is not None:
+                self._latencies.append(latency)
+                LLM_LATENCY.observe(latency, provider=self.name)
+            if len(self._outcomes) >= self.min_samples and self.error_rate_locked() >= self.error_threshold:
+                print(colored(f"[!] {self.name}: error rate {self.error_rate_locked():.0%}, "
+                              f"failing over for {self.cooldown:.0f}s", "yellow"))
+                self._unavailable_until = time.monotonic() + self.cooldown
+                self._outcomes.clear()
+                LLM_AVAILABLE.set(0, provider=self.name)
+
+    def error_rate_locked(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 1 - sum(self._outcomes) / len(self._outcomes)
+
+    def available(self) -> bool:
+        with self._lock:
+            if self._unavailable_until and time.monotonic() >= self._unavailable_until:
+                self._unavailable_until = 0.0
+                LLM_AVAILABLE.set(1, provider=self.name)
+            return not self._unavailable_until
+
+    def latency_quantile(self, q: float, min_samples: int) -> Optional[float]:
+        """The q-quantile of recent successful latencies, or None with fewer than `min_samples`."""
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "available": not self._unavailable_until,
+                "error_rate": self.error_rate_locked(),
+                "p50": latencies[len(latencies) // 2] if latencies else None,
+                "p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+            }
+
+
+# ============================
+# Router
+# ============================
+class LLMRouter:
+    """
+    Sends every request to the preferred healthy provider. If it's slower
+    than usual, the request is also sent to the next provider and whichever
+    answers first wins. A provider that fails is failed over to the next
+    one right away, and one whose error rate spikes is skipped until its
+    cooldown is over.
+
+    Every hedge is a second paid request, so by default a request is only
+    hedged once it has run longer than its provider's 95th percentile
+    latency, which hedges about one request in twenty. Until a provider
+    has `hedge_samples` successful requests to measure, its requests
+    aren't hedged.
+
+    Args:
+        providers (List[Provider]): In order of preference.
+        preferred (Dict[str, str]): Maps an ai_model to the provider that
+            should be tried first for it, e.g. {"gemmini": "gemini"}.
+        hedge_delay (float): Fixed seconds before hedging instead of the
+            measured p95; 0 or less disables hedging.
+        hedge_samples (int): Latencies needed before the p95 is trusted.
+        error_threshold (float): Error rate that takes a provider out of rotation.
+        window (int): Number of recent requests the error rate is computed over.
+        min_samples (int): Requests needed before the error rate counts.
+        cooldown (float): Seconds a failed-over provider is skipped.
+    """
+
+    def __init__(self, providers: List[Provider], preferred: Optional[Dict[str, str]] = None,
+                 hedge_delay: Optional[float] = None, hedge_samples: int = 20, error_threshold: float = 0.5,
+                 window: int = 20, min_samples: int = 5, cooldown: float = 60.0):
+        if not providers:
+            raise ValueError("LLMRouter needs at least one provider.")
+        self.providers = providers
+        self.preferred = preferred or {}
+        self.hedge_delay = hedge_delay
+        self.hedge_samples = hedge_samples
+        self.stats = {
+            provider.name: ProviderStats(provider.name, window, min_samples, error_threshold, cooldown)
+            for provider in providers
+        }
+        # Hedged requests that lost keep running here until they finish
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm")
+
+    def _order(self, ai_model: str) -> List[Provider]:
+        first = self.preferred.get(ai_model)
+        ordered = sorted(self.providers, key=lambda provider: provider.name != first)
+        available = [provider for provider in ordered if self.stats[provider.name].available()]
+        # With every provider failed over, trying one beats failing outright
+        return available or ordered
+
+    def _hedge_after(self, provider: Provider) -> Optional[float]:
+        """Seconds to wait on `provider` before hedging, or None not to hedge."""
+        if self.hedge_delay is not None:
+            return self.hedge_delay if self.hedge_delay > 0 else None
+        return self.stats[provider.name].latency_quantile(0.95, self.hedge_samples)
+
+    def _call(self, provider: Provider, prompt: str, ai_model: str, json_mode: bool) -> str:
+        start = time.monotonic()
+        try:
+            response = provider.complete(prompt, ai_model, json_mode)
+            if not response:
+                raise LLMError(f"{provider.name}: empty response")
+        except Exception:
+            self.stats[provider.name].record(False, time.monotonic() - start)
+            raise
+        self.stats[provider.name].record(True, time.monotonic() - start)
+        return response
+
+    def complete(self, prompt: str, ai_model: str, json_mode: bool = False) -> str:
+        """
+        Returns the first successful answer, hedging and failing over as needed.
+
+        Raises:
+            LLMError: If every provider failed.
+        """
+        candidates = self._order(ai_model)
+        running, errors = {}, []
+
+        def launch():
+            provider = candidates.pop(0)
+            running[self._executor.submit(self._call, provider, prompt, ai_model, json_mode)] = provider
+
+        launch()
+        while running:
+            hedge_after = None
+            if candidates and len(running) == 1:
+                hedge_after = self._hedge_after(next(iter(running.values())))
+            done, _ = wait(running, timeout=hedge_after, return_when=FIRST_COMPLETED)
+            if not done:
+                LLM_HEDGES.inc(provider=candidates[0].name)
+                print(colored(f"[*] No answer after {hedge_after:.1f}s, hedging to {candidates[0].name}", "blue"))
+                launch()
+                continue
+            for future in done:
+                provider = running.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(f"{provider.name}: {e}")
+            if not running and candidates:
+                print(colored(f"[!] Failing over to {candidates[0].name}", "yellow"))
+                launch()
+
+        raise LLMError(f"Every LLM provider failed: {'; '.join(errors)}")
+
+    def complete_many(self, prompts: List[str], ai_model: str, json_mode: bool = False,
+                      concurrency: int = 8) -> List[str]:
+        """Runs complete() for several prompts at once. Returns the answers in order."""
+        if len(prompts) <= 1:
+            return [self.complete(prompt, ai_model, json_mode) for prompt in prompts]
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(prompts)))) as executor:
+            return list(executor.map(lambda prompt: self.complete(prompt, ai_model, json_mode), prompts))
+
+    def stream(self, prompt: str, ai_model: str) -> Iterator[str]:
+        """
+        Streams the answer of the first provider that starts answering.
+        Streams aren't hedged, but a provider failing before its first
+        token is failed over. They count toward the error rate, but their
+        durations stay out of the p95 that complete() hedges on; the time
+        to the first token goes to its own histogram instead.
+        """
+        errors = []
+        for provider in self._order(ai_model):
+            start = time.monotonic()
+            started = False
+            try:
+                for delta in provider.stream(prompt, ai_model):
+                    if not started:
+                        started = True
+                        LLM_FIRST_TOKEN.observe(time.monotonic() - start, provider=provider.name)
+                    yield delta
+            except Exception as e:
+                self.stats[provider.name].record(False)
+                if started:
+                    raise
+                errors.append(f"{provider.name}: {e}")
+                continue
+            self.stats[provider.name].record(True)
+            return
+        raise LLMError(f"Every LLM provider failed: {'; '.join(errors)}")
+
+    async def acomplete(self, prompt: str, ai_model: str, json_mode: bool = False) -> str:
+        """asyncio version of complete(). Losing hedged requests are cancelled."""
+        candidates = self._order(ai_model)
+        running, errors = {}, []
+
+        async def call(provider):
+            start = time.monotonic()
+            try:
+                response = await provider.acomplete(prompt, ai_model, json_mode)
+                if not response:
+                    raise LLMError(f"{provider.name}: empty response")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.stats[provider.name].record(False, time.monotonic() - start)
+                raise
+            self.stats[provider.name].record(True, time.monotonic() - start)
+            return response
+
+        def launch():
+            provider = candidates.pop(0)
+            running[asyncio.ensure_future(call(provider))] = provider
+
+        launch()
+        try:
+            while running:
+                hedge_after = None
+                if candidates and len(running) == 1:
+                    hedge_after = self._hedge_after(next(iter(running.values())))
+                done, _ = await asyncio.wait(running, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    LLM_HEDGES.inc(provider=candidates[0].name)
+                    launch()
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {e}")
+                if not running and candidates:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+
+        raise LLMError(f"Every LLM provider failed: {'; '.join(errors)}")
+
+    def health(self) -> Dict[str, dict]:
+        """Returns availability, error rate and latency percentiles per provider."""
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
@@ -0,0 +1,100 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+from metrics import REGISTRY, Gauge
+
+RESOURCE_SLOTS = REGISTRY.register(Gauge(
+    "moneyprinter_resource_slots", "Slots of each resource pool by state.", ["resource", "state"]))
+
+
+class ResourcePool:
+    """
+    Limits how many stages of one resource class run at the same time,
+    across all jobs and shorts of the process.
+
+    Args:
+        name (str): Name of the resource class, e.g. "cpu".
+        slots (int): Stages allowed to run at once.
+        threads (int): Threads each running stage may use, e.g. for
+            write_videofile(threads=...).
+    """
+
+    def __init__(self, name: str, slots: int, threads: int = 1):
+        self.name = name
+        self.slots = max(1, slots)
+        self.threads = max(1, threads)
+        self._semaphore = threading.BoundedSemaphore(self.slots)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._active = 0
+        self._report()
+
+    def _report(self) -> None:
+        RESOURCE_SLOTS.set(self._active, resource=self.name, state="active")
+        RESOURCE_SLOTS.set(self._waiting, resource=self.name, state="waiting")
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            self._waiting += 1
+            self._report()
+        self._semaphore.acquire()
+        with self._lock:
+            self._waiting -= 1
+            self._active += 1
+            self._report()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._report()
+            self._semaphore.release()
+
+
+class Scheduler:
+    """
+    A set of resource pools. Stages name the pool they run in; stages
+    without one, or naming an unknown pool, run unlimited.
+    """
+
+    def __init__(self, pools: Dict[str, ResourcePool]):
+        self.pools = pools
+
+    @contextmanager
+    def slot(self, resource: str = None):
+        pool = self.pools.get(resource)
+        if pool is None:
+            yield
+            return
+        with pool.acquire():
+            yield
+
+    def threads(self, resource: str) -> int:
+        """Returns how many threads a stage running in `resource` may use."""
+        pool = self.pools.get(resource)
+        return pool.threads if pool is not None else 1
+
+
+def default_scheduler() -> Scheduler:
+    """
+    Builds the process-wide scheduler from the environment:
+
+    - cpu: Whisper, MoviePy compositing and x264 encoding. CPU_SLOTS
+      renders at once (default: a quarter of the cores), each using an
+      equal share of the cores as encoder threads.
+    - io: LLM calls, Pexels, downloads and Gradio RPCs, which mostly wait.
+      IO_SLOTS at once (default 32).
+    """
+    cores = os.cpu_count() or 1
+    cpu_slots = max(1, int(os.getenv("CPU_SLOTS", cores // 4)))
+    io_slots = max(1, int(os.getenv("IO_SLOTS", 32)))
+    return Scheduler({
+        "cpu": ResourcePool("cpu", cpu_slots, threads=max(1, cores // cpu_slots)),
+        "io": ResourcePool("io", io_slots),
+    })
+
+
+SCHEDULER = default_scheduler()
@@ -1,8 +1,126 @@
+import os
+import json
 import requests
 
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple
 from termcolor import colored
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from cache import DiskCache
+from metrics import EXTERNAL_FAILURES, timed
+from utils import OUTPUT_RESOLUTION
 
+# (connect, read) timeouts for Pexels API requests, in seconds
+PEXELS_TIMEOUT = (float(os.getenv("PEXELS_CONNECT_TIMEOUT", 5)), float(os.getenv("PEXELS_READ_TIMEOUT", 20)))
+PEXELS_CONCURRENCY = int(os.getenv("PEXELS_CONCURRENCY", 8))
+# How much of the output resolution the cropped rendition must cover: 1.0
+# avoids any upscaling, less trades sharpness for smaller downloads, more
+# leaves headroom for zoom effects
+STOCK_QUALITY = float(os.getenv("STOCK_QUALITY", 1.0))
+
+# Shared by every job, so searches reuse warm connections to api.pexels.com
+pexels_session = requests.Session()
+pexels_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
+# Search results for recurring topics come from disk; Pexels allows only a
+# few hundred requests per hour. Expired results are kept another
+# PEXELS_CACHE_STALE_TTL seconds to be revalidated with their ETag, or
+# served when Pexels fails. PEXELS_CACHE_TTL=0 disables the cache.
+PEXELS_CACHE_TTL = float(os.getenv("PEXELS_CACHE_TTL", 24 * 3600))
+search_cache = DiskCache(
+    "pexels",
+    os.path.abspath("../cache/pexels.db"),
+    ttl=PEXELS_CACHE_TTL,
+    max_bytes=int(float(os.getenv("PEXELS_CACHE_MAX_MB", 32)) * 1024 * 1024),
+    stale_ttl=float(os.getenv("PEXELS_CACHE_STALE_TTL", 7 * 24 * 3600)),
+) if PEXELS_CACHE_TTL > 0 else None
+
+
+def _fetch_search(query: str, it: int, api_key: str) -> dict:
+    """
+    Returns the Pexels search response for a query, from the cache when
+    possible. A stale cached response is revalidated with If-None-Match.
+    """
+    params = {"query": " ".join(query.lower().split()), "per_page": it}
+    key = DiskCache.make_key(params["query"], params["per_page"])
+    entry = search_cache.get_entry(key) if search_cache is not None else None
+    if entry is not None and entry[1]:
+        return json.loads(entry[0])["body"]
+
+    # Build headers
+    headers = {"Authorization": api_key}
+    cached = json.loads(entry[0]) if entry is not None else None
+    if cached is not None and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+
+    # Send the request
+    try:
+        r = pexels_session.get("https://api.pexels.com/videos/search", headers=headers, params=params,
+                               timeout=PEXELS_TIMEOUT)
+    except requests.RequestException:
+        EXTERNAL_FAILURES.inc(service="pexels")
+        if cached is not None:
+            print(colored(f"[!] Pexels unreachable, using cached results for \"{query}\"", "yellow"))
+            return cached["body"]
+        raise
+
+    if r.status_code == 304 and cached is not None:
+        search_cache.set(key, entry[0])
+        return cached["body"]
+    if r.status_code != 200:
+        EXTERNAL_FAILURES.inc(service="pexels")
+        if cached is not None:
+            print(colored(f"[!] Pexels returned HTTP {r.status_code}, using cached results for \"{query}\"",
+                          "yellow"))
+            return cached["body"]
+        # Let the caller report the real failure, not a KeyError on the error body
+        r.raise_for_status()
+        raise requests.HTTPError(f"Pexels returned HTTP {r.status_code}", response=r)
+
+    body = r.json()
+    if search_cache is not None:
+        search_cache.set(key, json.dumps({"etag": r.headers.get("ETag"), "body": body}).encode("utf-8"))
+    return body
+
+
+def _crop_height(width: int, height: int, target: Tuple[int, int]) -> float:
+    """Height of the largest crop with the target's aspect ratio that fits in width x height."""
+    return min(height, width * target[1] / target[0])
+
+
+def select_rendition(video_files: List[dict], target: Tuple[int, int] = OUTPUT_RESOLUTION,
+                     quality: float = STOCK_QUALITY) -> Optional[dict]:
+    """
+    Picks the rendition of a Pexels video to download.
+
+    Every clip is cropped to the target's aspect ratio and scaled to the
+    target, so any pixels beyond what the crop needs are downloaded and
+    decoded for nothing. Picks the smallest rendition whose crop covers
+    `quality` times the target height, or the largest one if none does.
+
+    Args:
+        video_files (List[dict]): The "video_files" of a Pexels video.
+        target (Tuple[int, int]): Output width and height.
+        quality (float): Share of the target the crop must cover.
+
+    Returns:
+        dict: The chosen rendition, or None if none has a download link.
+    """
+    renditions = [
+        video for video in video_files
+        if ".com/video-files" in video.get("link", "") and video.get("width") and video.get("height")
+    ]
+    if not renditions:
+        return None
+    renditions.sort(key=lambda video: video["width"] * video["height"])
+    needed = target[1] * quality
+    for video in renditions:
+        if _crop_height(video["width"], video["height"], target) >= needed:
+            return video
+    return renditions[-1]
+
+
+@timed("search_for_stock_videos")
 def search_for_stock_videos(query: str, api_key: str, it: int, min_dur: int) -> List[str]:
     """
     Searches for stock videos based on a query.
@@ -14,47 +132,22 @@ def search_for_stock_videos(query: str, api_key: str, it: int, min_dur: int) ->
     Returns:
         List[str]: A list of stock videos.
     """
-    
-    # Build headers
-    headers = {
-        "Authorization": api_key
-    }
-
-    # Build URL
-    qurl = f"https://api.pexels.com/videos/search?query={query}&per_page={it}"
-
-    # Send the request
-    r = requests.get(qurl, headers=headers)
-
-    # Parse the response
-    response = r.json()
+    response = _fetch_search(query, it, api_key)
 
     # Parse each video
-    raw_urls = []
     video_url = []
-    video_res = 0
     try:
         # loop through each video in the result
-        for i in range(it):
+        for video in response["videos"][:it]:
             #check if video has desired minimum duration
-            if response["videos"][i]["duration"] < min_dur:
+            if video["duration"] < min_dur:
                 continue
-            raw_urls = response["videos"][i]["video_files"]
-            temp_video_url = ""
-            
-            # loop through each url to determine the best quality
-            for video in raw_urls:
-                # Check if video has a valid download link
-                if ".com/video-files" in video["link"]:
-                    # Only save the URL with the largest resolution
-                    if (video["width"]*video["height"]) > video_res:
-                        temp_video_url = video["link"]
-                        video_res = video["width"]*video["height"]
-                        
-            # add the url to the return list if it's not empty
-            if temp_video_url != "":
-                video_url.append(temp_video_url)
-                
+
+            # pick the smallest file that still fills the output
+            rendition = select_rendition(video["video_files"])
+            if rendition is not None:
+                video_url.append(rendition["link"])
+
     except Exception as e:
         print(colored("[-] No Videos found.", "red"))
         print(colored(e, "red"))
@@ -64,3 +157,52 @@ def search_for_stock_videos(query: str, api_key: str, it: int, min_dur: int) ->
 
     # Return the video url
     return video_url
+
+
+def _search_quietly(query: str, api_key: str, it: int, min_dur: int) -> List[str]:
+    try:
+        return search_for_stock_videos(query, api_key, it, min_dur)
+    except Exception as e:
+        print(colored(f"[-] Search for \"{query}\" failed: {e}", "red"))
+        return []
+
+
+def iter_stock_videos(queries: Iterable[str], api_key: str, it: int, min_dur: int,
+                      per_query: int = 1, concurrency: int = PEXELS_CONCURRENCY) -> Iterator[str]:
+    """
+    Searches for stock videos for several queries at once and yields the
+    URLs while the searches are still running, so downloads can start
+    before the slowest search is done.
+
+    URLs come in the order of the queries: a search that finishes before
+    an earlier one is held until that one is in. The first query's URLs
+    therefore go to the downloads first, though the downloads themselves
+    land in the order they finish.
+
+    Args:
+        queries (Iterable[str]): The queries to search for.
+        api_key (str): The API key to use.
+        it (int): Results requested per query.
+        min_dur (int): Minimum video duration in seconds.
+        per_query (int): Videos taken from each query's results.
+        concurrency (int): Requests in flight at most.
+
+    Returns:
+        Iterator[str]: Video URLs, each at most once. A query whose search
+            fails contributes nothing.
+    """
+    queries = list(queries)
+    if not queries:
+        return
+    seen = set()
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(queries)))) as executor:
+        futures = [executor.submit(_search_quietly, query, api_key, it, min_dur) for query in queries]
+        for future in futures:
+            taken = 0
+            for url in future.result():
+                if taken == per_query:
+                    break
+                if url not in seen:
+                    seen.add(url)
+                    taken += 1
+                    yield url
@@ -0,0 +1,92 @@
+import re
+import math
+from collections import Counter
+from typing import Dict, List, Set
+
+
+def word_shingles(text: str, n: int = 3) -> Set[str]:
+    """
+    Returns the set of n-word sequences of a text, ignoring case and
+    punctuation. Texts shorter than n words give a single shingle.
+    """
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    """Jaccard similarity of two sets, 0 for two empty sets."""
+    if not a and not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def is_near_duplicate(text: str, others: List[str], threshold: float = 0.5, n: int = 3) -> bool:
+    """
+    Tells whether `text` shares at least `threshold` of its word shingles
+    (Jaccard) with any of `others`. Copies with a few words changed share
+    most shingles; scripts written independently on the same subject
+    share few beyond the subject's name.
+    """
+    shingles = word_shingles(text, n)
+    return any(jaccard(shingles, word_shingles(other, n)) >= threshold for other in others)
+
+
+def char_ngrams(text: str, n: int = 3) -> Counter:
+    """
+    Counts the character n-grams of each word of a text, ignoring case
+    and word order. Words are padded with spaces, so "sea" gives " se",
+    "sea" and "ea ".
+    """
+    grams = Counter()
+    for word in re.findall(r"\w+", text.lower()):
+        padded = f" {word} "
+        grams.update(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+    return grams
+
+
+def tfidf_vectors(texts: List[str], n: int = 3) -> List[Dict[str, float]]:
+    """
+    Returns a unit-length TF-IDF vector of character n-grams per text.
+    N-grams found in every text weigh nothing, so a word all the texts
+    share (like the video subject in every search term) doesn't make
+    them similar.
+    """
+    counts = [char_ngrams(text, n) for text in texts]
+    df = Counter(gram for grams in counts for gram in grams)
+    vectors = []
+    for grams in counts:
+        vector = {gram: tf * math.log(len(texts) / df[gram]) for gram, tf in grams.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        vectors.append({gram: weight / norm for gram, weight in vector.items() if weight} if norm else {})
+    return vectors
+
+
+def cosine(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """Cosine similarity of two unit-length sparse vectors."""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(gram, 0.0) for gram, weight in a.items())
+
+
+def cluster_terms(terms: List[str], threshold: float = 0.4, n: int = 3) -> List[List[str]]:
+    """
+    Groups near-duplicate terms ("ocean waves", "waves ocean", "sea waves")
+    by the cosine similarity of their character n-gram TF-IDF vectors.
+    Each term joins the first cluster whose first term it's at least
+    `threshold` similar to, so clusters and their members keep the order
+    of `terms`. Terms equal ignoring case and spacing always cluster.
+    """
+    vectors = tfidf_vectors(terms, n)
+    clusters, heads = [], []
+    for term, vector in zip(terms, vectors):
+        key = " ".join(term.lower().split())
+        for cluster, (head_key, head_vector) in zip(clusters, heads):
+            if key == head_key or cosine(vector, head_vector) >= threshold:
+                cluster.append(term)
+                break
+        else:
+            clusters.append([term])
+            heads.append((key, vector))
+    return clusters
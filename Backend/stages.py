@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from termcolor import colored
+
+
+class StageError(Exception):
+    """
+    Raised when a stage of a stage graph fails. Wraps the original exception
+    and remembers which stage it came from.
+    """
+
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+@dataclass
+class Stage:
+    """
+    A named unit of work in a stage graph.
+
+    `func` is called with one keyword argument per dependency, named after
+    the dependency and bound to that stage's result. `resource` names the
+    scheduler pool the stage runs in ("cpu" or "io"), None runs it unlimited.
+    """
+    name: str
+    func: Callable[..., Any]
+    deps: Tuple[str, ...] = field(default_factory=tuple)
+    resource: Optional[str] = None
+
+
+class Journal:
+    """
+    A small JSON file recording the results of finished stages (and of
+    finer-grained steps inside them), so a retried job resumes where it
+    left off instead of redoing everything.
+
+    A recorded result only counts while every absolute file path in it
+    still exists, so deleting an intermediate file forces it to be redone.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def lookup(self, key: str) -> Tuple[bool, Any]:
+        """Returns (True, result) if `key` was recorded and its files still exist, else (False, None)."""
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            value = self._entries[key]
+        if not _files_exist(value):
+            return False, None
+        return True, value
+
+    def record(self, key: str, value: Any) -> None:
+        """Records a result. Results that aren't JSON-serializable are not journaled."""
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            print(colored(f"[!] Not journaling '{key}': result is not JSON-serializable", "yellow"))
+            return
+        with self._lock:
+            self._entries[key] = value
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+
+    def memo(self, key: str, func: Callable[[], Any]) -> Any:
+        """Returns the recorded result for `key`, or calls func() and records what it returns."""
+        found, value = self.lookup(key)
+        if found:
+            print(colored(f"[journal] Reusing {key}", "magenta"))
+            return value
+        value = func()
+        self.record(key, value)
+        return value
+
+
+def _files_exist(value: Any) -> bool:
+    if isinstance(value, str):
+        return not os.path.isabs(value) or os.path.exists(value)
+    if isinstance(value, (list, tuple)):
+        return all(_files_exist(item) for item in value)
+    if isinstance(value, dict):
+        return all(_files_exist(item) for item in value.values())
+    return True
+
+
+def _validate(stages: List[Stage]) -> List[str]:
+    """Checks names and dependencies, and returns the stage names in dependency order."""
+    names = [stage.name for stage in stages]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Duplicate stage names in graph: {names}")
+
+    known = set(names)
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in known]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {missing}")
+
+    # Kahn's algorithm, which also rejects cycles up front
+    order = []
+    remaining = {stage.name: set(stage.deps) for stage in stages}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Stage graph has a cycle between: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+        order.extend(ready)
+    return order
+
+
+def _restore(stages: List[Stage], order: List[str], journal: Journal) -> Dict[str, Any]:
+    """
+    Returns the journaled results that can be reused. A stage is only
+    restored if all of its dependencies were restored too; once a stage
+    has to run again, everything downstream of it is redone as well.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    restored = {}
+    for name in order:
+        if not all(dep in restored for dep in by_name[name].deps):
+            continue
+        found, value = journal.lookup(name)
+        if found:
+            restored[name] = value
+    return restored
+
+
+def run_stages(
+    stages: List[Stage],
+    max_workers: Optional[int] = None,
+    on_event: Optional[Callable[[str, str], None]] = None,
+    cancel_token=None,
+    journal: Optional[Journal] = None,
+    scheduler=None,
+) -> Dict[str, Any]:
+    """
+    Runs a graph of stages, starting every stage as soon as all of its
+    dependencies have finished, so independent stages overlap.
+
+    Args:
+        stages (List[Stage]): The stages to run.
+        max_workers (int): Maximum number of stages running at once.
+            Defaults to the number of stages.
+        on_event (Callable): Optional callback, called as
+            on_event(stage_name, "started" | "finished" | "failed" | "restored").
+        cancel_token (CancelToken): Optional token checked before every
+            stage is started.
+        journal (Journal): Optional journal. Stages with a usable
+            journaled result are not run again, and every stage that
+            finishes is recorded.
+        scheduler (Scheduler): Optional. Every stage waits for a slot in
+            its resource pool before it starts.
+
+    Returns:
+        Dict[str, Any]: The result of every stage, keyed by stage name.
+
+    Raises:
+        StageError: If any stage raises. Stages that have not started yet
+            are not started; stages already running are waited for.
+        JobCancelled: If the cancel token fires between stages.
+    """
+    order = _validate(stages)
+
+    def notify(name: str, event: str) -> None:
+        if on_event is not None:
+            on_event(name, event)
+
+    def call(stage: Stage) -> Any:
+        if scheduler is None:
+            return run(stage)
+        with scheduler.slot(stage.resource):
+            return run(stage)
+
+    def run(stage: Stage) -> Any:
+        if cancel_token is not None:
+            # Waiting for a slot can take a while
+            cancel_token.raise_if_cancelled()
+        start = time.monotonic()
+        notify(stage.name, "started")
+        result = stage.func(**{dep: results[dep] for dep in stage.deps})
+        if journal is not None:
+            journal.record(stage.name, result)
+        elapsed = time.monotonic() - start
+        print(colored(f"[stage] {stage.name} finished in {elapsed:.2f}s", "magenta"))
+        return result
+
+    results: Dict[str, Any] = _restore(stages, order, journal) if journal is not None else {}
+    for name in results:
+        print(colored(f"[stage] {name} restored from journal", "magenta"))
+        notify(name, "restored")
+
+    pending = {stage.name: stage for stage in stages if stage.name not in results}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(pending) or 1) as executor:
+        while pending or running:
+            if cancel_token is not None and cancel_token.cancelled:
+                pending.clear()
+                wait(running)
+                cancel_token.raise_if_cancelled()
+
+            for name, stage in list(pending.items()):
+                if all(dep in results for dep in stage.deps):
+                    running[executor.submit(call, stage)] = name
+                    del pending[name]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            failure = None
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    notify(name, "finished")
+                except Exception as e:
+                    notify(name, "failed")
+                    failure = failure or StageError(name, e)
+
+            if failure is not None:
+                pending.clear()
+                wait(running)
+                raise failure
+
+    return results
@@ -0,0 +1,43 @@
+import pytest
+
+from llmjson import JsonExtractor, SchemaError, extract_json, parse_llm_json, validate_search_terms
+
+
+def test_truncated_array_keeps_last_complete_string():
+    assert extract_json('["a", "b"') == [["a", "b"]]
+    assert extract_json('["a", "b", "c') == [["a", "b"]]
+
+
+def test_truncated_object_drops_dangling_key():
+    assert extract_json('{"a": "b", "c"') == [{"a": "b"}]
+
+
+def test_values_nested_in_non_json_brackets():
+    assert extract_json('see [a [1, 2] b] and {"k": [3]}') == [[1, 2], {"k": [3]}]
+
+
+def test_streamed_matches_whole_text():
+    text = 'pre [bad] then ["a", "b"] and ["c"'
+    extractor = JsonExtractor()
+    values = []
+    for c in text:
+        values += extractor.feed(c)
+    assert values + extractor.close() == extract_json(text) == [["a", "b"], ["c"]]
+
+
+@pytest.mark.parametrize("text", ["[" * 2000, "[" * 2000 + "]" * 2000], ids=["open", "closed"])
+def test_deep_nesting_does_not_recurse(text):
+    extract_json(text)
+    with pytest.raises(SchemaError):
+        parse_llm_json(text, validate_search_terms)
+
+
+def test_value_under_deep_nesting_is_found():
+    assert parse_llm_json("[" * 2000 + '"x"', validate_search_terms) == ["x"]
+
+
+def test_truncated_trailing_number_is_kept():
+    assert extract_json("[1, 2, 3") == [[1, 2, 3]]
+    assert extract_json('{"a": 1, "b": 22') == [{"a": 1, "b": 22}]
+    # Not a number yet: dropped
+    assert extract_json("[1, 2, 3.5e") == [[1, 2]]
@@ -0,0 +1,60 @@
+import pytest
+
+from llm import LLMError
+from router import LLMRouter, StandInProvider
+
+
+class CountingProvider(StandInProvider):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = 0
+
+    def complete(self, prompt, ai_model, json_mode=False):
+        self.calls += 1
+        return super().complete(prompt, ai_model, json_mode)
+
+
+def test_slow_primary_loses_to_hedge():
+    router = LLMRouter([StandInProvider(reply=lambda prompt: "slow", delay=1.0, name="slow"),
+                        StandInProvider(reply=lambda prompt: "fast", name="fast")], hedge_delay=0.05)
+    assert router.complete("prompt", "model") == "fast"
+
+
+def test_hedges_past_measured_p95():
+    primary = StandInProvider(reply=lambda prompt: "primary", delay=0.01, name="primary")
+    router = LLMRouter([primary, StandInProvider(reply=lambda prompt: "backup", name="backup")], hedge_samples=5)
+    for _ in range(5):
+        assert router.complete("prompt", "model") == "primary"
+    primary.delay = 1.0
+    assert router.complete("prompt", "model") == "backup"
+
+
+def test_no_hedging_before_enough_samples():
+    router = LLMRouter([StandInProvider(reply=lambda prompt: "primary", delay=0.2, name="primary"),
+                        StandInProvider(reply=lambda prompt: "backup", name="backup")])
+    assert router.complete("prompt", "model") == "primary"
+
+
+def test_streams_stay_out_of_hedge_latency():
+    router = LLMRouter([StandInProvider(delay=0.05, name="primary")], hedge_samples=1)
+    assert "".join(router.stream("prompt", "model"))
+    assert router.stats["primary"].latency_quantile(0.95, 1) is None
+
+
+def test_failing_provider_is_failed_over_and_cooled_down():
+    failing = CountingProvider(fail_rate=1.0, name="failing")
+    backup = CountingProvider(reply=lambda prompt: "backup", name="backup")
+    router = LLMRouter([failing, backup], hedge_delay=0, min_samples=2, error_threshold=0.5, cooldown=60)
+    for _ in range(2):
+        assert router.complete("prompt", "model") == "backup"
+    assert not router.stats["failing"].available()
+
+    assert router.complete("prompt", "model") == "backup"
+    assert failing.calls == 2 and backup.calls == 3
+
+
+def test_every_provider_failing_raises():
+    router = LLMRouter([StandInProvider(fail_rate=1.0, name="a"), StandInProvider(fail_rate=1.0, name="b")],
+                       hedge_delay=0)
+    with pytest.raises(LLMError, match="a: .*b: "):
+        router.complete("prompt", "model")
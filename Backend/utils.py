@@ -2,7 +2,9 @@ import os
 import sys
 import json
 import random
+import shutil
 import logging
+import threading
 import zipfile
 import requests
 
@@ -12,6 +14,15 @@ from termcolor import colored
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Every short renders in its own scratch directory below this one
+WORKSPACES_DIR = "../temp"
+
+# Size of the stock footage track; collect_clips crops and scales every clip to it
+OUTPUT_RESOLUTION = (720, 1280)
+
+_gradio_locks = {}
+_gradio_locks_guard = threading.Lock()
+
 
 def clean_dir(path: str) -> None:
     """
@@ -37,6 +48,61 @@ def clean_dir(path: str) -> None:
     except Exception as e:
         logger.error(f"Error occurred while cleaning directory {path}: {str(e)}")
 
+def workspace_path(*parts) -> str:
+    """
+    Returns the absolute path of a workspace without creating it.
+
+    Args:
+        parts: Path components below WORKSPACES_DIR.
+
+    Returns:
+        str: Absolute path to the workspace.
+    """
+    return os.path.abspath(os.path.join(WORKSPACES_DIR, *[str(part) for part in parts]))
+
+def create_workspace(*parts) -> str:
+    """
+    Creates an isolated scratch directory, e.g. create_workspace(task_id, 0)
+    gives ../temp/<task_id>/0. Concurrent shorts never share a workspace,
+    so one of them cleaning up can't delete another one's files.
+
+    Args:
+        parts: Path components below WORKSPACES_DIR.
+
+    Returns:
+        str: Absolute path to the workspace.
+    """
+    path = workspace_path(*parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def remove_workspace(path: str) -> None:
+    """
+    Removes a workspace created by create_workspace and everything in it.
+
+    Args:
+        path (str): Path to the workspace.
+
+    Returns:
+        None
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    logger.info(colored(f"Removed workspace {path}", "green"))
+
+def gradio_lock(url: str) -> threading.Lock:
+    """
+    Returns the lock guarding a local Gradio server. The Gradio apps we drive
+    keep UI state between calls, so only one job may talk to a server at once.
+
+    Args:
+        url (str): URL of the Gradio server.
+
+    Returns:
+        threading.Lock: The lock for that server.
+    """
+    with _gradio_locks_guard:
+        return _gradio_locks.setdefault(url.rstrip("/"), threading.Lock())
+
 def fetch_songs(zip_url: str) -> None:
     """
     Downloads songs into songs/ directory to use with geneated videos.
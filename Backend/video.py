@@ -1,12 +1,13 @@
 import os
+import time
 import uuid
+import queue
+import threading
 import random
 import numpy as np
-import requests
-import srt_equalizer
 import assemblyai as aai
 import whisper
-from typing import List
+from typing import Iterable, Iterator, List, Union
 from moviepy.editor import *
 from termcolor import colored
 from dotenv import load_dotenv
@@ -16,6 +17,12 @@ from moviepy.audio.io.AudioFileClip import AudioFileClip
 from moviepy.editor import CompositeAudioClip
 from moviepy.editor import TextClip, CompositeVideoClip
 from moviepy.config import change_settings
+from progress import render_logger
+from cues import CueTable
+from metrics import timed
+from download import download_file
+from utils import OUTPUT_RESOLUTION
+from concurrent.futures import ThreadPoolExecutor, wait
 from video_effect.popuptext import create_pop_text_clip
 from video_effect.videomoment import add_shaky_effect, add_subtle_zoom_movement, create_video_from_images
 
@@ -25,18 +32,153 @@ change_settings({"IMAGEMAGICK_BINARY": r"C:\Program Files\ImageMagick-7.1.2-Q16\
 load_dotenv("../.env")
 
 ASSEMBLY_AI_API_KEY = os.getenv("ASSEMBLY_AI_API_KEY")
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", 4))
+# Once the first clip is in, seconds to wait for the others before going on without them
+DOWNLOAD_STRAGGLER_TIMEOUT = float(os.getenv("DOWNLOAD_STRAGGLER_TIMEOUT", 120))
 
 
-def save_video(video_url: str, directory: str = "../temp") -> str:
+@timed("save_video")
+def save_video(video_url: str, directory: str = "../temp", cancel_token=None) -> str:
     """
     Saves a video from a given URL and returns the path to the video.
+    The video is streamed to disk, never held in memory as a whole.
     """
     video_id = uuid.uuid4()
     video_path = f"{directory}/{video_id}.mp4"
-    with open(video_path, "wb") as f:
-        f.write(requests.get(video_url).content)
+    download_file(video_url, video_path, service="pexels_download", cancel_token=cancel_token)
     return video_path
 
+
+def _saver(directory: str, save, cancel_token):
+    """Wraps `save` (or save_video) to return None for a failed download."""
+    save = save or (lambda url: save_video(url, directory, cancel_token))
+
+    def save_one(url):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        try:
+            return save(url)
+        except Exception as e:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            print(colored(f"[-] Could not download {url}: {e}", "red"))
+            return None
+
+    return save_one
+
+
+_DOWNLOADS_DONE = object()
+
+
+class DownloadedPaths:
+    """
+    The iterator returned by save_videos_iter. close() stops the downloads
+    even if the paths were never iterated, which closing a generator
+    doesn't do.
+    """
+
+    def __init__(self, paths: Iterator[str], stop):
+        self._paths = paths
+        self._stop = stop
+
+    def __iter__(self) -> "DownloadedPaths":
+        return self
+
+    def __next__(self) -> str:
+        return next(self._paths)
+
+    def close(self) -> None:
+        self._stop()
+        self._paths.close()
+
+
+def save_videos_iter(video_urls: Iterable[str], directory: str = "../temp",
+                     concurrency: int = DOWNLOAD_CONCURRENCY, save=None, cancel_token=None,
+                     straggler_timeout: float = DOWNLOAD_STRAGGLER_TIMEOUT) -> DownloadedPaths:
+    """
+    Downloads videos as their URLs come in, e.g. from iter_stock_videos,
+    and yields each path as soon as it's on disk. Downloads start right
+    away, not when the result is first iterated.
+
+    Closing the returned iterator stops the downloads: no further URLs are
+    taken and queued downloads are cancelled. Those already running finish
+    in the background.
+
+    Args:
+        video_urls (Iterable[str]): The videos to save; may be a generator
+            still producing URLs.
+        directory (str): Where to save them.
+        concurrency (int): Downloads running at most.
+        save (Callable): Saves one URL and returns its path, instead of
+            save_video, e.g. to go through a cache.
+        cancel_token (CancelToken): Stops the downloads when triggered.
+        straggler_timeout (float): Once the first video is in, seconds to
+            wait for the others. Downloads still running then are left to
+            finish in the background, but aren't yielded. None waits for all.
+
+    Returns:
+        DownloadedPaths: Paths in the order the downloads finish. Videos
+            that failed to download are left out.
+    """
+    save_one = _saver(directory, save, cancel_token)
+    results = queue.Queue()
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+    stopped = threading.Event()
+    futures = []
+
+    def feed():
+        try:
+            for url in video_urls:
+                if stopped.is_set() or (cancel_token is not None and cancel_token.cancelled):
+                    break
+                future = executor.submit(save_one, url)
+                future.add_done_callback(results.put)
+                futures.append(future)
+            wait(futures)
+        except Exception as e:
+            results.put(e)
+        finally:
+            results.put(_DOWNLOADS_DONE)
+            executor.shutdown(wait=False)
+
+    threading.Thread(target=feed, name="video-downloads", daemon=True).start()
+
+    def stop():
+        stopped.set()
+        for future in list(futures):
+            future.cancel()
+
+    def paths():
+        try:
+            yield from wait_for_paths()
+        finally:
+            stop()
+
+    def wait_for_paths():
+        first_at = None
+        while True:
+            timeout = None
+            if straggler_timeout is not None and first_at is not None:
+                timeout = max(0.0, first_at + straggler_timeout - time.monotonic())
+            try:
+                item = results.get(timeout=timeout)
+            except queue.Empty:
+                print(colored(f"[!] Going on without the downloads still running after {straggler_timeout}s",
+                              "yellow"))
+                return
+            if item is _DOWNLOADS_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            if item.cancelled():
+                continue
+            path = item.result()
+            if path:
+                first_at = first_at or time.monotonic()
+                yield path
+
+    return DownloadedPaths(paths(), stop)
+
 def cleanup_images(image_paths: List[str]):
     """Clean up temporary image files."""
     for path in image_paths:
@@ -46,136 +188,170 @@ def cleanup_images(image_paths: List[str]):
             pass
 
 
-def __generate_subtitles_whisper(audio_path: str, model_size: str = "base") -> str:
+def __generate_subtitles_whisper(audio_path: str, model_size: str = "base") -> CueTable:
     """
     Generates subtitles from a given audio file using local Whisper.
     """
-    def convert_to_srt_time_format(total_seconds):
-        h, remainder = divmod(int(total_seconds), 3600)
-        m, s = divmod(remainder, 60)
-        ms = int((total_seconds - int(total_seconds)) * 1000)
-        return f"{h:01}:{m:02}:{s:02},{ms:03}"
-
     print(colored(f"[+] Transcribing locally with Whisper ({model_size})...", "blue"))
     model = whisper.load_model(model_size)
     result = model.transcribe(audio_path, word_timestamps=True, fp16=False)
+    return CueTable.from_segments(result["segments"])
 
-    subtitles = []
-    for i, seg in enumerate(result["segments"], start=1):
-        start = convert_to_srt_time_format(seg["start"])
-        end = convert_to_srt_time_format(seg["end"])
-        text = seg["text"].strip()
-        subtitles.append(f"{i}\n{start} --> {end}\n{text}\n")
 
-    return "\n".join(subtitles)
-
-
-def generate_subtitles(audio_path: str, model_size: str = "base") -> str:
+@timed("generate_subtitles")
+def generate_subtitles(audio_path: str, model_size: str = "base", directory: str = "../subtitles",
+                       cancel_token=None) -> str:
     """
     Generates subtitles from an audio file using Whisper locally, with debug prints.
+    Cues are split to at most 10 characters before the SRT file is written.
     """
-    def equalize_subtitles(srt_path: str, max_chars: int = 10):
-        print(colored(f"[DEBUG] Equalizing subtitles with max_chars={max_chars}: {srt_path}", "yellow"))
-        srt_equalizer.equalize_srt_file(srt_path, srt_path, max_chars)
-        print(colored("[DEBUG] Subtitle equalization complete.", "yellow"))
+    max_chars = 10
 
-    subtitles_path = f"../subtitles/{uuid.uuid4()}.srt"
+    os.makedirs(directory, exist_ok=True)
+    subtitles_path = f"{directory}/{uuid.uuid4()}.srt"
     print(colored(f"[DEBUG] Subtitles will be saved to: {subtitles_path}", "yellow"))
     print(colored(f"[DEBUG] Using audio file: {audio_path}", "yellow"))
     print(colored(f"[DEBUG] Using Whisper model: {model_size}", "yellow"))
 
+    # Whisper can't be interrupted mid-transcription, so check right before it
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
     try:
-        subtitles = __generate_subtitles_whisper(audio_path, model_size=model_size)
-        print(colored(f"[DEBUG] Raw subtitles generated:\n{subtitles[:500]}...", "yellow"))  # show first 500 chars
+        cues = __generate_subtitles_whisper(audio_path, model_size=model_size)
+        print(colored(f"[DEBUG] Raw subtitles generated:\n{cues.to_srt()[:500]}...", "yellow"))  # show first 500 chars
     except Exception as e:
         print(colored(f"[ERROR] Whisper transcription failed: {e}", "red"))
         raise
 
+    print(colored(f"[DEBUG] Equalizing subtitles with max_chars={max_chars}", "yellow"))
+    cues = cues.equalize(max_chars)
+
     try:
-        with open(subtitles_path, "w", encoding="utf-8") as f:
-            f.write(subtitles)
+        # Also keeps the table in memory for the stages reading this file
+        cues.write(subtitles_path)
         print(colored(f"[DEBUG] Subtitles written to file: {subtitles_path}", "yellow"))
     except Exception as e:
         print(colored(f"[ERROR] Failed to write subtitles file: {e}", "red"))
         raise
 
-    try:
-        equalize_subtitles(subtitles_path)
-    except Exception as e:
-        print(colored(f"[ERROR] Subtitle equalization failed: {e}", "red"))
-        raise
-
     print(colored("[+] Subtitles generated successfully.", "green"))
     return subtitles_path
 
 
 
-def combine_videos(video_paths: List[str], max_duration: int, max_clip_duration: int, threads: int) -> str:
+@timed("collect_clips")
+def collect_clips(video_paths: Iterable[str], max_duration: int, max_clip_duration: int,
+                  cancel_token=None, expected_clips: int = None) -> list:
     """
-    Combines a list of videos into one video.
+    Opens, trims and crops the clips for a video of `max_duration` seconds,
+    repeating them if they fall short.
+
+    video_paths may be an iterator still producing paths, like
+    save_videos_iter; each clip is opened and trimmed as soon as it
+    arrives, and the iterator is closed as soon as there's enough footage,
+    which stops its remaining downloads. expected_clips is then the number
+    of clips to plan for.
+
+    Returns:
+        list: The clips, ready for write_combined.
     """
-    video_id = uuid.uuid4()
-    combined_video_path = f"../temp/{video_id}.mp4"
-    
-    # Filter out non-video files
-    valid_video_paths = []
-    for video_path in video_paths:
-        if video_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv')):
-            valid_video_paths.append(video_path)
-        else:
-            print(colored(f"[!] Skipping non-video file: {video_path}", "yellow"))
-    
-    if not valid_video_paths:
-        raise ValueError("No valid video files found to combine")
-    
+    if expected_clips is None:
+        video_paths = list(video_paths)
+        expected_clips = len(video_paths)
+
     # Required duration of each clip
-    req_dur = max_duration / len(valid_video_paths)
+    req_dur = max_duration / max(1, expected_clips)
 
     print(colored("[+] Combining videos...", "blue"))
     print(colored(f"[+] Each clip will be maximum {req_dur} seconds long.", "blue"))
 
     clips = []
     tot_dur = 0
+
+    def add_clip(video_path):
+        nonlocal tot_dur
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        try:
+            clip = VideoFileClip(video_path)
+            clip = clip.without_audio()
+
+            # Check if clip is longer than the remaining audio
+            if (max_duration - tot_dur) < clip.duration:
+                clip = clip.subclip(0, (max_duration - tot_dur))
+            # Only shorten clips if the calculated clip length (req_dur) is shorter than the actual clip to prevent still image
+            elif req_dur < clip.duration:
+                clip = clip.subclip(0, req_dur)
+            clip = clip.set_fps(30)
+
+            # Not all videos are same size, so we need to resize them
+            aspect = OUTPUT_RESOLUTION[0] / OUTPUT_RESOLUTION[1]
+            if round((clip.w/clip.h), 4) < aspect:
+                clip = crop(clip, width=clip.w, height=round(clip.w/aspect),
+                            x_center=clip.w / 2, y_center=clip.h / 2)
+            else:
+                clip = crop(clip, width=round(aspect*clip.h), height=clip.h,
+                            x_center=clip.w / 2, y_center=clip.h / 2)
+            clip = clip.resize(OUTPUT_RESOLUTION)
+
+            if clip.duration > max_clip_duration:
+                clip = clip.subclip(0, max_clip_duration)
+
+            clips.append(clip)
+            tot_dur += clip.duration
+        except Exception as e:
+            print(colored(f"[!] Error processing {video_path}: {e}", "red"))
+
+    # Filter out non-video files, using each clip as it arrives
+    valid_video_paths = []
+    try:
+        for video_path in video_paths:
+            if not video_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv', '.webm', '.flv', '.wmv')):
+                print(colored(f"[!] Skipping non-video file: {video_path}", "yellow"))
+                continue
+            valid_video_paths.append(video_path)
+            add_clip(video_path)
+            if tot_dur >= max_duration:
+                break
+    finally:
+        # Enough footage: don't wait for, or keep downloading, the rest
+        if hasattr(video_paths, "close"):
+            video_paths.close()
+
+    if not valid_video_paths:
+        raise ValueError("No valid video files found to combine")
+
     # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached
     while tot_dur < max_duration:
+        added = len(clips)
         for video_path in valid_video_paths:
-            try:
-                clip = VideoFileClip(video_path)
-                clip = clip.without_audio()
-                
-                # Check if clip is longer than the remaining audio
-                if (max_duration - tot_dur) < clip.duration:
-                    clip = clip.subclip(0, (max_duration - tot_dur))
-                # Only shorten clips if the calculated clip length (req_dur) is shorter than the actual clip to prevent still image
-                elif req_dur < clip.duration:
-                    clip = clip.subclip(0, req_dur)
-                clip = clip.set_fps(30)
-
-                # Not all videos are same size, so we need to resize them
-                if round((clip.w/clip.h), 4) < 0.5625:
-                    clip = crop(clip, width=clip.w, height=round(clip.w/0.5625), 
-                                x_center=clip.w / 2, y_center=clip.h / 2)
-                else:
-                    clip = crop(clip, width=round(0.5625*clip.h), height=clip.h,
-                                x_center=clip.w / 2, y_center=clip.h / 2)
-                clip = clip.resize((720, 1280))
-
-                if clip.duration > max_clip_duration:
-                    clip = clip.subclip(0, max_clip_duration)
-
-                clips.append(clip)
-                tot_dur += clip.duration
-                
-                if tot_dur >= max_duration:
-                    break
-                    
-            except Exception as e:
-                print(colored(f"[!] Error processing {video_path}: {e}", "red"))
-                continue
+            add_clip(video_path)
+            if tot_dur >= max_duration:
+                break
+        if len(clips) == added:
+            raise ValueError("None of the videos could be used")
+
+    return clips
+
+
+@timed("write_combined")
+def write_combined(clips: list, threads: int, directory: str = "../temp", cancel_token=None,
+                   on_progress=None) -> str:
+    """
+    Concatenates clips from collect_clips and encodes them to one video.
 
+    on_progress, if given, is called as on_progress(bar, done, total) while
+    the result is written, with bar "chunk" for audio and "t" for frames.
+
+    Returns:
+        str: Path to the combined video.
+    """
+    combined_video_path = f"{directory}/{uuid.uuid4()}.mp4"
     final_clip = concatenate_videoclips(clips)
     final_clip = final_clip.set_fps(30)
-    final_clip.write_videofile(combined_video_path, threads=threads, verbose=False, logger=None)
+    final_clip.write_videofile(combined_video_path, threads=threads, verbose=False,
+                               logger=render_logger(cancel_token, on_progress))
 
     return combined_video_path
 
@@ -211,10 +387,11 @@ def add_background_music(video_clip, music_path, volume=0.3, loop=True):
     # Set the composite audio to the video clip
     return video_clip.set_audio(composite_audio)
 
+@timed("generate_video")
 def generate_video(
     combined_video_path: str,
     tts_path: str,
-    subtitles_path: str,
+    subtitles_path: Union[str, CueTable],
     threads: int,
     subtitles_position: str,
     text_color: str,
@@ -226,10 +403,14 @@ def generate_video(
     zoom_effect: bool = True,  
     max_zoom: float = 1.13,  # Changed from zoom_range to max_zoom (3% zoom)
     movement_range: float = 50,  
-    zoom_change_interval: float = 3.0 
+    zoom_change_interval: float = 3.0,
+    cancel_token=None,
+    on_progress=None
 ) -> str:
     """
     This function creates the final video, with subtitles and audio.
+    subtitles_path is an SRT file or an already loaded CueTable.
+    on_progress is called as on_progress(bar, done, total) while writing.
     """
     # Ensure Generated_Video folder exists
     output_dir = "../Generated_Video"
@@ -242,35 +423,12 @@ def generate_video(
     # Load the video clip
     video_clip = VideoFileClip(combined_video_path)
 
-    # Read subtitles from file
-    with open(subtitles_path, 'r', encoding='utf-8') as f:
-        subtitle_content = f.read()
-    
-    # Parse subtitles manually to create animated text clips
+    # Create animated text clips from the subtitle cues
     subtitle_clips = []
-    subtitle_blocks = subtitle_content.strip().split('\n\n')
-    
-    for block in subtitle_blocks:
-        lines = block.strip().split('\n')
-        if len(lines) < 3:
-            continue
-            
-        # Parse timecodes
-        timecode_line = lines[1]
-        start_time, end_time = timecode_line.split(' --> ')
-        
-        # Convert timecode to seconds
-        def timecode_to_seconds(timecode):
-            h, m, s_ms = timecode.split(':')
-            s, ms = s_ms.split(',')
-            return int(h)*3600 + int(m)*60 + int(s) + int(ms)/1000.0
-        
-        start_seconds = timecode_to_seconds(start_time)
-        end_seconds = timecode_to_seconds(end_time)
+    for start_seconds, end_seconds, text in CueTable.load(subtitles_path):
         duration = end_seconds - start_seconds
-        
-        text = ' '.join(lines[2:])
-        
+        text = ' '.join(text.split('\n'))
+
         text_clip = create_pop_text_clip(
             text,
             duration=duration,
@@ -307,7 +465,8 @@ def generate_video(
                 min_zoom=1.0,
                 max_zoom=max_zoom,  
                 horizontal_range=movement_range,
-                cycles=zoom_change_interval
+                cycles=zoom_change_interval,
+                cancel_token=cancel_token
             )
     except Exception as e:
         print(colored(f"[WARNING] Zoom effect failed: {e}, continuing without it", "yellow"))
@@ -316,11 +475,11 @@ def generate_video(
         if shaky_effect:
             print(colored("[+] Applying continuous smooth shaky effect to final video...", "blue"))
             # Use the MoviePy version (more reliable)
-            result = add_shaky_effect(result, shake_intensity, shake_frequency)
+            result = add_shaky_effect(result, shake_intensity, shake_frequency, cancel_token)
     except Exception as e:
         print(colored(f"[WARNING] Shaky effect failed: {e}, trying OpenCV version", "yellow"))
         try:
-            result = add_shaky_effect(result, shake_intensity, shake_frequency)
+            result = add_shaky_effect(result, shake_intensity, shake_frequency, cancel_token)
         except Exception as e2:
             print(colored(f"[WARNING] Both shaky effect methods failed: {e2}, continuing without shaky effect", "yellow"))
 
@@ -337,7 +496,7 @@ def generate_video(
         preset='medium', 
         ffmpeg_params=['-crf', '23', '-pix_fmt', 'yuv420p'],
         verbose=False,
-        logger=None
+        logger=render_logger(cancel_token, on_progress)
     )
 
     print(colored(f"[+] Final video saved as {final_video_path}", "green"))
@@ -8,13 +8,14 @@ import os
 
 
 
-def add_subtle_zoom_movement(clip, min_zoom=1.0, max_zoom=1.05, horizontal_range=50, cycles=1):
+def add_subtle_zoom_movement(clip, min_zoom=1.0, max_zoom=1.05, horizontal_range=50, cycles=1, cancel_token=None):
     """
     Smooth zoom in/out with **visible left-right movement**.
     - min_zoom -> max_zoom -> min_zoom
     - Horizontal movement goes left -> right -> left (oscillates)
     - 'horizontal_range' is max pixels moved left or right
     - 'cycles' = number of horizontal swings during clip
+    - 'cancel_token' aborts rendering with JobCancelled on the next frame once cancelled
     """
     print(colored(f"[DEBUG] Applying Ken Burns effect: min_zoom={min_zoom}, max_zoom={max_zoom}, horizontal_range={horizontal_range}, cycles={cycles}", "yellow"))
 
@@ -35,6 +36,8 @@ def add_subtle_zoom_movement(clip, min_zoom=1.0, max_zoom=1.05, horizontal_range
         return frame
 
     def apply_effect(get_frame, t):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
         frame = normalize_frame(get_frame(t))
         h, w = frame.shape[:2]
 
@@ -74,13 +77,14 @@ def add_subtle_zoom_movement(clip, min_zoom=1.0, max_zoom=1.05, horizontal_range
 
 
 
-def add_shaky_effect(clip, intensity=10, frequency=20):
+def add_shaky_effect(clip, intensity=10, frequency=20, cancel_token=None):
     """
     Adds a smooth vertical-only shaky effect (up and down) to a clip.
     
     Parameters:
     - intensity: maximum vertical displacement in pixels
     - frequency: how many shakes per second
+    - cancel_token: aborts rendering with JobCancelled on the next frame once cancelled
     """
     print(colored(f"[DEBUG] Applying vertical-only shaky effect: intensity={intensity}, frequency={frequency}", "yellow"))
     
@@ -93,6 +97,9 @@ def add_shaky_effect(clip, intensity=10, frequency=20):
     
     def apply_shake(get_frame, t):
         nonlocal current_offset_y, target_offset_y, last_change_time
+
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
         
         # Update target vertical position based on frequency
         if t - last_change_time >= 1.0 / frequency:
@@ -5,6 +5,7 @@ import random
 import httplib2
 
 from termcolor import colored
+from metrics import EXTERNAL_RETRIES, timed
 from oauth2client.file import Storage
 from apiclient.discovery import build
 from apiclient.errors import HttpError
@@ -135,6 +136,7 @@ def resumable_upload(insert_request: MediaFileUpload):
     error = None
     retry = 0
     while response is None:
+        error = None
         try:
             print(colored(" => Uploading file...", "magenta"))
             status, response = insert_request.next_chunk()
@@ -151,6 +153,7 @@ def resumable_upload(insert_request: MediaFileUpload):
 
         if error is not None:
             print(colored(error, "red"))
+            EXTERNAL_RETRIES.inc(service="youtube")
             retry += 1
             if retry > MAX_RETRIES:
                 raise Exception("No longer attempting to retry.")
@@ -160,6 +163,7 @@ def resumable_upload(insert_request: MediaFileUpload):
             print(colored(f" => Sleeping {sleep_seconds} seconds and then retrying...", "blue"))
             time.sleep(sleep_seconds)  
   
+@timed("upload_video")
 def upload_video(video_path, title, description, category, keywords, privacy_status):
     try:
         # Get the authenticated YouTube service
@@ -11,6 +11,9 @@ const cancelButton = document.querySelector("#cancelButton");
 
 const advancedOptionsToggle = document.querySelector("#advancedOptionsToggle");
 
+// Id of the task started by the last click on "Generate"
+let currentTaskId = null;
+
 advancedOptionsToggle.addEventListener("click", () => {
   // Change Emoji, from ▼ to ▲ and vice versa
   const emoji = advancedOptionsToggle.textContent;
@@ -27,6 +30,7 @@ const cancelGeneration = () => {
   // Send request to /cancel
   fetch("http://localhost:8080/api/cancel", {
     method: "POST",
+    body: JSON.stringify({ task_id: currentTaskId }),
     headers: {
       "Content-Type": "application/json",
       Accept: "application/json",
@@ -50,6 +54,37 @@ const cancelGeneration = () => {
   generateButton.classList.remove("hidden");
 };
 
+const resetButtons = () => {
+  generateButton.disabled = false;
+  generateButton.classList.remove("hidden");
+  cancelButton.classList.add("hidden");
+};
+
+// Follow a task over Server-Sent Events until it finishes
+const watchTask = (taskId) => {
+  const events = new EventSource(`http://localhost:8080/api/generate/events/${taskId}`);
+
+  events.addEventListener("stage", (event) => {
+    const stage = JSON.parse(event.data);
+    console.log(`Video ${stage.video}: ${stage.stage} ${stage.event}`);
+  });
+
+  events.addEventListener("progress", (event) => {
+    const progress = JSON.parse(event.data);
+    console.log(`Video ${progress.video}: ${progress.stage} ${progress.done}/${progress.total}`);
+  });
+
+  events.addEventListener("status", (event) => {
+    const task = JSON.parse(event.data);
+    console.log(task);
+    if (["success", "error", "cancelled"].includes(task.status)) {
+      events.close();
+      alert(task.message);
+      resetButtons();
+    }
+  });
+};
+
 const generateVideo = () => {
   console.log("Generating video...");
   // Disable button and change text
@@ -102,11 +137,14 @@ const generateVideo = () => {
     .then((response) => response.json())
     .then((data) => {
       console.log(data);
+      if (data.task_id) {
+        // Keep the cancel button until the task has finished
+        currentTaskId = data.task_id;
+        watchTask(data.task_id);
+        return;
+      }
       alert(data.message);
-      // Hide cancel button after generation is complete
-      generateButton.disabled = false;
-      generateButton.classList.remove("hidden");
-      cancelButton.classList.add("hidden");
+      resetButtons();
     })
     .catch((error) => {
       alert("An error occurred. Please try again later.");